@@ -0,0 +1,22 @@
+import sys
+import time
+from bluespecrepl import bsvproject
+from bluespecrepl.tests.fakemodule import make_synthetic_modules
+
+# Measures how get_complete_schedule scales on synthetic designs.
+# The designs are deep hierarchies where every module has a few rules that
+# call methods of its submodules, so no bsc or bluetcl is needed.
+# usage: python complete_schedule.py [depth] [rules_per_module]
+max_depth = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+rules_per_module = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+methods_per_module = 2
+submodules_per_module = 2
+
+print('%8s %10s %10s' % ('depth', 'rules', 'seconds'))
+for depth in range(2, max_depth + 1, 2):
+    proj = bsvproject.BSVProject('Top.bsv', 'mkLevel%d' % depth, v_path = [])
+    proj.modules = make_synthetic_modules(depth, rules_per_module, methods_per_module, submodules_per_module)
+    start = time.time()
+    schedule = proj.get_complete_schedule()
+    elapsed = time.time() - start
+    print('%8d %10d %10.3f' % (depth, len(schedule), elapsed))
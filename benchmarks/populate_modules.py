@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+from bluespecrepl import bsvproject
+
+# Compares reading module metadata from bluetcl with one bluetcl process
+# against reading it with a pool of bluetcl processes.
+# usage: python populate_modules.py [num_modules] [jobs]
+num_modules = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+jobs = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+rules_per_module = 10
+
+# setup build directory and cd to it
+build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', os.path.basename(__file__))
+os.makedirs(build_dir, exist_ok = True)
+os.chdir(build_dir)
+
+# create a design with many synthesized modules
+bsv = 'interface Counter;\n    method Bit#(32) value;\nendinterface\n'
+for i in range(num_modules):
+    bsv += '(* synthesize *)\nmodule mkCounter%d(Counter);\n' % i
+    bsv += '    Reg#(Bit#(32)) count <- mkReg(0);\n'
+    for j in range(rules_per_module):
+        bsv += '    rule incr%d(count[%d] == 1);\n        count <= count + %d;\n    endrule\n' % (j, j, j + 1)
+    bsv += '    method Bit#(32) value = count;\nendmodule\n'
+bsv += '(* synthesize *)\nmodule mkTop(Empty);\n'
+for i in range(num_modules):
+    bsv += '    Counter c%d <- mkCounter%d;\n' % (i, i)
+bsv += 'endmodule\n'
+with open('Top.bsv', 'w') as f:
+    f.write(bsv)
+
+proj = bsvproject.BSVProject('Top.bsv', 'mkTop')
+proj.compile_verilog()
+# always read the metadata from bluetcl
+proj.use_build_cache = False
+
+def populate(jobs):
+    proj.close()
+    start = time.time()
+    proj.populate_packages_and_modules(force = True, jobs = jobs)
+    return time.time() - start, proj.modules
+
+def summarize(modules):
+    return { name : (module.execution, module.method_calls_by_rule, module.interface.bsv_decl()) for name, module in modules.items() }
+
+sequential_time, sequential_modules = populate(1)
+parallel_time, parallel_modules = populate(jobs)
+if summarize(sequential_modules) != summarize(parallel_modules):
+    raise Exception('parallel metadata does not match sequential metadata')
+
+print('modules: %d' % len(sequential_modules))
+print('jobs = 1: %.2f s' % sequential_time)
+print('jobs = %d: %.2f s (%.2fx)' % (jobs, parallel_time, sequential_time / parallel_time))
+proj.close()
@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+from bluespecrepl import bsvproject
+
+# Compares the cycles per second of run_bsc_schedule with the native step
+# in the verilator wrapper against the step done from python.
+# usage: python step.py [num_cycles] [num_registers]
+num_cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+num_registers = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+# setup build directory and cd to it
+build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', os.path.basename(__file__))
+os.makedirs(build_dir, exist_ok = True)
+os.chdir(build_dir)
+
+# create a design with a rule per register
+bsv = '(* synthesize *)\nmodule mkTop(Empty);\n'
+for i in range(num_registers):
+    bsv += '    Reg#(Bit#(32)) count%d <- mkReg(0);\n' % i
+    bsv += '    rule incr%d;\n        count%d <= count%d + %d;\n    endrule\n' % (i, i, i, i + 1)
+bsv += 'endmodule\n'
+with open('Top.bsv', 'w') as f:
+    f.write(bsv)
+
+proj = bsvproject.BSVProject('Top.bsv', 'mkTop')
+sim = proj.gen_python_repl(scheduling_control = True)
+if sim._native_step is None:
+    raise Exception('the simulator does not have a native step')
+
+def run(use_native_step, n):
+    sim.use_native_step = use_native_step
+    start = time.time()
+    sim.run_bsc_schedule(n)
+    return n / (time.time() - start)
+
+# the python step is much slower, so it does fewer cycles
+python_rate = run(False, max(1, num_cycles // 100))
+native_rate = run(True, num_cycles)
+print('%-10s %15s' % ('step', 'cycles/s'))
+print('%-10s %15.0f' % ('python', python_rate))
+print('%-10s %15.0f' % ('native', native_rate))
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+from bluespecrepl import verilog_mutator
+
+# Measures how VerilogMutator scales with the number of rules in a module,
+# and compares it with TextVerilogMutator (the text column, which includes
+# reading, editing, and writing the module). The write column splices the
+# changes into the original source and the regenerate column formats the
+# whole AST.
+# The modules are generated in the style of bsc output, so no bsc is needed.
+# usage: python verilog_mutator.py [max_rules]
+max_rules = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+
+# setup build directory and cd to it
+build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', os.path.basename(__file__))
+os.makedirs(build_dir, exist_ok = True)
+os.chdir(build_dir)
+
+def write_module(filename, num_rules):
+    lines = ['module mkTest(CLK, RST_N, EN_go, RDY_go);',
+             '  input  CLK;', '  input  RST_N;', '  input  EN_go;', '  output RDY_go;',
+             '  wire RDY_go;', '  reg [31 : 0] count;', '  wire [31 : 0] count$D_IN;', '  wire count$EN;',
+             '  wire sub$EN_go, sub$RDY_go;']
+    for i in range(num_rules):
+        lines.append('  wire CAN_FIRE_RL_r%d, WILL_FIRE_RL_r%d;' % (i, i))
+    lines.append("  assign RDY_go = 1'd1 ;")
+    for i in range(num_rules):
+        lines.append('  assign CAN_FIRE_RL_r%d = count[%d] ;' % (i, i % 32))
+        lines.append('  assign WILL_FIRE_RL_r%d = CAN_FIRE_RL_r%d && !EN_go ;' % (i, i))
+    lines.append("  assign count$D_IN = count + 32'd1 ;")
+    lines.append("  assign count$EN = 1'd1 ;")
+    lines.append("  assign sub$EN_go = 1'd1 ;")
+    lines.append('  mkSub sub(.CLK(CLK), .RST_N(RST_N), .EN_go(sub$EN_go), .RDY_go(sub$RDY_go));')
+    lines.append('  always@(posedge CLK)')
+    lines.append('  begin')
+    lines.append('    if (count$EN) count <= count$D_IN;')
+    lines.append('  end')
+    lines.append('endmodule')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+print('%8s %8s %10s %10s %10s %10s %10s %10s' % ('rules', 'MB', 'parse', 'get_assign', 'expose', 'write', 'regenerate', 'text'))
+num_rules = 1000
+while num_rules <= max_rules:
+    write_module('mkTest.v', num_rules)
+    start = time.time()
+    mutator = verilog_mutator.VerilogMutator('mkTest.v')
+    parse_time = time.time() - start
+    start = time.time()
+    for i in range(num_rules):
+        mutator.get_assign('WILL_FIRE_RL_r%d' % i)
+    get_assign_time = time.time() - start
+    start = time.time()
+    mutator.expose_internal_scheduling_signals(num_rules_per_module = {'mkSub' : 10}, add_force_fire = True)
+    expose_time = time.time() - start
+    start = time.time()
+    mutator.write_verilog('mkTest_out.v', splice = True)
+    write_time = time.time() - start
+    start = time.time()
+    mutator.get_verilog()
+    regenerate_time = time.time() - start
+    start = time.time()
+    text_mutator = verilog_mutator.TextVerilogMutator('mkTest.v')
+    text_mutator.expose_internal_scheduling_signals(num_rules_per_module = {'mkSub' : 10}, add_force_fire = True)
+    text_mutator.write_verilog('mkTest_text.v')
+    text_time = time.time() - start
+    size = os.path.getsize('mkTest.v') / 1e6
+    print('%8d %8.2f %10.3f %10.3f %10.3f %10.3f %10.3f %10.3f' % (num_rules, size, parse_time, get_assign_time, expose_time, write_time, regenerate_time, text_time))
+    num_rules *= 2
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import subprocess
+from pyverilog.vparser.parser import VerilogCodeParser
+from bluespecrepl import verilog_mutator
+
+# Compares parsing many modules the way pyverilog does it by default (a new
+# parser and an iverilog process for each module) with the shared parser and
+# the batched preprocessing used by add_scheduling_signals.
+# The modules are generated in the style of bsc output, so no bsc is needed.
+# usage: python verilog_parser.py [num_modules]
+num_modules = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+# setup build directory and cd to it
+build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', os.path.basename(__file__))
+os.makedirs(build_dir, exist_ok = True)
+os.chdir(build_dir)
+
+filenames = []
+for i in range(num_modules):
+    filename = 'mkCounter%d.v' % i
+    with open(filename, 'w') as f:
+        f.write('module mkCounter%d(CLK, RST_N, RDY_value, value);\n' % i +
+                '  input  CLK;\n  input  RST_N;\n  output RDY_value;\n  output [31 : 0] value;\n' +
+                '  reg [31 : 0] count;\n  wire CAN_FIRE_RL_incr, WILL_FIRE_RL_incr;\n' +
+                "  assign RDY_value = 1'd1 ;\n  assign value = count ;\n" +
+                "  assign CAN_FIRE_RL_incr = 1'd1 ;\n  assign WILL_FIRE_RL_incr = 1'd1 ;\n" +
+                "  always@(posedge CLK)\n  begin\n    if (RST_N == 1'b0) count <= 32'd0;\n    else count <= count + 32'd1;\n  end\n" +
+                'endmodule\n')
+    filenames.append(filename)
+
+# time to construct the shared parser in a new process, with and without the PLY tables in verilog_parser_tables_dir
+startup_script = 'import time\nstart = time.time()\nfrom bluespecrepl import verilog_mutator\nverilog_mutator.get_verilog_parser()\nprint(time.time() - start)\n'
+tables_filename = os.path.join(verilog_mutator.verilog_parser_tables_dir, 'parser_tables_%s.pickle' % verilog_mutator.get_pyverilog_version())
+if os.path.exists(tables_filename):
+    os.remove(tables_filename)
+cold_startup_time = float(subprocess.check_output([sys.executable, '-c', startup_script]))
+warm_startup_time = float(subprocess.check_output([sys.executable, '-c', startup_script]))
+print('%-40s %10.3f' % ('process startup (no parser tables)', cold_startup_time))
+print('%-40s %10.3f' % ('process startup (saved parser tables)', warm_startup_time))
+
+start = time.time()
+for filename in filenames:
+    VerilogCodeParser([filename], preprocess_output = 'preprocess.output', preprocess_include = [], preprocess_define = []).parse()
+per_module_time = time.time() - start
+print('%-40s %10.3f' % ('parser and iverilog per module', per_module_time))
+
+start = time.time()
+for text in verilog_mutator.preprocess_verilog_files(filenames):
+    verilog_mutator.parse_verilog_text(text)
+shared_time = time.time() - start
+print('%-40s %10.3f' % ('shared parser and one iverilog', shared_time))
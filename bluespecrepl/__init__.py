@@ -2,6 +2,11 @@ from bluespecrepl.bluesim import Bluesim
 from bluespecrepl.bluetcl import Virtual, BlueTCL
 from bluespecrepl.bsvproject import BSVProject
 from bluespecrepl.bsvutil import add_line_macro
+from bluespecrepl.instancetable import InstanceTable
 from bluespecrepl.pyverilatorbsv import BSVInterfaceMethod, PyVerilatorBSV
+from bluespecrepl.rulegraph import RuleGraph
+from bluespecrepl.simstore import SimulatorStore
+from bluespecrepl.sweep import VariantBuild, build_variants
 from bluespecrepl.vcd import VCD
-from bluespecrepl.verilog_mutator import VerilogMutator
+from bluespecrepl.verilog_mutator import TextVerilogMutator, VerilogMutator
+from bluespecrepl.verilog_text_editor import UnsupportedVerilogError, VerilogTextEditor
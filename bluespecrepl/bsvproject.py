@@ -1,15 +1,53 @@
 import sys
 import os
+import copy
+import json
+import pickle
 import re
 import glob
+import heapq
 import subprocess
 import shutil
+import time
+import asyncio
 import warnings
+import functools
+import threading
+import concurrent.futures
 import tclwrapper
 from tclwrapper.tclutil import *
+import bluespecrepl.buildcache as buildcache
+import bluespecrepl.bsvutil as bsvutil
+import bluespecrepl.instancetable as instancetable
+import bluespecrepl.rulegraph as rulegraph
+import bluespecrepl.simstore as simstore
 import bluespecrepl.verilog_mutator as verilog_mutator
 import bluespecrepl.pyverilatorbsv as pyverilatorbsv
 
+async def run_command_async(command, output_callback = None):
+    """Runs command as an asyncio subprocess and returns its exit code.
+
+    Each line of the command's output (stdout and stderr combined) is passed to
+    output_callback without the trailing newline, or printed if output_callback
+    is None. If the calling task is cancelled, the subprocess is killed.
+    """
+    process = await asyncio.create_subprocess_exec(*command, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.STDOUT)
+    try:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            line = line.decode('utf-8', 'replace').rstrip('\n')
+            if output_callback is None:
+                print(line)
+            else:
+                output_callback(line)
+        return await process.wait()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
 class BSVProject:
     """Bluespec System Verilog Project class.
 
@@ -28,12 +66,30 @@ class BSVProject:
     sim_exe -- name for bluesim executable
     bsc_options -- list of additional command line arguments for bsc
     rts_options -- list of RTS command line arguments for bsc
+
+    Compilation results are tracked in a build manifest stored in build_dir.
+    If the BSV sources, bsc options, path, and bsc version have not changed
+    since the last successful compilation, bsc is not run again. The metadata
+    read from bluetcl by populate_packages_and_modules is cached in info_dir.
+    Set use_build_cache to False to always run bsc and bluetcl.
     """
 
     # paths that are always appended to the end of the user-specified paths
     default_paths = ['+']
     # automatically add these to self.bsc_options in the __init__ function
     default_bsc_options = ['-aggressive-conditions', '-keep-fires']
+    # name of the build manifest file within build_dir
+    build_manifest_name = 'bluespecrepl_manifest.json'
+    # name of the bluetcl metadata cache file within info_dir
+    metadata_cache_name = 'bluespecrepl_metadata.pickle'
+    # incremented whenever the classes stored in the metadata cache change
+    metadata_cache_version = 1
+    # name of the complete schedule cache file within info_dir
+    schedule_cache_name = 'bluespecrepl_schedule.json'
+    # name of the directory within info_dir with the parsed verilog used for scheduling control
+    verilog_ast_cache_name = 'bluespecrepl_verilog_ast_cache'
+    # name of the directory within info_dir with the bsc info files of the bluesim back end of compile_all
+    bluesim_info_dir_name = 'bluesim'
 
     def __init__(self, top_file = None, top_module = None, bsv_path = [], v_path = None, build_dir = 'build_dir', sim_dir = 'sim_dir', verilog_dir = 'verilog_dir', info_dir = 'info_dir', f_dir = '.', sim_exe = 'sim.out', bsc_options = [], rts_options = [], bspec_file = None):
         if bspec_file is not None:
@@ -67,6 +123,68 @@ class BSVProject:
         # stuctures that hold metadata obtained from bluetcl
         self.packages = None
         self.modules = None
+        # incremental build state
+        self.use_build_cache = True
+        self.build_manifests = {}
+        self.build_manifests_lock = threading.Lock()
+        # (out_folder, extra_bsc_args) of the last call to compile_verilog
+        self.last_verilog_build = None
+        # (key of the .ba files, self.modules) of the metadata used by get_complete_schedule_from_elaboration
+        self.elaboration_modules = None
+        # bluetcl session shared by the functions that query bluetcl
+        self.bluetcl_session = None
+        self.bluetcl_session_digest = None
+        self.bluetcl_packages = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # locks can't be pickled, and the manifests are reloaded from disk when needed
+        del state['build_manifests_lock']
+        state['build_manifests'] = {}
+        # the bluetcl process can't be shared, so the copy starts its own session
+        state['bluetcl_session'] = None
+        state['bluetcl_session_digest'] = None
+        state['bluetcl_packages'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.build_manifests_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def make_variant(self, variant_dir, extra_bsc_options = []):
+        """Returns a copy of this project that uses extra bsc options and writes all outputs to variant_dir.
+
+        The variant shares the sources of this project, but it has its own
+        build_dir, sim_dir, verilog_dir, info_dir, and sim_exe within
+        variant_dir, so several variants can be compiled at the same time.
+        """
+        variant = copy.copy(self)
+        variant.bsv_path = self.bsv_path.copy()
+        variant.v_path = self.v_path.copy()
+        variant.bsc_options = self.bsc_options + list(extra_bsc_options)
+        variant.rts_options = self.rts_options.copy()
+        variant.build_dir = os.path.join(variant_dir, 'build_dir')
+        variant.sim_dir = os.path.join(variant_dir, 'sim_dir')
+        variant.verilog_dir = os.path.join(variant_dir, 'verilog_dir')
+        variant.info_dir = os.path.join(variant_dir, 'info_dir')
+        variant.sim_exe = os.path.join(variant_dir, os.path.basename(self.sim_exe))
+        variant.packages = None
+        variant.modules = None
+        variant.last_verilog_build = None
+        variant.elaboration_modules = None
+        # the variant writes to its own build directories, so it keeps its own manifests
+        variant.build_manifests = {}
+        variant.build_manifests_lock = threading.Lock()
+        variant.bluetcl_session = None
+        variant.bluetcl_session_digest = None
+        variant.bluetcl_packages = None
+        return variant
 
     # command line argument formatting
     def get_dir_args(self, build_dir = None, sim_dir = None, verilog_dir = None, info_dir = None, f_dir = None):
@@ -90,11 +208,25 @@ class BSVProject:
                 '-info-dir', info_dir,
                 '-fdir', f_dir]
 
-    def get_path_arg(self):
+    def get_path_arg(self, build_dir = None):
         """Returns formatted bsc arguments for the path."""
+        if build_dir is None:
+            build_dir = self.build_dir
         # The bluespec compiler automatically adds build_dir to the front of the path, but bluetcl does not,
         # so we add it manually and get a warning from the bluespec compiler about redundant folders in the path
-        return ['-p', ':'.join([self.build_dir] + self.bsv_path + BSVProject.default_paths)]
+        return ['-p', ':'.join([build_dir] + self.bsv_path + BSVProject.default_paths)]
+
+    def get_search_dirs(self):
+        """Returns the directories searched for .bo and .ba files, in order."""
+        directories = []
+        for directory in [self.build_dir] + self.bsv_path + BSVProject.default_paths:
+            # expand the bsc path shorthands for the Bluespec libraries
+            if directory == '+':
+                directory = os.path.join('%', 'Libraries')
+            if directory.startswith('%'):
+                directory = os.environ.get('BLUESPECDIR', '') + directory[1:]
+            directories.append(directory)
+        return directories
 
     def get_sim_exe_out_arg(self):
         """Returns formatted bsc argument for the sim exe."""
@@ -103,47 +235,185 @@ class BSVProject:
             os.makedirs(dirname)
         return ['-o', self.sim_exe]
 
+    # build cache functions
+    def get_build_manifest(self, build_dir = None):
+        """Returns the BuildManifest for the builds writing to build_dir, loading it if necessary."""
+        if build_dir is None:
+            build_dir = self.build_dir
+        filename = os.path.join(build_dir, BSVProject.build_manifest_name)
+        with self.build_manifests_lock:
+            if filename not in self.build_manifests:
+                self.build_manifests[filename] = buildcache.BuildManifest(filename)
+            return self.build_manifests[filename]
+
+    def get_build_cache_stats(self):
+        """Returns a dict with the number of build cache hits and misses."""
+        self.get_build_manifest()
+        with self.build_manifests_lock:
+            stats = [manifest.get_stats() for manifest in self.build_manifests.values()]
+        return {'hits' : sum(x['hits'] for x in stats), 'misses' : sum(x['misses'] for x in stats)}
+
+    def get_bsv_sources(self):
+        """Returns the list of BSV source files that can be used by this project."""
+        directories = self.bsv_path + ['.', os.path.dirname(self.top_file) or '.']
+        sources = buildcache.find_bsv_sources(directories)
+        if os.path.normpath(self.top_file) not in sources:
+            sources.append(os.path.normpath(self.top_file))
+        return sources
+
+    def get_build_key(self, bsc_commands):
+        """Returns a hash of everything that affects the result of running bsc_commands."""
+        return buildcache.hash_data({
+            'sources' : { source : buildcache.hash_file(source) for source in self.get_bsv_sources() },
+            'commands' : bsc_commands,
+            'bsc_version' : buildcache.get_bsc_version() })
+
+    def _build_is_up_to_date(self, target, key, outputs, build_dir = None):
+        if not self.use_build_cache:
+            return False
+        return self.get_build_manifest(build_dir).is_up_to_date(target, key, outputs)
+
+    def _record_build(self, target, key, build_dir = None):
+        if not self.use_build_cache:
+            return
+        manifest = self.get_build_manifest(build_dir)
+        # every target writes .bo/.ba files to build_dir, so a successful build
+        # of one target makes the recorded state of the other targets stale
+        for other_target in list(manifest.targets):
+            if other_target != target:
+                manifest.targets.pop(other_target)
+        manifest.update(target, key)
+
     # compilation functions
-    def compile_verilog(self, out_folder = None, extra_bsc_args = []):
-        """Compiles the project to verilog.
+    def compile_packages(self, bsc_args, jobs):
+        """Compiles every user package imported by top_file, except for the top package itself.
 
-        If out_folder is specified, the verilog is written there. Otherwise the
-        verilog is written to the projects verilog_dir.
+        bsc_args is the list of bsc arguments placed before the package file
+        name. Packages are compiled with up to jobs concurrent bsc processes,
+        and a package is only compiled after all the packages it imports.
         """
+        graph = bsvutil.get_package_dependencies(self.top_file, self.bsv_path)
+        top_package = os.path.splitext(os.path.basename(self.top_file))[0]
+        remaining = { package : set(dependencies) for package, (_, dependencies) in graph.items() if package != top_package }
+        for dependencies in remaining.values():
+            dependencies.discard(top_package)
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as executor:
+            while len(remaining) != 0 or len(running) != 0:
+                ready = [package for package, dependencies in remaining.items() if len(dependencies) == 0]
+                for package in sorted(ready):
+                    del remaining[package]
+                    running[executor.submit(subprocess.call, bsc_args + [graph[package][0]])] = package
+                if len(running) == 0:
+                    raise Exception('Cyclic package imports found among: ' + ', '.join(sorted(remaining)))
+                done, _ = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    package = running.pop(future)
+                    if future.result() != 0:
+                        for other_future in running:
+                            other_future.cancel()
+                        raise Exception('Bluespec Compiler failed compilation of package ' + package)
+                    for dependencies in remaining.values():
+                        dependencies.discard(package)
+
+    def _get_verilog_build(self, out_folder = None, extra_bsc_args = []):
+        """Returns (bsc_args, bsc_command, key, outputs) for a verilog build."""
         # add the -elab flag to ensure .ba files are generated during compilation
         # .ba files are used by bluetcl to get information about the design
-        bsc_command = ['bsc', '-verilog', '-elab'] + self.bsc_options + extra_bsc_args + self.get_dir_args(verilog_dir = out_folder) + self.get_path_arg() + ['-g', self.top_module, '-u', self.top_file]
-        exit_code = subprocess.call(bsc_command)
-        if exit_code != 0:
-            raise Exception('Bluespec Compiler failed compilation')
+        bsc_args = ['bsc', '-verilog', '-elab'] + self.bsc_options + extra_bsc_args + self.get_dir_args(verilog_dir = out_folder) + self.get_path_arg()
+        bsc_command = bsc_args + ['-g', self.top_module, '-u', self.top_file]
+        key = self.get_build_key([bsc_command])
+        outputs = [os.path.join(out_folder if out_folder is not None else self.verilog_dir, self.top_module + '.v'),
+                   os.path.join(self.build_dir, self.top_module + '.ba')]
+        return bsc_args, bsc_command, key, outputs
+
+    def _get_bluesim_build(self, out_folder = None, extra_bsc_args = [], build_dir = None, info_dir = None):
+        """Returns (bsc_commands, key, outputs) for a bluesim build."""
+        dir_args = self.get_dir_args(build_dir = build_dir, sim_dir = out_folder, info_dir = info_dir)
+        compile_command = ['bsc', '-sim'] + self.bsc_options + extra_bsc_args + dir_args + self.get_path_arg(build_dir) + ['-g', self.top_module, '-u', self.top_file]
+        link_command = ['bsc', '-sim'] + self.bsc_options + extra_bsc_args + dir_args + self.get_path_arg(build_dir) + self.get_sim_exe_out_arg() + ['-e', self.top_module]
+        key = self.get_build_key([compile_command, link_command])
+        outputs = [self.sim_exe, os.path.join(out_folder if out_folder is not None else self.sim_dir, 'model_%s.cxx' % self.top_module)]
+        return [compile_command, link_command], key, outputs
+
+    def compile_verilog(self, out_folder = None, extra_bsc_args = [], force = False, jobs = 1):
+        """Compiles the project to verilog.
 
-    def compile_bluesim(self, out_folder = None, extra_bsc_args = []):
-        """Compiles the project to a bluesim executable.
+        If out_folder is specified, the verilog is written there. Otherwise the
+        verilog is written to the projects verilog_dir. If nothing changed since
+        the last compilation, bsc is not run unless force is True.
 
-        If out_folder is specified, the bluesim intermediate files are written
-        there. Otherwise the files are written to sim_dir.
+        If jobs is greater than 1, the packages imported by top_file are first
+        compiled concurrently following their import dependencies, and then the
+        top package is compiled and top_module is elaborated.
         """
-        bsc_command = ['bsc', '-sim'] + self.bsc_options + extra_bsc_args + self.get_dir_args(sim_dir = out_folder) + self.get_path_arg() + ['-g', self.top_module, '-u', self.top_file]
-        exit_code = subprocess.call(bsc_command)
-        if exit_code != 0:
-            raise Exception('Bluespec Compiler failed compilation')
-        bsc_command = ['bsc', '-sim'] + self.bsc_options + extra_bsc_args + self.get_dir_args(sim_dir = out_folder) + self.get_path_arg() + self.get_sim_exe_out_arg() + ['-e', self.top_module]
+        bsc_args, bsc_command, key, outputs = self._get_verilog_build(out_folder, extra_bsc_args)
+        self.last_verilog_build = (out_folder, list(extra_bsc_args))
+        if not force and self._build_is_up_to_date('verilog', key, outputs):
+            return
+        if jobs > 1:
+            self.compile_packages(bsc_args, jobs)
         exit_code = subprocess.call(bsc_command)
         if exit_code != 0:
             raise Exception('Bluespec Compiler failed compilation')
+        self._record_build('verilog', key)
 
-    def gen_python_repl(self, scheduling_control = False, verilator_dir = 'verilator_dir'):
-        """Compiles the project to a python BluespecREPL compatable verilator executable."""
-        extra_bsc_args = []
-        if scheduling_control:
-            extra_bsc_args.append('-no-opt-ATS')
-        self.compile_verilog(extra_bsc_args = extra_bsc_args)
-
-        # now get interface information
-        self.populate_packages_and_modules()
-
-        interface = [(hierarchy, method.to_dict()) for hierarchy, method in self.modules[self.top_module].interface.methods]
+    def compile_bluesim(self, out_folder = None, extra_bsc_args = [], force = False, build_dir = None, info_dir = None):
+        """Compiles the project to a bluesim executable.
 
+        If out_folder is specified, the bluesim intermediate files are written
+        there. Otherwise the files are written to sim_dir. If build_dir or
+        info_dir are specified, they are used instead of the project's
+        build_dir for .bo/.ba files and info_dir for bsc info files. If nothing
+        changed since the last compilation, bsc is not run unless force is True.
+        """
+        bsc_commands, key, outputs = self._get_bluesim_build(out_folder, extra_bsc_args, build_dir, info_dir)
+        if not force and self._build_is_up_to_date('bluesim', key, outputs, build_dir):
+            return
+        for bsc_command in bsc_commands:
+            exit_code = subprocess.call(bsc_command)
+            if exit_code != 0:
+                raise Exception('Bluespec Compiler failed compilation')
+        self._record_build('bluesim', key, build_dir)
+
+    def compile_all(self, extra_bsc_args = [], force = False):
+        """Compiles the project to verilog and to a bluesim executable concurrently.
+
+        bsc generates backend-specific .ba files while compiling each package,
+        so the two back ends can't share build_dir. The verilog back end uses
+        build_dir and the bluesim back end keeps its .bo/.ba files in sim_dir.
+        The two bsc runs would also race on the files in info_dir, so the
+        bluesim back end writes them to a bluesim directory within info_dir.
+
+        Returns a dictionary mapping 'verilog' and 'bluesim' to the time in
+        seconds taken by each back end.
+        """
+        # create all the output directories before starting the back ends
+        bluesim_info_dir = os.path.join(self.info_dir, BSVProject.bluesim_info_dir_name)
+        self.get_dir_args()
+        self.get_dir_args(info_dir = bluesim_info_dir)
+        self.get_sim_exe_out_arg()
+        def timed(compile_function, **kwargs):
+            start_time = time.perf_counter()
+            compile_function(extra_bsc_args = extra_bsc_args, force = force, **kwargs)
+            return time.perf_counter() - start_time
+        with concurrent.futures.ThreadPoolExecutor(max_workers = 2) as executor:
+            futures = {
+                'verilog' : executor.submit(timed, self.compile_verilog),
+                'bluesim' : executor.submit(timed, self.compile_bluesim, build_dir = self.sim_dir, info_dir = bluesim_info_dir) }
+            # wait for both back ends before raising any errors
+            concurrent.futures.wait(futures.values())
+            return { backend : future.result() for backend, future in futures.items() }
+
+    def prepare_verilator_verilog(self, scheduling_control = False, verilator_dir = 'verilator_dir', jobs = None):
+        """Copies the compiled verilog to verilator_dir, adding scheduling control signals if requested.
+
+        Returns a (verilog_files, rules) tuple where verilog_files is a
+        dictionary mapping module names to verilog files in verilator_dir and
+        rules is the list of rule names in the order of the scheduling control
+        signals of the top module. The scheduling control signals are added by
+        a pool of jobs worker processes (one per CPU if jobs is None).
+        """
         # copy verilog files to verilator dir
         verilator_verilog_files = {} # map from module name to verilog file
         if not os.path.exists(verilator_dir):
@@ -151,76 +421,288 @@ class BSVProject:
         for name in os.listdir(self.verilog_dir):
             base, extension = os.path.splitext(name)
             if extension.lower() == '.v':
-                shutil.copy(os.path.join(self.verilog_dir, name), os.path.join(verilator_dir, name))
+                if not (scheduling_control and extension == '.v'):
+                    # add_scheduling_signals writes these files itself and
+                    # skips the ones that are already up to date
+                    shutil.copy(os.path.join(self.verilog_dir, name), os.path.join(verilator_dir, name))
                 verilator_verilog_files[base] = os.path.join(verilator_dir, name)
 
-        verilog_file = os.path.join(verilator_dir, self.top_module + '.v')
         rules = []
         if scheduling_control:
             # modify the compiled verilog to add scheduling control signals
             # this is done hierarchically from the leaf modules to the top module
-            mutators = { module : verilog_mutator.VerilogMutator(module_verilog_file) for module, module_verilog_file in verilator_verilog_files.items() }
-            submodules = { module : mutator.get_submodules() for module, mutator in mutators.items() }
-            modules_to_mutate = list(verilator_verilog_files.keys())
-            num_rules_per_module = {}
-            rule_names_per_module = {}
-            while len(modules_to_mutate) != 0:
-                module_to_mutate = None
-                for module in modules_to_mutate:
-                    good_candidate = True
-                    for instance_name, instance_module in submodules[module]:
-                        if instance_module in modules_to_mutate:
-                            good_candidate = False
-                    if good_candidate:
-                        module_to_mutate = module
-                        break
-                if module_to_mutate is not None:
-                    mutator = mutators[module_to_mutate]
-                    num_rules = mutator.expose_internal_scheduling_signals(num_rules_per_module = num_rules_per_module)
-                    mutator.write_verilog(verilator_verilog_files[module])
-                    rules = mutator.get_rules_in_scheduling_order()
-                    num_rules_per_module[module_to_mutate] = num_rules
-                    # get list of rule names
-                    full_module_rule_names = []
-                    for sched_item in mutator.get_default_scheduling_order():
-                        if sched_item.startswith('RL_'):
-                            full_module_rule_names.append(sched_item)
-                        elif sched_item.startswith('MODULE_'):
-                            submodule_instance_name = sched_item[len('MODULE_'):]
-                            submodule_type = [y for x, y in submodules[module_to_mutate] if x == submodule_instance_name][0]
-                            if submodule_type not in rule_names_per_module:
-                                # this submodule has no known rules
-                                continue
-                            submodule_rule_names = [submodule_instance_name + '__DOT__' + x for x in rule_names_per_module[submodule_type]]
-                            full_module_rule_names += submodule_rule_names
-                        else:
-                            raise Exception('Unsupported scheuling item type')
-                    rule_names_per_module[module_to_mutate] = full_module_rule_names
-                    rule_order = mutator.get_default_scheduling_order()
-                    modules_to_mutate.remove(module_to_mutate)
-                else:
-                    raise Exception("Adding scheduling control failed. Can't find next module to mutate")
+            ast_cache_dir = None
+            if self.use_build_cache:
+                # unchanged modules don't have to be parsed or mutated again
+                ast_cache_dir = os.path.join(self.info_dir, BSVProject.verilog_ast_cache_name)
+            rule_names_per_module = verilog_mutator.add_scheduling_signals(self.verilog_dir, verilator_dir, jobs = jobs, ast_cache_dir = ast_cache_dir, use_cache = self.use_build_cache)
             # get rule names
             rules = rule_names_per_module[self.top_module]
 
-        return pyverilatorbsv.PyVerilatorBSV.build(
-                verilog_file,
-                verilog_path = [verilator_dir] + self.v_path,
+        return verilator_verilog_files, rules
+
+    def _get_verilator_build(self, scheduling_control, verilator_dir):
+        """Returns a dictionary describing the verilator build used by gen_python_repl."""
+        # now get interface information
+        self.populate_packages_and_modules()
+
+        interface = [(hierarchy, method.to_dict()) for hierarchy, method in self.modules[self.top_module].interface.methods]
+        verilator_verilog_files, rules = self.prepare_verilator_verilog(scheduling_control, verilator_dir)
+        verilog_path = [verilator_dir] + self.v_path
+        key = buildcache.hash_data({
+            'verilog' : { name : buildcache.hash_file(filename) for name, filename in verilator_verilog_files.items() },
+            'verilog_path' : verilog_path,
+            # verilator may pick up any of the library modules in v_path (e.g. the Bluespec Verilog directory)
+            'verilog_libraries' : { filename : buildcache.hash_file(filename) for filename in buildcache.find_verilog_sources(self.v_path) },
+            'bsc_version' : buildcache.get_bsc_version(),
+            'interface' : interface,
+            'rules' : rules,
+            'bsc_build_dir' : self.build_dir,
+            'verilator_version' : buildcache.get_verilator_version() })
+        return {
+            'verilog_file' : os.path.join(verilator_dir, self.top_module + '.v'),
+            'verilog_path' : verilog_path,
+            'verilator_dir' : verilator_dir,
+            'interface' : interface,
+            'rules' : rules,
+            'key' : key,
+            'so_file' : os.path.join(verilator_dir, 'V' + self.top_module) }
+
+    def _get_cached_verilator_build(self, build, force, simulator_store):
+        """Returns the so file of an existing build matching build, or None if it has to be built."""
+        if force:
+            return None
+        if self._build_is_up_to_date('verilator', build['key'], [build['so_file']], build['verilator_dir']):
+            return build['so_file']
+        if simulator_store is not None and simulator_store.get(build['key'], build['so_file']):
+            self._record_build('verilator', build['key'], build['verilator_dir'])
+            return build['so_file']
+        return None
+
+    def _record_verilator_build(self, build, simulator_store):
+        self._record_build('verilator', build['key'], build['verilator_dir'])
+        if simulator_store is not None:
+            json_data = pyverilatorbsv.PyVerilatorBSV.get_json_data(build['interface'], build['rules'], self.build_dir)
+            simulator_store.put(build['key'], build['so_file'], json_data)
+
+    def build_python_repl(self, scheduling_control = False, verilator_dir = 'verilator_dir', force = False, simulator_store = None):
+        """Builds the verilator executable used by gen_python_repl without loading it.
+
+        Returns the path of the verilator shared object, which can be loaded
+        with pyverilatorbsv.PyVerilatorBSV(so_file). See gen_python_repl for a
+        description of the arguments.
+        """
+        extra_bsc_args = []
+        if scheduling_control:
+            extra_bsc_args.append('-no-opt-ATS')
+        self.compile_verilog(extra_bsc_args = extra_bsc_args, force = force)
+
+        build = self._get_verilator_build(scheduling_control, verilator_dir)
+        if simulator_store is None:
+            simulator_store = simstore.SimulatorStore.from_environment()
+        so_file = self._get_cached_verilator_build(build, force, simulator_store)
+        if so_file is not None:
+            return so_file
+        # generate the verilator C++ model, then compile it
+        pyverilatorbsv.PyVerilatorBSV.build(
+                build['verilog_file'],
+                verilog_path = build['verilog_path'],
                 build_dir = verilator_dir,
-                interface = interface,
-                rules = rules,
+                interface = build['interface'],
+                rules = build['rules'],
+                gen_only = True,
                 bsc_build_dir = self.build_dir)
+        exit_code = subprocess.call(pyverilatorbsv.PyVerilatorBSV.get_make_command(build['verilog_file'], verilator_dir))
+        if exit_code != 0:
+            raise Exception('Compilation of the verilator model failed')
+        self._record_verilator_build(build, simulator_store)
+        return build['so_file']
+
+    def gen_python_repl(self, scheduling_control = False, verilator_dir = 'verilator_dir', force = False, simulator_store = None):
+        """Compiles the project to a python BluespecREPL compatable verilator executable.
+
+        If the verilog given to verilator, the rules, the interface, and the
+        verilator version all match the previous build in verilator_dir, the
+        existing verilator executable is loaded instead of being rebuilt
+        (unless force is True).
+
+        simulator_store is an optional SimulatorStore shared between projects
+        that is checked for an identical build before running verilator. If it
+        is None, the store named by $BLUESPECREPL_SIMULATOR_STORE is used if
+        that environment variable is set.
+        """
+        so_file = self.build_python_repl(scheduling_control, verilator_dir, force, simulator_store)
+        return pyverilatorbsv.PyVerilatorBSV(so_file)
+
+    # asynchronous compilation functions
+    async def compile_verilog_async(self, out_folder = None, extra_bsc_args = [], force = False, output_callback = None):
+        """Asynchronous version of compile_verilog.
+
+        Each line of bsc output is passed to output_callback (or printed if
+        output_callback is None). Cancelling the task kills bsc.
+        """
+        _, bsc_command, key, outputs = self._get_verilog_build(out_folder, extra_bsc_args)
+        self.last_verilog_build = (out_folder, list(extra_bsc_args))
+        if not force and self._build_is_up_to_date('verilog', key, outputs):
+            return
+        exit_code = await run_command_async(bsc_command, output_callback)
+        if exit_code != 0:
+            raise Exception('Bluespec Compiler failed compilation')
+        self._record_build('verilog', key)
+
+    async def compile_bluesim_async(self, out_folder = None, extra_bsc_args = [], force = False, build_dir = None, info_dir = None, output_callback = None):
+        """Asynchronous version of compile_bluesim.
+
+        Each line of bsc output is passed to output_callback (or printed if
+        output_callback is None). Cancelling the task kills bsc.
+        """
+        bsc_commands, key, outputs = self._get_bluesim_build(out_folder, extra_bsc_args, build_dir, info_dir)
+        if not force and self._build_is_up_to_date('bluesim', key, outputs, build_dir):
+            return
+        for bsc_command in bsc_commands:
+            exit_code = await run_command_async(bsc_command, output_callback)
+            if exit_code != 0:
+                raise Exception('Bluespec Compiler failed compilation')
+        self._record_build('bluesim', key, build_dir)
+
+    async def gen_python_repl_async(self, scheduling_control = False, verilator_dir = 'verilator_dir', force = False, simulator_store = None, output_callback = None):
+        """Asynchronous version of gen_python_repl.
+
+        The output of bsc and of the C++ compilation of the verilator model is
+        passed line by line to output_callback (or printed if output_callback
+        is None). Verilator itself is run by pyverilator, so its output is not
+        streamed. The bluetcl queries, verilog mutation, and verilator run
+        happen in the event loop's default executor. Cancelling the task kills
+        any running bsc or make process.
+        """
+        loop = asyncio.get_event_loop()
+        extra_bsc_args = []
+        if scheduling_control:
+            extra_bsc_args.append('-no-opt-ATS')
+        await self.compile_verilog_async(extra_bsc_args = extra_bsc_args, force = force, output_callback = output_callback)
+
+        build = await loop.run_in_executor(None, self._get_verilator_build, scheduling_control, verilator_dir)
+        if simulator_store is None:
+            simulator_store = simstore.SimulatorStore.from_environment()
+        so_file = await loop.run_in_executor(None, self._get_cached_verilator_build, build, force, simulator_store)
+        if so_file is None:
+            # generate the verilator C++ model, then compile it
+            await loop.run_in_executor(None, functools.partial(pyverilatorbsv.PyVerilatorBSV.build,
+                    build['verilog_file'],
+                    verilog_path = build['verilog_path'],
+                    build_dir = verilator_dir,
+                    interface = build['interface'],
+                    rules = build['rules'],
+                    gen_only = True,
+                    bsc_build_dir = self.build_dir))
+            make_command = pyverilatorbsv.PyVerilatorBSV.get_make_command(build['verilog_file'], verilator_dir)
+            exit_code = await run_command_async(make_command, output_callback)
+            if exit_code != 0:
+                raise Exception('Compilation of the verilator model failed')
+            so_file = build['so_file']
+            await loop.run_in_executor(None, self._record_verilator_build, build, simulator_store)
+        return await loop.run_in_executor(None, pyverilatorbsv.PyVerilatorBSV, so_file)
+
+    # bluetcl session functions
+    def get_build_dir_digest(self):
+        """Returns a digest of the names, sizes, and modification times of the .bo and .ba files in build_dir."""
+        entries = []
+        if os.path.isdir(self.build_dir):
+            for name in sorted(os.listdir(self.build_dir)):
+                if os.path.splitext(name)[1] in ['.bo', '.ba']:
+                    stat = os.stat(os.path.join(self.build_dir, name))
+                    entries.append((name, stat.st_size, stat.st_mtime_ns))
+        return buildcache.hash_data(entries)
+
+    def get_bluetcl(self):
+        """Returns the bluetcl session for this project, starting it if necessary.
+
+        The session is shared by all the functions that query bluetcl, so
+        bluetcl only has to start and load packages once. It is restarted
+        automatically when the .bo or .ba files in build_dir change. Call
+        close() to stop it."""
+        digest = self.get_build_dir_digest()
+        if self.bluetcl_session is not None and self.bluetcl_session_digest != digest:
+            # bluetcl has stale packages loaded
+            self.close()
+        if self.bluetcl_session is None:
+            bluetcl = tclwrapper.TCLWrapper('bluetcl')
+            bluetcl.start()
+            try:
+                bluetcl.eval('Bluetcl::flags set -verilog ' + ' '.join(self.get_path_arg()))
+            except:
+                bluetcl.stop()
+                raise
+            self.bluetcl_session = bluetcl
+            self.bluetcl_session_digest = digest
+            self.bluetcl_packages = None
+        return self.bluetcl_session
+
+    def get_bluetcl_packages(self):
+        """Loads the top package in the bluetcl session and returns the list of all loaded packages."""
+        bluetcl = self.get_bluetcl()
+        if self.bluetcl_packages is None:
+            bluetcl.eval('Bluetcl::bpackage load %s' % os.path.basename(self.top_file).split('.')[0])
+            self.bluetcl_packages = bluetcl.eval('Bluetcl::bpackage list', to_list = True)
+        return self.bluetcl_packages
+
+    def close(self):
+        """Stops the bluetcl session of this project, if there is one."""
+        if self.bluetcl_session is not None:
+            self.bluetcl_session.stop()
+        self.bluetcl_session = None
+        self.bluetcl_session_digest = None
+        self.bluetcl_packages = None
+
+    # metadata cache functions
+    def get_artifact_hash(self, name, extension, search_dirs = None):
+        """Returns the hash of the first name + extension file found in search_dirs, or None if there isn't one."""
+        if search_dirs is None:
+            search_dirs = self.get_search_dirs()
+        for directory in search_dirs:
+            filename = os.path.join(directory, name + extension)
+            if os.path.isfile(filename):
+                return buildcache.hash_file(filename)
+        return None
+
+    def _load_metadata_cache(self, search_dirs):
+        filename = os.path.join(self.info_dir, BSVProject.metadata_cache_name)
+        try:
+            with open(filename, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception:
+            # missing or corrupted caches are treated as empty
+            return {}, {}
+        if cache.get('version') != BSVProject.metadata_cache_version or cache.get('search_dirs') != search_dirs:
+            return {}, {}
+        return cache['packages'], cache['modules']
+
+    def _write_metadata_cache(self, search_dirs, packages, modules):
+        if not os.path.exists(self.info_dir):
+            os.makedirs(self.info_dir, exist_ok = True)
+        cache = {
+                'version' : BSVProject.metadata_cache_version,
+                'search_dirs' : search_dirs,
+                'packages' : packages,
+                'modules' : modules }
+        filename = os.path.join(self.info_dir, BSVProject.metadata_cache_name)
+        # write to a temporary file first so an interrupted write doesn't corrupt the cache
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
 
     def clean(self):
         """Deletes output from project compilation."""
+        self.close()
         cleaning_targets = [
                 (self.build_dir, ['.ba', '.bo']),
-                (self.sim_dir, ['.cxx', '.h', '.o']),
+                (self.sim_dir, ['.cxx', '.h', '.o', '.ba', '.bo']),
                 (self.verilog_dir, ['.v']),
                 (self.info_dir, [])]
         # This function should delete:
         #   *.ba, *.bo from build_dir
-        #   *.cxx, *.h, *.o from sim_dir
+        #   *.cxx, *.h, *.o from sim_dir (and *.ba, *.bo from compile_all)
         #   *.v from verilog_dir
         #   ? from info_dir
         #   sim_exe
@@ -238,6 +720,29 @@ class BSVProject:
         except OSError:
             # ignore errors
             pass
+        for name in [BSVProject.metadata_cache_name, BSVProject.schedule_cache_name]:
+            try:
+                os.remove(os.path.join(self.info_dir, name))
+            except OSError:
+                # ignore errors
+                pass
+        shutil.rmtree(os.path.join(self.info_dir, BSVProject.verilog_ast_cache_name), ignore_errors = True)
+        shutil.rmtree(os.path.join(self.info_dir, BSVProject.bluesim_info_dir_name), ignore_errors = True)
+        try:
+            os.rmdir(self.info_dir)
+        except OSError:
+            # ignore errors
+            pass
+        # the build manifests would otherwise claim the deleted outputs are up to date
+        for path in [self.build_dir, self.sim_dir]:
+            try:
+                os.remove(os.path.join(path, BSVProject.build_manifest_name))
+                os.rmdir(path)
+            except OSError:
+                # ignore errors
+                pass
+        with self.build_manifests_lock:
+            self.build_manifests = {}
 
     # import/export methods
     def import_bspec_project_file(self, filename):
@@ -314,33 +819,108 @@ class BSVProject:
         params['COMP_RTS_OPTIONS'] = ' '.join(self.rts_options)
         return params
 
-    def populate_packages_and_modules(self, force = False):
+    def populate_packages_and_modules(self, force = False, jobs = 1):
         """Populates self.packages and self.modules members using information from bluetcl.
 
         self.packages is a dictionary mapping package names to BluespecPackage objects.
         self.modules is a dictionary mapping module names to BluespecModule objects.
         If self.packages and self.modules have already been filled, this function does
-        nothing unless force is True."""
+        nothing unless force is True.
+
+        The results are cached in info_dir along with the hashes of the .bo and
+        .ba files they were read from. Later calls, even from other python
+        processes, only query bluetcl for the packages and modules whose files
+        changed, and don't start bluetcl at all if nothing changed.
+
+        If jobs is greater than 1, the module metadata is read by up to jobs
+        bluetcl processes in parallel. The result is the same as with jobs = 1."""
         if not force and self.packages is not None and self.modules is not None:
             # nothing to do
             return
         if not os.path.isfile(os.path.join(self.build_dir, self.top_module + '.ba')):
             raise Exception("top file not elaborated: either you forgot to build the design or the top module doesn't have a (* synthesize *) attribute")
-        with tclwrapper.TCLWrapper('bluetcl') as bluetcl:
-            bluetcl.eval('Bluetcl::flags set -verilog ' + ' '.join(self.get_path_arg()))
-            # load top package
-            bluetcl.eval('Bluetcl::bpackage load %s' % os.path.basename(self.top_file).split('.')[0])
-            # list all packages
-            packages = bluetcl.eval('Bluetcl::bpackage list', to_list = True)
-
-            if force or self.packages is None:
-                self.packages = { pkg_name : BluespecPackage(pkg_name, bluetcl) for pkg_name in packages}
-            if force or self.modules is None:
-                self.modules = {}
-                for package_name in self.packages:
-                    for module in self.packages[package_name].modules:
-                        if module not in self.modules:
-                            self.modules[module] = BluespecModule(module, bluetcl)
+        search_dirs = self.get_search_dirs()
+        # cached_packages maps package names to (key, BluespecPackage) tuples
+        # cached_modules maps module names to (package name, key, BluespecModule) tuples
+        cached_packages, cached_modules = {}, {}
+        if self.use_build_cache and not force:
+            cached_packages, cached_modules = self._load_metadata_cache(search_dirs)
+
+        hashes = {}
+        def get_key(name, extension):
+            if (name, extension) not in hashes:
+                hashes[(name, extension)] = self.get_artifact_hash(name.split('::')[-1], extension, search_dirs)
+            return hashes[(name, extension)]
+        def get_module_key(module, package_name):
+            # modules without a .ba file are described by their package's .bo file
+            return (get_key(package_name, '.bo'), get_key(module, '.ba'))
+
+        top_package = os.path.basename(self.top_file).split('.')[0]
+        if (top_package in cached_packages
+                and all(get_key(name, '.bo') == key for name, (key, _) in cached_packages.items())
+                and all(get_module_key(name, package_name) == key for name, (package_name, key, _) in cached_modules.items())):
+            # the imported packages are recorded in the .bo files, so the set of packages can't have changed either
+            self.packages = { name : package for name, (_, package) in cached_packages.items() }
+            self.modules = { name : module for name, (_, _, module) in cached_modules.items() }
+            return
+
+        bluetcl = self.get_bluetcl()
+        # load the top package and list all packages
+        packages = self.get_bluetcl_packages()
+
+        if force or self.packages is None:
+            stale_packages = [ pkg_name for pkg_name in packages if pkg_name not in cached_packages or cached_packages[pkg_name][0] != get_key(pkg_name, '.bo') ]
+            # read the metadata for all the stale packages at once
+            replay = BluetclReplay.from_bluetcl(bluetcl, packages = stale_packages)
+            self.packages = {}
+            for pkg_name in packages:
+                if pkg_name in stale_packages:
+                    self.packages[pkg_name] = BluespecPackage(pkg_name, replay)
+                else:
+                    self.packages[pkg_name] = cached_packages[pkg_name][1]
+        # the first package listing each module is the one that defines it
+        module_packages = {}
+        for package_name in self.packages:
+            for module in self.packages[package_name].modules:
+                if module not in module_packages:
+                    module_packages[module] = package_name
+        if force or self.modules is None:
+            stale_modules = [ module for module, package_name in module_packages.items() if module not in cached_modules or cached_modules[module][1] != get_module_key(module, package_name) ]
+            stale_module_metadata = self._read_module_metadata(stale_modules, jobs)
+            self.modules = {}
+            for module in module_packages:
+                if module in stale_module_metadata:
+                    self.modules[module] = stale_module_metadata[module]
+                else:
+                    self.modules[module] = cached_modules[module][2]
+
+        if self.use_build_cache:
+            self._write_metadata_cache(search_dirs,
+                    { name : (get_key(name, '.bo'), package) for name, package in self.packages.items() },
+                    { name : (module_packages[name], get_module_key(name, module_packages[name]), module) for name, module in self.modules.items() })
+
+    def _read_module_metadata(self, modules, jobs = 1):
+        """Returns a dictionary mapping each module in modules to a BluespecModule read from bluetcl."""
+        if jobs <= 1 or len(modules) <= 1:
+            # read the metadata for all the modules at once
+            replay = BluetclReplay.from_bluetcl(self.get_bluetcl(), modules = modules)
+            return { module : BluespecModule(module, replay) for module in modules }
+        top_package = os.path.basename(self.top_file).split('.')[0]
+        def read_modules(worker_modules):
+            # each worker has its own bluetcl process reading from the same build_dir
+            with tclwrapper.TCLWrapper('bluetcl') as bluetcl:
+                bluetcl.eval('Bluetcl::flags set -verilog ' + ' '.join(self.get_path_arg()))
+                bluetcl.eval('Bluetcl::bpackage load %s' % top_package)
+                replay = BluetclReplay.from_bluetcl(bluetcl, modules = worker_modules)
+                return { module : BluespecModule(module, replay) for module in worker_modules }
+        # deal the modules out round-robin so large modules are spread across the workers
+        worker_modules = [ modules[i::jobs] for i in range(min(jobs, len(modules))) ]
+        metadata = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers = len(worker_modules)) as executor:
+            for worker_metadata in executor.map(read_modules, worker_modules):
+                metadata.update(worker_metadata)
+        # merge in the same order as the sequential path
+        return { module : metadata[module] for module in modules }
 
     # Advanced Functions
     #####################
@@ -350,24 +930,22 @@ class BSVProject:
         The dictionary has module names as keys and lists of (instance_name, module_name) tuples as values."""
 
         submodule_dict = {}
-        with tclwrapper.TCLWrapper('bluetcl') as bluetcl:
-            bluetcl.eval('Bluetcl::flags set -verilog ' + ' '.join(self.get_path_arg()))
-            bluetcl.eval('Bluetcl::bpackage load %s' % os.path.basename(self.top_file).split('.')[0])
-            packages = bluetcl.eval('Bluetcl::bpackage list', to_list = True)
-
-            # "Bluetcl::defs module <pkg>" returns modules with package names as well,
-            # but "Bluetcl::module submods <mod>" doesn't accept package names, so they should be stripped
-            modules = [mod.split('::')[-1] for pkg in packages for mod in bluetcl.eval('Bluetcl::defs module %s' % pkg, to_list = True)]
-            uniq_modules = []
-            for mod in modules:
-                if mod not in uniq_modules:
-                    uniq_modules.append(mod)
-            for module in uniq_modules:
-                bluetcl.eval('Bluetcl::module load %s' % module)
-                user_or_prim, submodules, functions = tclstring_to_list(bluetcl.eval('Bluetcl::module submods %s' % module))
-                submodules = tclstring_to_nested_list(submodules, levels = 2)
-                if user_or_prim == 'user':
-                    submodule_dict[module] = submodules
+        bluetcl = self.get_bluetcl()
+        packages = self.get_bluetcl_packages()
+
+        # "Bluetcl::defs module <pkg>" returns modules with package names as well,
+        # but "Bluetcl::module submods <mod>" doesn't accept package names, so they should be stripped
+        modules = [mod.split('::')[-1] for pkg in packages for mod in bluetcl.eval('Bluetcl::defs module %s' % pkg, to_list = True)]
+        uniq_modules = []
+        for mod in modules:
+            if mod not in uniq_modules:
+                uniq_modules.append(mod)
+        for module in uniq_modules:
+            bluetcl.eval('Bluetcl::module load %s' % module)
+            user_or_prim, submodules, functions = tclstring_to_list(bluetcl.eval('Bluetcl::module submods %s' % module))
+            submodules = tclstring_to_nested_list(submodules, levels = 2)
+            if user_or_prim == 'user':
+                submodule_dict[module] = submodules
         return submodule_dict
 
     def get_rule_method_calls(self):
@@ -376,63 +954,72 @@ class BSVProject:
         The dictionary contains a list of (rule, methods) tuples in execution order."""
 
         rule_method_call_dict = {}
-        with tclwrapper.TCLWrapper('bluetcl') as bluetcl:
-            bluetcl.eval('Bluetcl::flags set -verilog ' + ' '.join(self.get_path_arg()))
-            bluetcl.eval('Bluetcl::bpackage load %s' % os.path.basename(self.top_file).split('.')[0])
-            packages = bluetcl.eval('Bluetcl::bpackage list', to_list = True)
-
-            # "Bluetcl::defs module <pkg>" returns modules with package names as well,
-            # but "Bluetcl::module submods <mod>" doesn't accept package names, so they should be stripped
-            modules = [mod.split('::')[-1] for pkg in packages for mod in bluetcl.eval('Bluetcl::defs module %s' % pkg, to_list = True)]
-            uniq_modules = []
-            for mod in modules:
-                if mod not in uniq_modules:
-                    uniq_modules.append(mod)
-            for module in uniq_modules:
-                bluetcl.eval('Bluetcl::module load %s' % module)
-                execution_order = tclstring_to_list(bluetcl.eval('Bluetcl::schedule execution %s' % module))
-                rule_method_call_dict[module] = []
-                for rule in execution_order:
-                    rule_info = tclstring_to_list(bluetcl.eval('Bluetcl::rule full %s %s' % (module, rule)))
-                    # look for item that has 'methods' as its first element
-                    # assume its always the 3rd element
-                    if not rule_info[3].startswith('methods'):
-                        raise Exception('method is expected to be the 3rd element from "Bluetcl::rule full <mod> <rule>"')
-                    methods_tclstring = tclstring_to_list(rule_info[3])
-                    method_calls = tclstring_to_flat_list(methods_tclstring)
-                    rule_method_call_dict[module].append((rule, method_calls))
+        bluetcl = self.get_bluetcl()
+        packages = self.get_bluetcl_packages()
+
+        # "Bluetcl::defs module <pkg>" returns modules with package names as well,
+        # but "Bluetcl::module submods <mod>" doesn't accept package names, so they should be stripped
+        modules = [mod.split('::')[-1] for pkg in packages for mod in bluetcl.eval('Bluetcl::defs module %s' % pkg, to_list = True)]
+        uniq_modules = []
+        for mod in modules:
+            if mod not in uniq_modules:
+                uniq_modules.append(mod)
+        for module in uniq_modules:
+            bluetcl.eval('Bluetcl::module load %s' % module)
+            execution_order = tclstring_to_list(bluetcl.eval('Bluetcl::schedule execution %s' % module))
+            rule_method_call_dict[module] = []
+            for rule in execution_order:
+                rule_info = tclstring_to_list(bluetcl.eval('Bluetcl::rule full %s %s' % (module, rule)))
+                # look for item that has 'methods' as its first element
+                # assume its always the 3rd element
+                if not rule_info[3].startswith('methods'):
+                    raise Exception('method is expected to be the 3rd element from "Bluetcl::rule full <mod> <rule>"')
+                methods_tclstring = tclstring_to_list(rule_info[3])
+                method_calls = tclstring_to_flat_list(methods_tclstring)
+                rule_method_call_dict[module].append((rule, method_calls))
         return rule_method_call_dict
 
     def get_hierarchy(self, module_name = None):
+        """Returns a dictionary mapping each module below module_name (top_module by default) to its submodules.
+
+        The submodules are lists of (instance_name, module_name) tuples. Modules
+        that can't be loaded by bluetcl, such as primitives, map to None."""
         if module_name is None:
             module_name = self.top_module
         hierarchy = {}
         modules_to_add = [module_name]
-        with tclwrapper.TCLWrapper('bluetcl') as bluetcl:
-            bluetcl.eval('Bluetcl::flags set -verilog ' + ' '.join(self.get_path_arg()))
-            while len(modules_to_add) > 0:
-                curr_module_name = modules_to_add.pop()
-                try:
-                    bluetcl.eval('Bluetcl::module load ' + curr_module_name)
-                    hierarchy[curr_module_name] = []
-                    user_or_prim, submodules, functions = tclstring_to_nested_list(bluetcl.eval('Bluetcl::module submods ' + curr_module_name))
-                    if user_or_prim == 'user':
-                        for instance_name, submodule_name in submodules:
-                            if submodule_name not in hierarchy and submodule_name not in modules_to_add:
-                                modules_to_add.append(submodule_name)
-                            hierarchy[curr_module_name].append((instance_name, submodule_name))
-                except tclwrapper.TCLWrapperError as e:
-                    # couldn't load modules, typically the case for primitive modules such as FIFOs
-                    hierarchy[curr_module_name] = None
+        # set of modules in hierarchy or modules_to_add for fast membership tests
+        seen_modules = {module_name}
+        bluetcl = self.get_bluetcl()
+        while len(modules_to_add) > 0:
+            curr_module_name = modules_to_add.pop()
+            try:
+                bluetcl.eval('Bluetcl::module load ' + curr_module_name)
+                hierarchy[curr_module_name] = []
+                user_or_prim, submodules, functions = tclstring_to_nested_list(bluetcl.eval('Bluetcl::module submods ' + curr_module_name))
+                if user_or_prim == 'user':
+                    for instance_name, submodule_name in submodules:
+                        if submodule_name not in seen_modules:
+                            seen_modules.add(submodule_name)
+                            modules_to_add.append(submodule_name)
+                        hierarchy[curr_module_name].append((instance_name, submodule_name))
+            except tclwrapper.TCLWrapperError as e:
+                # couldn't load modules, typically the case for primitive modules such as FIFOs
+                hierarchy[curr_module_name] = None
         return hierarchy
 
+    def get_instance_table(self, module_name = None):
+        """Returns an InstanceTable of all the instances below module_name (top_module by default)."""
+        if module_name is None:
+            module_name = self.top_module
+        return instancetable.InstanceTable(self.get_hierarchy(module_name), module_name)
+
     def get_module_schedule(self, module_name = None):
         if module_name is None:
             module_name = self.top_module
-        with tclwrapper.TCLWrapper('bluetcl') as bluetcl:
-            bluetcl.eval('Bluetcl::flags set -verilog ' + ' '.join(self.get_path_arg()))
-            bluetcl.eval('Bluetcl::module load ' + module_name)
-            return tclstring_to_list(bluetcl.eval('Bluetcl::schedule execution ' + module_name))
+        bluetcl = self.get_bluetcl()
+        bluetcl.eval('Bluetcl::module load ' + module_name)
+        return tclstring_to_list(bluetcl.eval('Bluetcl::schedule execution ' + module_name))
 
     def get_complete_schedule_from_bluesim(self):
         """Returns the complete schedule for the top module.
@@ -477,6 +1064,67 @@ class BSVProject:
                 line = f.readline()
         return complete_schedule
 
+    def get_rule_graph(self, module_name = None):
+        """Returns a RuleGraph of the rules and methods of every instance below module_name (top_module by default)."""
+        if self.modules is None:
+            self.populate_packages_and_modules()
+        if module_name is None:
+            module_name = self.top_module
+        return rulegraph.RuleGraph(self.modules, module_name)
+
+    def get_complete_schedule_from_elaboration(self):
+        """Returns the complete schedule for the top module without compiling for bluesim.
+
+        The schedule has the same format as get_complete_schedule_from_bluesim,
+        a list of rule names with their instance hierarchy as tuples, but it is
+        computed by get_complete_schedule from the elaborated design. The
+        result is cached in info_dir until the .ba files in build_dir change.
+
+        The design is brought up to date with the same options as the last
+        call to compile_verilog, so the verilator build isn't invalidated. If
+        compile_verilog wasn't called yet, the existing .ba files are used, and
+        the design is only compiled with the default options if there are none.
+        """
+        if self.last_verilog_build is not None:
+            out_folder, extra_bsc_args = self.last_verilog_build
+            self.compile_verilog(out_folder, extra_bsc_args)
+        elif not os.path.isfile(os.path.join(self.build_dir, self.top_module + '.ba')):
+            self.compile_verilog()
+        ba_files = sorted(glob.glob(os.path.join(self.build_dir, '*.ba')))
+        key = buildcache.hash_data({ os.path.basename(x) : buildcache.hash_file(x) for x in ba_files })
+        cache_file = os.path.join(self.info_dir, BSVProject.schedule_cache_name)
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+            if cache['top_module'] == self.top_module and cache['key'] == key:
+                return [ tuple(x) for x in cache['schedule'] ]
+        except (OSError, ValueError, KeyError):
+            # missing or corrupted caches are treated as empty
+            pass
+
+        # the metadata in memory may be older than the .ba files, the metadata cache on disk is checked against them
+        # it is only read again if the .ba files changed or self.modules was replaced since the last call
+        if self.elaboration_modules is None or self.elaboration_modules[0] != key or self.elaboration_modules[1] is not self.modules:
+            self.packages = None
+            self.modules = None
+            self.populate_packages_and_modules()
+            self.elaboration_modules = (key, self.modules)
+        complete_schedule = []
+        for full_name in self.get_complete_schedule():
+            # remove the top module from the hierarchy like bluesim does
+            hierarchy = tuple(full_name.split('.')[1:])
+            # bluesim only schedules rules, top-level methods are called from outside
+            if hierarchy[-1].startswith('RL_'):
+                complete_schedule.append(hierarchy)
+
+        if not os.path.exists(self.info_dir):
+            os.makedirs(self.info_dir, exist_ok = True)
+        tmp_cache_file = cache_file + '.tmp'
+        with open(tmp_cache_file, 'w') as f:
+            json.dump({'top_module' : self.top_module, 'key' : key, 'schedule' : complete_schedule}, f)
+        os.replace(tmp_cache_file, cache_file)
+        return complete_schedule
+
     def get_complete_schedule(self, module_name = None):
         """Returns the complete schedule for the top module.
 
@@ -491,21 +1139,16 @@ class BSVProject:
         if module_name is None:
             module_name = self.top_module
 
+        instances = instancetable.InstanceTable({ name : module.submodules for name, module in self.modules.items() }, module_name)
         instance_dict = {}
-        worklist = [ (module_name, self.modules[module_name]) ]
-        while len(worklist) != 0:
-            instance_name, module = worklist.pop()
-            instance_dict[instance_name] = module
-            for submodule_instance, submodule_type in module.submodules:
-                if submodule_type in self.modules:
-                    worklist.append((instance_name + '.' + submodule_instance, self.modules[submodule_type]))
-
-        partial_order = {}
+        for instance_id, instance_name in instances.iter_paths():
+            module_type = instances.get_module(instance_id)
+            # instances of modules without metadata (e.g. primitives) have no rules
+            if module_type in self.modules:
+                instance_dict[instance_name] = self.modules[module_type]
+
         called_methods = {} # list of rules (and methods) that call a given method
         for instance_name, module in instance_dict.items():
-            # add execution to partial order
-            for i in range(len(module.execution)):
-                partial_order[instance_name + '.' + module.execution[i]] = [instance_name + '.' + x for x in module.execution[i+1:]]
             # add method calls to partial order
             # get list of rules that call each method
             for rule, methods in module.method_calls_by_rule.items():
@@ -523,58 +1166,72 @@ class BSVProject:
                     if rule not in called_methods:
                         called_methods[rule] = []
         # the items in called_methods are a list of rules and methods, this function helps to get just rules
-        # similar to taking the transitive closure of called_methods
+        # similar to taking the transitive closure of called_methods, but each result is only computed once
+        rules_from_rule_or_method = {}
         def get_rules_from_rule_or_method(x):
-            if x not in called_methods:
-                # x is a rule or top-level method
-                return [x]
-            rules = [get_rules_from_rule_or_method(y) for y in called_methods[x]]
-            rules = sum(rules, []) # flatten rules
-            return list(set(rules))
-        # create a new partial order that doesn't contain called methods
-        new_partial_order = {}
-        for first_rule, second_rules in partial_order.items():
-            actual_first_rules = get_rules_from_rule_or_method(first_rule)
-
-            actual_second_rules = []
-            for second_rule in second_rules:
-                actual_second_rules += get_rules_from_rule_or_method(second_rule)
-
-            for r1 in actual_first_rules:
-                if r1 not in new_partial_order:
-                    new_partial_order[r1] = actual_second_rules
+            if x not in rules_from_rule_or_method:
+                if x not in called_methods:
+                    # x is a rule or top-level method
+                    rules_from_rule_or_method[x] = [x]
                 else:
-                    new_partial_order[r1] += actual_second_rules
-        # cleanup new_partial_order
-        for first_rule in new_partial_order:
-            new_partial_order[first_rule] = list(set(new_partial_order[first_rule]))
-            while new_partial_order[first_rule].count(first_rule) > 0:
-                new_partial_order[first_rule].remove(first_rule)
-        partial_order = new_partial_order.copy()
-
+                    # dict keys are used as an ordered set
+                    rules = {}
+                    for y in called_methods[x]:
+                        for rule in get_rules_from_rule_or_method(y):
+                            rules[rule] = None
+                    rules_from_rule_or_method[x] = list(rules)
+            return rules_from_rule_or_method[x]
+
+        # build the partial order between rules, with called methods replaced by the rules that call them
+        # within an instance, each item in the execution order comes before every item after it, so it
+        # is enough to add edges to the next item that has rules, the rest of the order is implied
+        successors = {}
+        for instance_name, module in instance_dict.items():
+            previous_rules = []
+            for item in module.execution:
+                rules = get_rules_from_rule_or_method(instance_name + '.' + item)
+                if len(rules) == 0:
+                    continue
+                for rule in rules:
+                    if rule not in successors:
+                        successors[rule] = set()
+                for first_rule in previous_rules:
+                    successors[first_rule].update(rules)
+                previous_rules = rules
+        predecessors = { rule : [] for rule in successors }
+        num_successors = {}
+        for first_rule, second_rules in successors.items():
+            second_rules.discard(first_rule)
+            num_successors[first_rule] = len(second_rules)
+            for second_rule in second_rules:
+                predecessors[second_rule].append(first_rule)
+
+        # schedule rules from end to beginning (Kahn's algorithm on the reversed partial order)
+        # when there is a choice, the rule added to the partial order last is scheduled last
+        rules = list(successors)
+        rule_ids = { rule : i for i, rule in enumerate(rules) }
+        candidates = [ -rule_ids[rule] for rule in rules if num_successors[rule] == 0 ]
+        heapq.heapify(candidates)
         full_schedule = []
-        to_schedule = set(partial_order.keys())
-        # schedule rules from end to beginning
-        while len(to_schedule) > 0:
-            removed_candidate = False
-            for candidate in to_schedule:
-                if len(partial_order[candidate]) == 0:
-                    to_schedule.remove(candidate)
-                    full_schedule = [candidate] + full_schedule
-                    # remove candidate from all the partial orders
-                    for x in partial_order:
-                        while partial_order[x].count(candidate) > 0:
-                            partial_order[x].remove(candidate)
-                    removed_candidate = True
-                    break
-            if not removed_candidate:
-                raise Exception("getting the full schedule failed")
+        while len(candidates) > 0:
+            candidate = rules[-heapq.heappop(candidates)]
+            full_schedule.append(candidate)
+            for first_rule in predecessors[candidate]:
+                num_successors[first_rule] -= 1
+                if num_successors[first_rule] == 0:
+                    heapq.heappush(candidates, -rule_ids[first_rule])
+        if len(full_schedule) != len(rules):
+            # the remaining rules are part of a cycle
+            raise Exception("getting the full schedule failed")
+        full_schedule.reverse()
 
         return full_schedule
 
 # There are no links between bluespec packages and modules, everything is done by name
 class BluespecPackage:
     def __init__(self, name, bluetcl):
+        # the bluetcl commands here are recorded by bluespecrepl::dump_package
+        # in tcl/dump_metadata.tcl, which has to use the exact same strings
         # first open package if its not already open
         bluetcl.eval('Bluetcl::bpackage load %s' % name)
         self.name = name
@@ -602,6 +1259,9 @@ class BluespecModule:
         else:
             self.package = None
             self.name = name
+        # the bluetcl commands here and in BluespecInterface are recorded by
+        # bluespecrepl::dump_module in tcl/dump_metadata.tcl, which has to use
+        # the exact same strings
         bluetcl.eval('Bluetcl::module load %s' % self.name)
 
         # get scheduling info (urgency and execution)
@@ -654,6 +1314,44 @@ class BluetclAssumptionError(Exception):
     """Raised when an assumption about the data coming back from Bluetcl was violated."""
     pass
 
+class BluetclReplay:
+    """Answers bluetcl eval calls using results recorded inside bluetcl.
+
+    bluespecrepl::dump_metadata (in tcl/dump_metadata.tcl) runs every command
+    used by BluespecPackage and BluespecModule within bluetcl and returns all
+    the results as a single JSON object. Passing a BluetclReplay to those
+    classes in place of bluetcl builds them without any further round trips.
+    Commands that weren't recorded are forwarded to bluetcl.
+    """
+
+    dump_script = os.path.join(os.path.realpath(os.path.dirname(os.path.realpath(__file__))), 'tcl', 'dump_metadata.tcl')
+
+    def __init__(self, results, bluetcl = None):
+        # results maps commands to (is_error, result) pairs
+        self.results = results
+        self.bluetcl = bluetcl
+
+    @classmethod
+    def from_bluetcl(cls, bluetcl, packages = [], modules = []):
+        """Records the metadata of the given packages and modules in a single bluetcl round trip."""
+        if len(packages) == 0 and len(modules) == 0:
+            return cls({}, bluetcl)
+        bluetcl.eval('source {%s}' % BluetclReplay.dump_script)
+        dump = bluetcl.eval('bluespecrepl::dump_metadata {%s} {%s}' % (' '.join(packages), ' '.join(modules)))
+        return cls(json.loads(dump), bluetcl)
+
+    def eval(self, command, to_list = False):
+        if command not in self.results:
+            if self.bluetcl is None:
+                raise BluetclAssumptionError('"{}" was not recorded by bluespecrepl::dump_metadata'.format(command))
+            return self.bluetcl.eval(command, to_list = to_list)
+        is_error, result = self.results[command]
+        if is_error:
+            raise tclwrapper.TCLWrapperError(command, result)
+        if to_list:
+            return tclstring_to_list(result)
+        return result
+
 class BluespecInterfaceMethod:
     def __init__(self, name, ready, enable, args, result):
         # bluespec name
@@ -1,3 +1,5 @@
+import os
+import re
 import inspect
 
 def add_line_macro(bsv_code, file_name = None, line_number = None):
@@ -32,3 +34,50 @@ def add_line_macro(bsv_code, file_name = None, line_number = None):
     finally:
         del frame
     return ('`line %d "%s" 0\n' % (line_number, file_name)) + bsv_code
+
+def get_bsv_imports(filename):
+    """Returns the list of package names imported by a BSV file.
+
+    Comments are stripped before looking for import statements, and duplicate
+    imports are only listed once."""
+    with open(filename) as f:
+        text = f.read()
+    # remove block comments and line comments
+    text = re.sub(r'/\*.*?\*/', ' ', text, flags = re.DOTALL)
+    text = re.sub(r'//[^\n]*', ' ', text)
+    imports = []
+    for package in re.findall(r'\bimport\s+([A-Za-z_][A-Za-z0-9_]*)\s*::', text):
+        if package not in imports:
+            imports.append(package)
+    return imports
+
+def get_package_dependencies(top_file, bsv_path = []):
+    """Returns the import dependency graph of the user packages used by top_file.
+
+    Packages are looked up as <package>.bsv in the directory of top_file and
+    then in each directory of bsv_path. Imported packages that can't be found
+    (e.g. Bluespec library packages) are not included in the graph. The result
+    is a dictionary mapping package names to (filename, dependencies) tuples
+    where dependencies is a list of package names in the graph."""
+    search_dirs = [os.path.dirname(top_file) or '.'] + [d for d in bsv_path if d != '+' and not d.startswith('%')]
+    def find_package(package):
+        for directory in search_dirs:
+            filename = os.path.join(directory, package + '.bsv')
+            if os.path.isfile(filename):
+                return filename
+        return None
+    top_package = os.path.splitext(os.path.basename(top_file))[0]
+    graph = {}
+    worklist = [(top_package, top_file)]
+    while len(worklist) != 0:
+        package, filename = worklist.pop()
+        if package in graph:
+            continue
+        dependencies = []
+        for imported_package in get_bsv_imports(filename):
+            imported_filename = find_package(imported_package)
+            if imported_filename is not None:
+                dependencies.append(imported_package)
+                worklist.append((imported_package, imported_filename))
+        graph[package] = (filename, dependencies)
+    return graph
@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import subprocess
+
+# file extensions of BSV sources that can affect a bsc compilation
+bsv_source_extensions = ['.bsv', '.bsh', '.bs']
+# file extensions of verilog sources that verilator can pick up from the verilog path
+verilog_source_extensions = ['.v', '.sv']
+
+def hash_file(filename):
+    """Returns the sha256 hex digest of the contents of a file."""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def hash_data(data):
+    """Returns the sha256 hex digest of a json-serializable python object."""
+    return hashlib.sha256(json.dumps(data, sort_keys = True).encode('utf-8')).hexdigest()
+
+def find_bsv_sources(directories):
+    """Returns a sorted list of BSV source files found in the given directories.
+
+    Directories that don't exist and bsc path shorthands ('+' and paths starting
+    with '%') are skipped since they refer to the Bluespec libraries."""
+    sources = set()
+    for directory in directories:
+        if directory == '+' or directory.startswith('%') or not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if os.path.splitext(name)[1].lower() in bsv_source_extensions:
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    sources.add(os.path.normpath(path))
+    return sorted(sources)
+
+def find_verilog_sources(directories):
+    """Returns a sorted list of verilog source files found in the given directories.
+
+    Directories that don't exist are skipped."""
+    sources = set()
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if os.path.splitext(name)[1].lower() in verilog_source_extensions:
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    sources.add(os.path.normpath(path))
+    return sorted(sources)
+
+_tool_versions = {}
+
+def get_tool_version(command):
+    """Returns the first line printed by running command (e.g. ['bsc', '-v']).
+
+    The result is cached since the executables don't change while python is running."""
+    key = tuple(command)
+    if key not in _tool_versions:
+        try:
+            output = subprocess.run(command, stdout = subprocess.PIPE, stderr = subprocess.STDOUT).stdout
+            _tool_versions[key] = output.decode('utf-8', 'replace').strip().split('\n')[0]
+        except OSError:
+            _tool_versions[key] = 'unknown'
+    return _tool_versions[key]
+
+def get_bsc_version():
+    """Returns the version string reported by bsc."""
+    return get_tool_version(['bsc', '-v'])
+
+def get_verilator_version():
+    """Returns the version string reported by verilator."""
+    return get_tool_version(['verilator', '--version'])
+
+class BuildManifest:
+    """Record of the inputs used for the most recent successful build of each target.
+
+    The manifest is stored as a json file mapping target names (e.g. 'verilog'
+    or 'bluesim') to a key computed from everything that went into the build.
+    If the key for a new build matches the stored key and all the outputs of
+    the build still exist, the build can be skipped.
+
+    hits -- number of times a target was found to be up to date
+    misses -- number of times a target had to be rebuilt
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self.targets = {}
+        try:
+            with open(self.filename) as f:
+                self.targets = json.load(f)
+        except (OSError, ValueError):
+            # missing or corrupted manifests are treated as empty
+            self.targets = {}
+
+    def is_up_to_date(self, target, key, outputs = []):
+        """Returns True if target was last built with the same key and all of its outputs exist.
+
+        This also updates the hit and miss counters."""
+        up_to_date = self.targets.get(target) == key and all(os.path.exists(x) for x in outputs)
+        if up_to_date:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return up_to_date
+
+    def update(self, target, key):
+        """Records a successful build of target with the given key."""
+        self.targets[target] = key
+        self.write()
+
+    def invalidate(self, target = None):
+        """Forgets the key for target, or for all targets if target is None."""
+        if target is None:
+            self.targets = {}
+        else:
+            self.targets.pop(target, None)
+        self.write()
+
+    def write(self):
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok = True)
+        # write to a temporary file first so an interrupted write doesn't corrupt the manifest
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.targets, f, indent = 2, sort_keys = True)
+        os.replace(tmp_filename, self.filename)
+
+    def get_stats(self):
+        """Returns a dict with the number of cache hits and misses."""
+        return {'hits' : self.hits, 'misses' : self.misses}
@@ -0,0 +1,124 @@
+import array
+
+class InstanceTable:
+    """Flattened table of the module instances in a design hierarchy.
+
+    Instances are numbered in depth-first preorder starting with the top
+    module as instance 0, so the subtree of instance i is the range of ids
+    from i to subtree_end[i]. The name of the top instance is the name of the
+    top module. Instance and module names are interned, so each instance only
+    takes a few integers.
+
+    parent -- array of parent instance ids (-1 for the top instance)
+    module -- array of module ids, which index module_names
+    name -- array of instance name ids, which index instance_names
+    subtree_end -- array of the ids one past the end of each subtree
+    """
+
+    def __init__(self, submodules, top_module):
+        """Creates the instance table for top_module.
+
+        submodules is a dictionary mapping module names to lists of
+        (instance_name, module_name) tuples for their submodules. Modules
+        missing from submodules or mapped to None are leaves."""
+        self.module_names = []
+        self.module_ids = {}
+        self.instance_names = []
+        self.instance_name_ids = {}
+        self.parent = array.array('q')
+        self.module = array.array('q')
+        self.name = array.array('q')
+        stack = [ (-1, top_module, top_module) ]
+        while len(stack) != 0:
+            parent, instance_name, module_name = stack.pop()
+            instance_id = len(self.parent)
+            self.parent.append(parent)
+            self.module.append(self._intern(module_name, self.module_names, self.module_ids))
+            self.name.append(self._intern(instance_name, self.instance_names, self.instance_name_ids))
+            children = submodules.get(module_name)
+            if children is not None:
+                # push the children in reverse so they are numbered in order
+                for submodule_instance, submodule_type in reversed(children):
+                    stack.append((instance_id, submodule_instance, submodule_type))
+        # in preorder, a subtree ends where the last subtree of its children ends
+        self.subtree_end = array.array('q', range(1, len(self.parent) + 1))
+        for instance_id in range(len(self.parent) - 1, 0, -1):
+            parent = self.parent[instance_id]
+            if self.subtree_end[instance_id] > self.subtree_end[parent]:
+                self.subtree_end[parent] = self.subtree_end[instance_id]
+
+    @staticmethod
+    def _intern(name, names, ids):
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def __len__(self):
+        return len(self.parent)
+
+    def get_name(self, instance_id):
+        return self.instance_names[self.name[instance_id]]
+
+    def get_module(self, instance_id):
+        return self.module_names[self.module[instance_id]]
+
+    def get_path(self, instance_id):
+        """Returns the hierarchical name of an instance, e.g. 'mkTop.sub.fifo'."""
+        names = []
+        while instance_id >= 0:
+            names.append(self.get_name(instance_id))
+            instance_id = self.parent[instance_id]
+        return '.'.join(reversed(names))
+
+    def find(self, path):
+        """Returns the id of the instance with the hierarchical name path.
+
+        Raises KeyError if there is no such instance."""
+        names = path.split('.')
+        if len(self.parent) == 0 or names[0] != self.get_name(0):
+            raise KeyError(path)
+        instance_id = 0
+        for name in names[1:]:
+            for child in self.get_children(instance_id):
+                if self.get_name(child) == name:
+                    instance_id = child
+                    break
+            else:
+                raise KeyError(path)
+        return instance_id
+
+    def get_children(self, instance_id):
+        """Yields the ids of the direct children of an instance."""
+        child = instance_id + 1
+        while child < self.subtree_end[instance_id]:
+            yield child
+            child = self.subtree_end[child]
+
+    def get_subtree(self, instance_id = 0):
+        """Returns the range of ids of an instance and all the instances below it."""
+        return range(instance_id, self.subtree_end[instance_id])
+
+    def get_instances_of(self, module_name):
+        """Returns the ids of all the instances of a module."""
+        if module_name not in self.module_ids:
+            return []
+        module_id = self.module_ids[module_name]
+        return [ i for i in range(len(self.module)) if self.module[i] == module_id ]
+
+    def iter_paths(self, instance_id = 0):
+        """Yields (instance_id, path) tuples for the subtree of an instance in preorder.
+
+        Each path is built from its parent's path, so this is much cheaper than
+        calling get_path for every instance."""
+        # stack of (instance_id, path) tuples for the ancestors of the current instance
+        stack = []
+        for i in self.get_subtree(instance_id):
+            if i == instance_id:
+                path = self.get_path(i)
+            else:
+                while stack[-1][0] != self.parent[i]:
+                    stack.pop()
+                path = stack[-1][1] + '.' + self.get_name(i)
+            stack.append((i, path))
+            yield i, path
@@ -1,4 +1,7 @@
+import os
 import random
+import ctypes
+import subprocess
 import pyverilator
 import bluespecrepl.bluetcl as bluetcl
 from tclwrapper import tclstring_to_nested_list
@@ -202,15 +205,106 @@ class BSVSignal:
 class Subinterface(pyverilator.Collection):
     pass
 
+# C++ added to the end of the pyverilator wrapper by PyVerilatorBSV.build.
+# bsv_step runs n cycles of PyVerilatorBSV.step in one call, using the
+# functions defined earlier in the wrapper, and returns the number of cycles
+# it ran. If tfp is not null, the VCD trace is updated like
+# PyVerilator.add_to_vcd_trace does after each eval (if trace_evals is true)
+# or each clock edge (otherwise), and it is flushed at the end.
+native_step_cpp = '''
+// multi-cycle step added by bluespecrepl (see PyVerilatorBSV.step)
+extern "C" {{
+static void bsv_step_trace(VerilatedVcdC* tfp, uint64_t* vcd_time) {{
+    *vcd_time += 5;
+    add_to_vcd_trace(tfp, *vcd_time);
+    *vcd_time += 5;
+    add_to_vcd_trace(tfp, *vcd_time);
+}}
+static void bsv_step_eval({model}* top, VerilatedVcdC* tfp, int trace_evals, uint64_t* vcd_time) {{
+    eval(top);
+    if (tfp != nullptr && trace_evals) {{
+        bsv_step_trace(tfp, vcd_time);
+    }}
+}}
+static void bsv_step_set_clock({model}* top, uint32_t value, int auto_eval, VerilatedVcdC* tfp, int trace_evals, uint64_t* vcd_time) {{
+    set_CLK(top, value);
+    if (auto_eval) {{
+        bsv_step_eval(top, tfp, trace_evals, vcd_time);
+    }}
+    if (tfp != nullptr && !trace_evals) {{
+        bsv_step_trace(tfp, vcd_time);
+    }}
+}}
+uint64_t bsv_step({model}* top, uint64_t n, int stop_on_finish, int auto_eval, VerilatedVcdC* tfp, int trace_evals, uint64_t* vcd_time) {{
+    uint64_t i = 0;
+    while (i < n && !(stop_on_finish && Verilated::gotFinish())) {{
+        bsv_step_eval(top, tfp, trace_evals, vcd_time);
+        bsv_step_set_clock(top, 0, auto_eval, tfp, trace_evals, vcd_time);
+        bsv_step_eval(top, tfp, trace_evals, vcd_time);
+        bsv_step_set_clock(top, 1, auto_eval, tfp, trace_evals, vcd_time);
+        bsv_step_eval(top, tfp, trace_evals, vcd_time);
+        i++;
+    }}
+    if (tfp != nullptr) {{
+        flush_vcd_trace(tfp);
+    }}
+    return i;
+}}
+}}
+'''
+
 class PyVerilatorBSV(pyverilator.PyVerilator):
     """PyVerilator instance with BSV-specific features."""
 
     default_vcd_filename = 'gtkwave.vcd'
 
     @classmethod
-    def build(cls, top_verilog_file, verilog_path = [], build_dir = 'obj_dir', interface = [], rules = [], gen_only = False, bsc_build_dir = 'build_dir'):
-        json_data = {'interface' : interface, 'rules' : rules, 'bsc_build_dir' : bsc_build_dir}
-        return super().build(top_verilog_file, verilog_path, build_dir, json_data, gen_only)
+    def build(cls, top_verilog_file, verilog_path = [], build_dir = 'obj_dir', interface = [], rules = [], gen_only = False, bsc_build_dir = 'build_dir', quiet = False, command_args = ()):
+        json_data = cls.get_json_data(interface, rules, bsc_build_dir)
+        # generate the C++ files first so the native step can be added to the
+        # wrapper, pyverilator has no hook for adding code to it
+        super().build(top_verilog_file, verilog_path, build_dir, json_data, True, quiet = quiet, command_args = command_args)
+        cls.add_native_step(top_verilog_file, build_dir)
+        if gen_only:
+            return None
+        # same as the make step of PyVerilator.build
+        make_command = cls.get_make_command(top_verilog_file, build_dir)
+        if quiet:
+            subprocess.run(make_command, stdout = subprocess.PIPE, stderr = subprocess.PIPE, check = True)
+        else:
+            subprocess.check_call(make_command)
+        module_name = os.path.splitext(os.path.basename(top_verilog_file))[0]
+        return cls(os.path.join(build_dir, 'V' + module_name), command_args = command_args)
+
+    @classmethod
+    def add_native_step(cls, top_verilog_file, build_dir = 'obj_dir'):
+        """Adds the bsv_step function used by step() to the pyverilator wrapper in build_dir.
+
+        Designs without a CLK input don't get a bsv_step function.
+        Returns True if the function was added."""
+        module_name = os.path.splitext(os.path.basename(top_verilog_file))[0]
+        wrapper_filename = os.path.join(build_dir, 'pyverilator_wrapper.cpp')
+        with open(wrapper_filename) as f:
+            wrapper = f.read()
+        if ' set_CLK(' not in wrapper:
+            return False
+        with open(wrapper_filename, 'a') as f:
+            f.write(native_step_cpp.format(model = 'V' + module_name))
+        return True
+
+    @classmethod
+    def get_json_data(cls, interface = [], rules = [], bsc_build_dir = 'build_dir'):
+        """Returns the json_data embedded in the verilator executable by build()."""
+        return {'interface' : interface, 'rules' : rules, 'bsc_build_dir' : bsc_build_dir}
+
+    @classmethod
+    def get_make_command(cls, top_verilog_file, build_dir = 'obj_dir'):
+        """Returns the command that compiles the C++ files generated by build(..., gen_only = True).
+
+        This is the only place with the make arguments, build() and BSVProject
+        both compile the verilator model with this command."""
+        module_name = os.path.splitext(os.path.basename(top_verilog_file))[0]
+        return ['make', '-C', build_dir, '-f', 'V%s.mk' % module_name, 'LDFLAGS=-fPIC -shared']
 
     def __init__(self, so_file, bsc_build_dir = None, **kwargs):
         super().__init__(so_file, **kwargs)
@@ -220,6 +314,13 @@ class PyVerilatorBSV(pyverilator.PyVerilator):
         else:
             self.bsc_build_dir = self.json_data['bsc_build_dir']
         self.gtkwave_active = False
+        # bsv_step is missing from simulators built without add_native_step
+        self._native_step = getattr(self.lib, 'bsv_step', None)
+        if self._native_step is not None:
+            self._native_step.argtypes = [ctypes.c_void_p, ctypes.c_uint64, ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_uint64)]
+            self._native_step.restype = ctypes.c_uint64
+        # set to False to always step the design from python
+        self.use_native_step = True
         self._populate_interface()
         self._populate_signal_translation()
         self._populate_bsv_internals()
@@ -495,13 +596,14 @@ class PyVerilatorBSV(pyverilator.PyVerilator):
             new_block_fire = new_block_fire & ~(1 << index)
         self['BLOCK_FIRE'] = new_block_fire
 
-    def run_bsc_schedule(self, n, print_fired_rules = False):
-        """Do n steps of the design with the scheduler created by the Bluespec compiler."""
+    def run_bsc_schedule(self, n, print_fired_rules = False, stop_on_finish = False):
+        """Do n steps of the design with the scheduler created by the Bluespec compiler.
+
+        Returns the number of steps done (see step)."""
         if 'BLOCK_FIRE' not in self:
             raise ValueError('This function requires scheduling control in the Verilog')
         self['BLOCK_FIRE'] = 0
-        for i in range(n):
-            self.step(print_fired_rules)
+        return self.step(n, print_fired_rules = print_fired_rules, stop_on_finish = stop_on_finish)
 
     def list_can_fire(self):
         """List the rules with CAN_FIRE = 1"""
@@ -532,7 +634,7 @@ class PyVerilatorBSV(pyverilator.PyVerilator):
         for i in range(n):
             chosen = random.choice(self.list_can_fire())
             self.set_fire([chosen])
-            self.step(print_fired_rules)
+            self.step(print_fired_rules = print_fired_rules)
 
     def run_until_predicate(self, predicate, print_fired_rules = False):
         """
@@ -546,12 +648,43 @@ class PyVerilatorBSV(pyverilator.PyVerilator):
         n = 0
         self.set_fire(self.rule_names)
         while not predicate(self):
-            self.step(print_fired_rules)
+            self.step(print_fired_rules = print_fired_rules)
             n += 1
         print("Predicate encountered after %d steps" % n)
 
-    def step(self, n = 1, print_fired_rules = False):
+    def _can_step_natively(self, print_fired_rules):
+        if not self.use_native_step or self._native_step is None or print_fired_rules:
+            return False
+        # the native step only traces the clock edges of CLK
+        return self.auto_tracing_mode != 'clock' or self.clock.verilator_name == 'CLK'
+
+    def step(self, n = 1, print_fired_rules = False, stop_on_finish = False):
+        """Do n clock cycles of the design.
+
+        If stop_on_finish is True, this stops early once the design calls
+        $finish. Returns the number of cycles done. The cycles are done by
+        one call to the bsv_step function of the simulator if it has one,
+        during which other python threads can run since ctypes releases the
+        GIL. Otherwise (or if print_fired_rules is True) each cycle is done
+        from python.
+        """
+        if n < 0:
+            # bsv_step takes an unsigned number of cycles
+            raise ValueError('step() expects a non-negative number of cycles, got %d' % n)
+        if self._can_step_natively(print_fired_rules):
+            tfp = None
+            if self.vcd_trace is not None and self.auto_tracing_mode is not None:
+                tfp = self.vcd_trace
+            vcd_time = ctypes.c_uint64(self.curr_time)
+            num_steps = self._native_step(self.model, n, stop_on_finish, self.auto_eval, tfp, self.auto_tracing_mode == 'eval', ctypes.byref(vcd_time))
+            if tfp is not None:
+                self.curr_time = vcd_time.value
+                if self.gtkwave_active:
+                    self.reload_dump_file()
+            return num_steps
         for i in range(n):
+            if stop_on_finish and self.finished:
+                return i
             self.eval()
             if (print_fired_rules):
                 print(self.list_will_fire())
@@ -559,4 +692,5 @@ class PyVerilatorBSV(pyverilator.PyVerilator):
             self.eval()
             self['CLK'] = 1
             self.eval()
+        return n
 
@@ -0,0 +1,116 @@
+import array
+import bisect
+import bluespecrepl.instancetable as instancetable
+
+def _to_csr(num_nodes, edges):
+    """Returns (offsets, targets) arrays for a list of (source, target) edges.
+
+    The targets of node i are targets[offsets[i]:offsets[i+1]] in sorted order."""
+    edges = sorted(set(edges))
+    offsets = array.array('q', [0] * (num_nodes + 1))
+    for source, _ in edges:
+        offsets[source + 1] += 1
+    for i in range(num_nodes):
+        offsets[i + 1] += offsets[i]
+    targets = array.array('q', [target for _, target in edges])
+    return offsets, targets
+
+def _has_edge(offsets, targets, source, target):
+    """Returns True if the CSR arrays have an edge from source to target."""
+    start = offsets[source]
+    end = offsets[source + 1]
+    k = bisect.bisect_left(targets, target, start, end)
+    return k != end and targets[k] == target
+
+class RuleGraph:
+    """Design-wide graph of the rules and methods of a compiled design.
+
+    The graph is built from the BluespecModule objects in BSVProject.modules.
+    Every rule and method of every instance in the hierarchy below the top
+    module gets an integer id. Names are full instance paths in the same form
+    as get_complete_schedule (e.g. 'mkTop.fifo.RL_deq' or 'mkTop.r.write').
+    Methods of primitive submodules that are called by rules are included too.
+
+    names -- list of names indexed by id
+    ids -- dictionary mapping names to ids
+    call_offsets, call_targets -- methods called by each rule, as CSR arrays
+    caller_offsets, caller_targets -- rules calling each method, as CSR arrays
+    blocker_offsets, blocker_targets -- rules that can block each rule, as CSR arrays
+    blocked_offsets, blocked_targets -- rules each rule can block, as CSR arrays
+    """
+
+    def __init__(self, modules, top_module):
+        self.names = []
+        self.ids = {}
+        calls = []
+        urgency = []
+        instances = instancetable.InstanceTable({ name : module.submodules for name, module in modules.items() }, top_module)
+        for instance_id, instance_name in instances.iter_paths():
+            if instances.get_module(instance_id) not in modules:
+                # primitive submodules only show up through the methods called on them
+                continue
+            module = modules[instances.get_module(instance_id)]
+            prefix = instance_name + '.'
+            for item in module.execution:
+                self._add(prefix + item)
+            for rule, methods in module.method_calls_by_rule.items():
+                rule_id = self._add(prefix + rule)
+                for method in methods:
+                    calls.append((rule_id, self._add(prefix + method)))
+            # urgency maps each rule to the rules that can block it
+            for rule, blocking_rules in module.urgency.items():
+                rule_id = self._add(prefix + rule)
+                for blocking_rule in blocking_rules:
+                    urgency.append((rule_id, self._add(prefix + blocking_rule)))
+
+        num_nodes = len(self.names)
+        self.call_offsets, self.call_targets = _to_csr(num_nodes, calls)
+        self.caller_offsets, self.caller_targets = _to_csr(num_nodes, [ (method, rule) for rule, method in calls ])
+        self.blocker_offsets, self.blocker_targets = _to_csr(num_nodes, urgency)
+        self.blocked_offsets, self.blocked_targets = _to_csr(num_nodes, [ (blocking_rule, rule) for rule, blocking_rule in urgency ])
+
+    def _add(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def get_id(self, name):
+        return self.ids[name]
+
+    def get_name(self, node_id):
+        return self.names[node_id]
+
+    def get_called_methods(self, rule):
+        """Returns the names of the methods called by rule."""
+        i = self.ids[rule]
+        return [ self.names[x] for x in self.call_targets[self.call_offsets[i]:self.call_offsets[i+1]] ]
+
+    def get_callers(self, method):
+        """Returns the names of the rules (and methods) that call method."""
+        i = self.ids[method]
+        return [ self.names[x] for x in self.caller_targets[self.caller_offsets[i]:self.caller_offsets[i+1]] ]
+
+    def calls(self, rule, method):
+        """Returns True if rule calls method."""
+        return _has_edge(self.call_offsets, self.call_targets, self.ids[rule], self.ids[method])
+
+    def can_block(self, blocking_rule, rule):
+        """Returns True if blocking_rule is more urgent than rule and can block it."""
+        return _has_edge(self.blocker_offsets, self.blocker_targets, self.ids[rule], self.ids[blocking_rule])
+
+    def get_blocking_rules(self, rule):
+        """Returns the names of the rules that can block rule."""
+        i = self.ids[rule]
+        return [ self.names[x] for x in self.blocker_targets[self.blocker_offsets[i]:self.blocker_offsets[i+1]] ]
+
+    def get_blocked_rules(self, rule):
+        """Returns the names of the rules that rule can block."""
+        i = self.ids[rule]
+        return [ self.names[x] for x in self.blocked_targets[self.blocked_offsets[i]:self.blocked_offsets[i+1]] ]
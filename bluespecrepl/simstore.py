@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import shutil
+import fcntl
+import tempfile
+import contextlib
+
+class SimulatorStore:
+    """Content-addressed store of compiled PyVerilatorBSV simulators.
+
+    The store is a directory that can be shared by many projects and
+    checkouts on the same machine. Each entry is a directory named after the
+    key of the build (a hash of the mutated verilog and the build options)
+    containing the verilator shared object and its json_data. Entries are
+    evicted in least-recently-used order when there are more than max_entries
+    entries or when the store is larger than max_size bytes. A lock file
+    protects the store from concurrent writers.
+    """
+
+    # environment variable that enables a machine-wide store in gen_python_repl
+    env_var = 'BLUESPECREPL_SIMULATOR_STORE'
+    # environment variables with the limits of that store
+    max_size_env_var = 'BLUESPECREPL_SIMULATOR_STORE_MAX_SIZE'
+    max_entries_env_var = 'BLUESPECREPL_SIMULATOR_STORE_MAX_ENTRIES'
+    # limits used by from_environment when the variables above are not set
+    default_max_size = 10 * 1024 ** 3
+    default_max_entries = 1000
+
+    so_name = 'simulator.so'
+    json_data_name = 'json_data.json'
+    lock_name = '.lock'
+
+    def __init__(self, cache_dir, max_size = None, max_entries = None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_entries = max_entries
+        os.makedirs(self.cache_dir, exist_ok = True)
+
+    @classmethod
+    def from_environment(cls):
+        """Returns a SimulatorStore for the directory in $BLUESPECREPL_SIMULATOR_STORE, or None if it is not set.
+
+        The store is limited to $BLUESPECREPL_SIMULATOR_STORE_MAX_SIZE bytes
+        (10 GiB by default) and $BLUESPECREPL_SIMULATOR_STORE_MAX_ENTRIES
+        entries (1000 by default). Setting either variable to 0 removes that
+        limit."""
+        cache_dir = os.environ.get(cls.env_var)
+        if not cache_dir:
+            return None
+        def get_limit(env_var, default):
+            value = os.environ.get(env_var)
+            if not value:
+                return default
+            try:
+                limit = int(value)
+            except ValueError:
+                raise ValueError('$%s must be a number, got "%s"' % (env_var, value))
+            return limit if limit > 0 else None
+        return cls(cache_dir,
+                max_size = get_limit(cls.max_size_env_var, cls.default_max_size),
+                max_entries = get_limit(cls.max_entries_env_var, cls.default_max_entries))
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        with open(os.path.join(self.cache_dir, SimulatorStore.lock_name), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def __contains__(self, key):
+        return os.path.isfile(os.path.join(self._entry_dir(key), SimulatorStore.so_name))
+
+    def get(self, key, so_file):
+        """Copies the shared object stored for key to so_file.
+
+        Returns True if the store had an entry for key, and False otherwise."""
+        with self._locked(exclusive = False):
+            entry_dir = self._entry_dir(key)
+            stored_so_file = os.path.join(entry_dir, SimulatorStore.so_name)
+            if not os.path.isfile(stored_so_file):
+                return False
+            so_dir = os.path.dirname(so_file)
+            if so_dir and not os.path.exists(so_dir):
+                os.makedirs(so_dir, exist_ok = True)
+            # copy to a temporary file first so so_file is never partially written
+            tmp_so_file = so_file + '.tmp'
+            shutil.copy(stored_so_file, tmp_so_file)
+            os.replace(tmp_so_file, so_file)
+            # the modification time of the entry directory tracks its last use
+            os.utime(entry_dir)
+            return True
+
+    def get_json_data(self, key):
+        """Returns the json_data stored for key, or None if there is no entry for key."""
+        try:
+            with open(os.path.join(self._entry_dir(key), SimulatorStore.json_data_name)) as f:
+                return json.load(f)
+        except OSError:
+            return None
+
+    def put(self, key, so_file, json_data = None):
+        """Adds the shared object so_file to the store under key and evicts old entries if necessary."""
+        with self._locked(exclusive = True):
+            if key not in self:
+                # build the entry in a temporary directory, then move it into place
+                tmp_dir = tempfile.mkdtemp(prefix = '.tmp-', dir = self.cache_dir)
+                try:
+                    shutil.copy(so_file, os.path.join(tmp_dir, SimulatorStore.so_name))
+                    with open(os.path.join(tmp_dir, SimulatorStore.json_data_name), 'w') as f:
+                        json.dump(json_data, f)
+                    os.rename(tmp_dir, self._entry_dir(key))
+                except:
+                    shutil.rmtree(tmp_dir, ignore_errors = True)
+                    raise
+            else:
+                os.utime(self._entry_dir(key))
+            self._evict()
+
+    def get_entries(self):
+        """Returns a list of (key, size, last_used) tuples sorted from least to most recently used."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, x)) for x in os.listdir(entry_dir))
+            entries.append((name, size, os.path.getmtime(entry_dir)))
+        entries.sort(key = lambda x: x[2])
+        return entries
+
+    def evict(self):
+        """Removes least recently used entries until the store is within its limits."""
+        with self._locked(exclusive = True):
+            self._evict()
+
+    def _evict(self):
+        entries = self.get_entries()
+        total_size = sum(size for _, size, _ in entries)
+        while len(entries) != 0:
+            too_many = self.max_entries is not None and len(entries) > self.max_entries
+            too_big = self.max_size is not None and total_size > self.max_size
+            if not too_many and not too_big:
+                break
+            key, size, _ = entries.pop(0)
+            shutil.rmtree(self._entry_dir(key), ignore_errors = True)
+            total_size -= size
+
+    def clear(self):
+        """Removes all entries from the store."""
+        with self._locked(exclusive = True):
+            for key, _, _ in self.get_entries():
+                shutil.rmtree(self._entry_dir(key), ignore_errors = True)
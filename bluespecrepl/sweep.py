@@ -0,0 +1,56 @@
+import os
+import concurrent.futures
+import bluespecrepl.pyverilatorbsv as pyverilatorbsv
+
+class VariantBuild:
+    """Result of building one variant of a parameter sweep.
+
+    bsc_options -- the extra bsc options used for this variant
+    project -- the BSVProject for this variant
+    sim -- the PyVerilatorBSV simulator, or None if the build failed
+    error -- the exception raised while building the variant, or None
+    """
+
+    def __init__(self, bsc_options, project, sim = None, error = None):
+        self.bsc_options = bsc_options
+        self.project = project
+        self.sim = sim
+        self.error = error
+
+    def succeeded(self):
+        return self.error is None
+
+def _build_variant(project, scheduling_control, verilator_dir):
+    # runs in a worker process, so only the path of the simulator is returned
+    return project.build_python_repl(scheduling_control = scheduling_control, verilator_dir = verilator_dir)
+
+def build_variants(base_project, option_overrides, sweep_dir = 'sweep_dir', scheduling_control = False, jobs = None):
+    """Builds a verilator simulator for each variant of base_project in parallel.
+
+    option_overrides is a list with one entry per variant, where each entry
+    is a list of extra bsc options (e.g. ['-D', 'WIDTH=32']). Each variant is
+    compiled in its own directory within sweep_dir using a pool of jobs worker
+    processes (one per CPU if jobs is None), and the resulting simulators are
+    loaded in this process.
+
+    Returns a list of VariantBuild objects in the same order as
+    option_overrides. A failed build doesn't stop the other builds; its
+    exception is stored in the error field of its VariantBuild.
+    """
+    results = []
+    variant_dirs = []
+    for i, bsc_options in enumerate(option_overrides):
+        variant_dir = os.path.join(sweep_dir, 'variant_%d' % i)
+        results.append(VariantBuild(bsc_options, base_project.make_variant(variant_dir, bsc_options)))
+        variant_dirs.append(variant_dir)
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+        futures = []
+        for result, variant_dir in zip(results, variant_dirs):
+            verilator_dir = os.path.join(variant_dir, 'verilator_dir')
+            futures.append(executor.submit(_build_variant, result.project, scheduling_control, verilator_dir))
+        for result, future in zip(results, futures):
+            try:
+                result.sim = pyverilatorbsv.PyVerilatorBSV(future.result())
+            except Exception as e:
+                result.error = e
+    return results
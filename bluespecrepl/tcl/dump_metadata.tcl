@@ -0,0 +1,99 @@
+# Procedures for reading the metadata used by bluespecrepl's BluespecPackage
+# and BluespecModule classes in a single bluetcl round trip.
+#
+# bluespecrepl::dump_metadata runs the same Bluetcl commands as those classes
+# and returns a JSON object mapping each command to [is_error, result].
+
+namespace eval ::bluespecrepl {
+    # maps commands to {is_error result} lists
+    variable results
+    array set results {}
+
+    # characters that have to be escaped in JSON strings
+    variable json_escapes [list "\\" "\\\\" "\"" "\\\"" "\n" "\\n" "\r" "\\r" "\t" "\\t"]
+    for {set i 0} {$i < 32} {incr i} {
+        if {[lsearch -exact $json_escapes [format %c $i]] < 0} {
+            lappend json_escapes [format %c $i] [format "\\u%04x" $i]
+        }
+    }
+}
+
+# Evaluates command, records its result, and returns it.
+proc ::bluespecrepl::record {command} {
+    variable results
+    if {![info exists results($command)]} {
+        if {[catch {uplevel #0 $command} result]} {
+            set results($command) [list 1 $result]
+        } else {
+            set results($command) [list 0 $result]
+        }
+    }
+    foreach {is_error result} $results($command) break
+    if {$is_error} {
+        return -code error $result
+    }
+    return $result
+}
+
+proc ::bluespecrepl::remove_package_name {name} {
+    regsub {^.*::} $name {} name
+    return $name
+}
+
+# The commands must match the ones sent by BluespecPackage in bsvproject.py
+# character for character, since the results are looked up by command.
+proc ::bluespecrepl::dump_package {package} {
+    catch {record "Bluetcl::bpackage load $package"}
+    if {![catch {record "Bluetcl::defs type $package"} types]} {
+        foreach type_name $types {
+            set type_name [remove_package_name $type_name]
+            catch {record "Bluetcl::type full \[Bluetcl::type constr {$type_name}\]"}
+        }
+    }
+    catch {record "Bluetcl::defs module $package"}
+    catch {record "Bluetcl::defs func $package"}
+}
+
+# The commands must match the ones sent by BluespecModule and
+# BluespecInterface in bsvproject.py character for character.
+proc ::bluespecrepl::dump_module {module} {
+    set module [remove_package_name $module]
+    catch {record "Bluetcl::module load $module"}
+    foreach query {urgency execution methodinfo pathinfo} {
+        catch {record "Bluetcl::schedule $query $module"}
+    }
+    catch {record "Bluetcl::module submods $module"}
+    if {![catch {record "Bluetcl::schedule execution $module"} rules]} {
+        foreach rule $rules {
+            catch {record "Bluetcl::rule full $module $rule"}
+        }
+    }
+    foreach query {ifc methods ports porttypes} {
+        catch {record "Bluetcl::module $query $module"}
+    }
+}
+
+proc ::bluespecrepl::json_string {s} {
+    variable json_escapes
+    return "\"[string map $json_escapes $s]\""
+}
+
+# Returns the results of all the commands used to read the metadata of the
+# given packages and modules as a JSON object.
+proc ::bluespecrepl::dump_metadata {packages modules} {
+    variable results
+    array unset results
+    array set results {}
+    foreach package $packages {
+        dump_package $package
+    }
+    foreach module $modules {
+        dump_module $module
+    }
+    set items {}
+    foreach command [lsort [array names results]] {
+        foreach {is_error result} $results($command) break
+        lappend items "[json_string $command]: \[$is_error, [json_string $result]\]"
+    }
+    return "{[join $items {, }]}"
+}
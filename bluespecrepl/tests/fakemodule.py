@@ -0,0 +1,33 @@
+class FakeModule:
+    """Stands in for BluespecModule with just the fields used by the complete schedule and RuleGraph."""
+    def __init__(self, execution, submodules = (), method_calls_by_rule = {}, urgency = {}):
+        self.execution = execution
+        self.submodules = submodules
+        self.method_calls_by_rule = method_calls_by_rule
+        self.urgency = urgency
+
+def make_synthetic_modules(depth, rules_per_module, methods_per_module = 2, submodules_per_module = 2):
+    """Returns a dictionary of FakeModules forming a hierarchy with mkLevel<depth> at the top.
+
+    Every module mkLevel<d> has rules_per_module rules followed by
+    methods_per_module methods, and if d > 0 it has submodules_per_module
+    instances of mkLevel<d-1>. Each rule calls one method of one submodule.
+    """
+    modules = {}
+    for d in range(depth + 1):
+        execution = []
+        method_calls_by_rule = {}
+        submodules = ()
+        if d > 0:
+            submodules = tuple(('sub%d' % i, 'mkLevel%d' % (d - 1)) for i in range(submodules_per_module))
+        for i in range(rules_per_module):
+            rule = 'RL_rule%d' % i
+            execution.append(rule)
+            calls = []
+            if d > 0:
+                calls.append('sub%d.method%d' % (i % submodules_per_module, i % methods_per_module))
+            method_calls_by_rule[rule] = calls
+        # methods come after the rules, so rules calling them are scheduled after the submodule's rules
+        execution += ['method%d' % i for i in range(methods_per_module)]
+        modules['mkLevel%d' % d] = FakeModule(execution, submodules, method_calls_by_rule)
+    return modules
@@ -2,7 +2,10 @@ import unittest
 import tempfile
 import shutil
 import os
+import asyncio
+import tclwrapper
 from bluespecrepl import bsvproject
+from bluespecrepl.tests.fakemodule import FakeModule
 
 class TestBSVProject(unittest.TestCase):
     def setUp(self):
@@ -68,8 +71,11 @@ class TestBSVProject(unittest.TestCase):
         self.assertTrue(os.path.isfile(os.path.join('verilator_dir','VmkTest.cpp')))
         self.assertTrue(os.path.isfile(os.path.join('verilator_dir','pyverilator_wrapper.cpp')))
         self.assertTrue(os.path.isfile(os.path.join('verilator_dir','VmkTest')))
+        # the parsed verilog is cached for the next build
+        self.assertTrue(os.path.isdir(os.path.join('info_dir', bsvproject.BSVProject.verilog_ast_cache_name)))
 
         proj.clean()
+        self.assertFalse(os.path.exists(os.path.join('info_dir', bsvproject.BSVProject.verilog_ast_cache_name)))
         # check for verilog output
         self.assertFalse(os.path.isfile(os.path.join('verilog_dir','mkTest.v')))
         # check for bluesim output
@@ -163,3 +169,340 @@ class TestBSVProject(unittest.TestCase):
                 self.assertIn(submodule_pair, expected_result[m])
             for submodule_pair in expected_result[m]:
                 self.assertIn(submodule_pair, submodule_pairs)
+
+    def test_bsvproject_build_cache(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+
+        proj.compile_verilog()
+        self.assertEqual(proj.get_build_cache_stats(), {'hits' : 0, 'misses' : 1})
+        # nothing changed, so bsc should not run again
+        proj.compile_verilog()
+        self.assertEqual(proj.get_build_cache_stats(), {'hits' : 1, 'misses' : 1})
+
+        # changing the source requires recompilation
+        with open('Test.bsv', 'a') as f:
+            f.write('// comment\n')
+        proj.compile_verilog()
+        self.assertEqual(proj.get_build_cache_stats(), {'hits' : 1, 'misses' : 2})
+
+        # changing the bsc options requires recompilation
+        proj.bsc_options.append('-show-schedule')
+        proj.compile_verilog()
+        self.assertEqual(proj.get_build_cache_stats(), {'hits' : 1, 'misses' : 3})
+
+        # missing outputs require recompilation
+        os.remove(os.path.join('verilog_dir', 'mkTest.v'))
+        proj.compile_verilog()
+        self.assertEqual(proj.get_build_cache_stats(), {'hits' : 1, 'misses' : 4})
+        self.assertTrue(os.path.isfile(os.path.join('verilog_dir','mkTest.v')))
+
+    def test_bsvproject_compile_all(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+
+        timings = proj.compile_all()
+        self.assertEqual(set(timings.keys()), {'verilog', 'bluesim'})
+        # check for verilog output
+        self.assertTrue(os.path.isfile(os.path.join('verilog_dir','mkTest.v')))
+        # check for bluesim output
+        self.assertTrue(os.path.isfile(os.path.join('sim_dir','mkTest.cxx')))
+        self.assertTrue(os.path.isfile('sim.out'))
+        # the bluesim back end has its own info_dir
+        self.assertTrue(os.path.isdir(os.path.join('info_dir', bsvproject.BSVProject.bluesim_info_dir_name)))
+
+        # both back ends are up to date now
+        proj.compile_all()
+        self.assertEqual(proj.get_build_cache_stats(), {'hits' : 2, 'misses' : 2})
+
+        # clean removes the output of both back ends
+        proj.clean()
+        self.assertFalse(os.path.exists('info_dir'))
+
+    def test_bsvproject_reuse_verilator_build(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                    rule oneRule;
+                        $display("Hello, World!");
+                    endrule
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+
+        proj.gen_python_repl(scheduling_control = True)
+        so_file = os.path.join('verilator_dir','VmkTest')
+        first_build_mtime = os.path.getmtime(so_file)
+
+        # the hardware didn't change, so the verilator executable should be reused
+        sim = proj.gen_python_repl(scheduling_control = True)
+        self.assertEqual(os.path.getmtime(so_file), first_build_mtime)
+        self.assertEqual(sim.rule_names, ['RL_oneRule'])
+
+    def test_bsvproject_verilator_build_key_uses_library_contents(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                endmodule
+                ''')
+        os.makedirs('lib')
+        with open(os.path.join('lib', 'Dummy.v'), 'w') as f:
+            f.write('module Dummy(); endmodule\n')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest', v_path = ['lib', os.path.join(os.environ['BLUESPECDIR'], 'Verilog')])
+        proj.compile_verilog()
+
+        first_key = proj._get_verilator_build(False, 'verilator_dir')['key']
+        self.assertEqual(proj._get_verilator_build(False, 'verilator_dir')['key'], first_key)
+        # changing a library module in v_path changes the verilator build
+        with open(os.path.join('lib', 'Dummy.v'), 'w') as f:
+            f.write('module Dummy(input CLK); endmodule\n')
+        self.assertNotEqual(proj._get_verilator_build(False, 'verilator_dir')['key'], first_key)
+
+    def test_bsvproject_compile_verilog_async(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+
+        output_lines = []
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(proj.compile_verilog_async(output_callback = output_lines.append))
+        finally:
+            loop.close()
+        # check for verilog output
+        self.assertTrue(os.path.isfile(os.path.join('verilog_dir','mkTest.v')))
+        # bsc reports the verilog file it wrote
+        self.assertTrue(any('mkTest.v' in line for line in output_lines))
+
+    def test_bsvproject_metadata_cache(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                    rule oneRule;
+                        $display("Hello, World!");
+                    endrule
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+        proj.compile_verilog()
+        proj.populate_packages_and_modules()
+        self.assertTrue(os.path.isfile(os.path.join('info_dir', bsvproject.BSVProject.metadata_cache_name)))
+
+        # a new project loads the same metadata from the cache
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+        proj.populate_packages_and_modules()
+        self.assertEqual(list(proj.modules['mkTest'].execution), ['RL_oneRule'])
+        self.assertIn('Prelude', proj.packages)
+
+        # changing the design only updates the stale metadata
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                    rule oneRule;
+                        $display("Hello, World!");
+                    endrule
+                    rule twoRule;
+                        $display("Goodbye, World!");
+                    endrule
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+        proj.compile_verilog()
+        proj.populate_packages_and_modules()
+        self.assertEqual(sorted(proj.modules['mkTest'].execution), ['RL_oneRule', 'RL_twoRule'])
+
+    def test_bsvproject_bluetcl_replay(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                interface Test;
+                    method Action start(Bit#(8) x);
+                    method Bit#(8) result;
+                endinterface
+                (* synthesize *)
+                module mkTest(Test);
+                    Reg#(Bit#(8)) r <- mkReg(0);
+                    rule incr;
+                        r <= r + 1;
+                    endrule
+                    method Action start(Bit#(8) x);
+                        r <= x;
+                    endmethod
+                    method Bit#(8) result = r;
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+        proj.compile_verilog()
+        with tclwrapper.TCLWrapper('bluetcl') as bluetcl:
+            bluetcl.eval('Bluetcl::flags set -verilog ' + ' '.join(proj.get_path_arg()))
+            bluetcl.eval('Bluetcl::bpackage load Test')
+            # the replay doesn't fall back to bluetcl, so every command has to be recorded by dump_metadata.tcl
+            replay = bsvproject.BluetclReplay(bsvproject.BluetclReplay.from_bluetcl(bluetcl, packages = ['Test'], modules = ['mkTest']).results)
+            # metadata built from the replay matches metadata read directly from bluetcl
+            replayed_package = bsvproject.BluespecPackage('Test', replay)
+            package = bsvproject.BluespecPackage('Test', bluetcl)
+            self.assertEqual(replayed_package.types, package.types)
+            self.assertEqual(replayed_package.modules, package.modules)
+            replayed_module = bsvproject.BluespecModule('mkTest', replay)
+            module = bsvproject.BluespecModule('mkTest', bluetcl)
+            self.assertEqual(replayed_module.execution, module.execution)
+            self.assertEqual(replayed_module.method_calls_by_rule, module.method_calls_by_rule)
+            self.assertEqual(replayed_module.interface.bsv_decl(), module.interface.bsv_decl())
+
+    def test_bsvproject_bluetcl_session(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                    rule oneRule;
+                        $display("Hello, World!");
+                    endrule
+                endmodule
+                ''')
+        with bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest') as proj:
+            proj.compile_verilog()
+            self.assertEqual(list(proj.get_module_schedule()), ['RL_oneRule'])
+            session = proj.bluetcl_session
+            # the session is reused by later queries
+            self.assertEqual(proj.get_hierarchy(), {'mkTest' : []})
+            self.assertIs(proj.bluetcl_session, session)
+
+            # recompiling the design restarts the session
+            with open('Test.bsv', 'w') as f:
+                f.write('''
+                    (* synthesize *)
+                    module mkTest(Empty);
+                        rule twoRule;
+                            $display("Goodbye, World!");
+                        endrule
+                    endmodule
+                    ''')
+            proj.compile_verilog()
+            self.assertEqual(list(proj.get_module_schedule()), ['RL_twoRule'])
+            self.assertIsNot(proj.bluetcl_session, session)
+        # leaving the with block stops the session
+        self.assertIsNone(proj.bluetcl_session)
+
+    def test_bsvproject_populate_parallel(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkA(Empty);
+                    rule a;
+                        $display("a");
+                    endrule
+                endmodule
+                (* synthesize *)
+                module mkB(Empty);
+                    rule b;
+                        $display("b");
+                    endrule
+                endmodule
+                (* synthesize *)
+                module mkTest(Empty);
+                    Empty a <- mkA;
+                    Empty b <- mkB;
+                    rule top;
+                        $display("top");
+                    endrule
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+        proj.use_build_cache = False
+        proj.compile_verilog()
+        proj.populate_packages_and_modules()
+        sequential_modules = proj.modules
+        proj.populate_packages_and_modules(force = True, jobs = 3)
+        # the parallel path produces the same modules in the same order
+        self.assertEqual(list(proj.modules), list(sequential_modules))
+        for name, module in proj.modules.items():
+            self.assertEqual(module.execution, sequential_modules[name].execution)
+            self.assertEqual(module.submodules, sequential_modules[name].submodules)
+            self.assertEqual(module.method_calls_by_rule, sequential_modules[name].method_calls_by_rule)
+        proj.close()
+
+    def test_bsvproject_complete_schedule(self):
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTop', v_path = [])
+        proj.modules = {
+                'mkSub' : FakeModule(['RL_s', 'put'], (), {'RL_s' : []}),
+                'mkTop' : FakeModule(['RL_a', 'RL_t', 'RL_b'], (('sub', 'mkSub'),), {'RL_a' : [], 'RL_t' : ['sub.put'], 'RL_b' : []}) }
+        # RL_s is before the method put, so it has to be before RL_t which calls put
+        self.assertEqual(proj.get_complete_schedule(), ['mkTop.RL_a', 'mkTop.sub.RL_s', 'mkTop.RL_t', 'mkTop.RL_b'])
+
+        # RL_t calls get, which is before RL_s, and put, which is after RL_s, so there is no valid schedule
+        proj.modules = {
+                'mkSub' : FakeModule(['get', 'RL_s', 'put'], (), {'RL_s' : []}),
+                'mkTop' : FakeModule(['RL_t'], (('sub', 'mkSub'),), {'RL_t' : ['sub.get', 'sub.put']}) }
+        with self.assertRaises(Exception):
+            proj.get_complete_schedule()
+
+    def test_bsvproject_complete_schedule_from_elaboration(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                interface Sub;
+                    method Action put(Bit#(8) x);
+                endinterface
+                (* synthesize *)
+                module mkSub(Sub);
+                    Reg#(Bit#(8)) r <- mkReg(0);
+                    rule incr;
+                        r <= r + 1;
+                    endrule
+                    method Action put(Bit#(8) x);
+                        r <= x;
+                    endmethod
+                endmodule
+                (* synthesize *)
+                module mkTest(Empty);
+                    Sub sub <- mkSub;
+                    rule send;
+                        sub.put(5);
+                    endrule
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+        schedule = proj.get_complete_schedule_from_elaboration()
+        self.assertTrue(os.path.isfile(os.path.join('info_dir', bsvproject.BSVProject.schedule_cache_name)))
+        # bluesim is not needed
+        self.assertFalse(os.path.exists('sim.out'))
+        self.assertEqual(schedule, proj.get_complete_schedule_from_bluesim())
+        # the second call uses the cached schedule
+        self.assertEqual(proj.get_complete_schedule_from_elaboration(), schedule)
+        proj.close()
+
+    def test_bsvproject_complete_schedule_from_elaboration_keeps_build_options(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkTest(Empty);
+                    Reg#(Bit#(8)) r <- mkReg(0);
+                    rule incr;
+                        r <= r + 1;
+                    endrule
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+        proj.compile_verilog(extra_bsc_args = ['-no-opt-ATS'])
+        verilog_key = proj.get_build_manifest().targets['verilog']
+        self.assertEqual(proj.get_complete_schedule_from_elaboration(), [('RL_incr',)])
+        # the verilog build with -no-opt-ATS is reused instead of being replaced by a default build
+        self.assertEqual(proj.get_build_manifest().targets['verilog'], verilog_key)
+        self.assertEqual(proj.get_build_cache_stats(), {'hits' : 1, 'misses' : 1})
+        proj.close()
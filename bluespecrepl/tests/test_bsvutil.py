@@ -1,17 +1,52 @@
 import unittest
+import tempfile
+import shutil
+import os
 
 from bluespecrepl import bsvutil
 
 class TestBSVUtil(unittest.TestCase):
+    def setUp(self):
+        self.old_dir = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+
+    def tearDown(self):
+        os.chdir(self.old_dir)
+        shutil.rmtree(self.test_dir)
+
     def test_add_line_macro(self):
         # This test will get messed up if you change the line number
         out = bsvutil.add_line_macro('typedef enum { Yes, No } YesNo deriving (Bits, Eq, FShow);')
-        self.assertTrue(out.startswith('`line 8 "%s" 0' % __file__))
+        self.assertTrue(out.startswith('`line 20 "%s" 0' % __file__))
 
         out = bsvutil.add_line_macro('''
         typedef enum { Yes, No } YesNo deriving (Bits, Eq, FShow);
         ''')
-        self.assertTrue(out.startswith('`line 11 "%s" 0\n' % __file__))
+        self.assertTrue(out.startswith('`line 23 "%s" 0\n' % __file__))
 
         out = bsvutil.add_line_macro('', file_name='MyFile.bsv', line_number=10)
         self.assertTrue(out.startswith('`line 10 "MyFile.bsv" 0'))
+
+    def test_get_package_dependencies(self):
+        os.makedirs('lib')
+        with open('Top.bsv', 'w') as f:
+            f.write('''
+                import FIFO::*;
+                import Middle :: *;
+                // import Commented::*;
+                /* import AlsoCommented::*; */
+                import Leaf::*;
+                ''')
+        with open(os.path.join('lib', 'Middle.bsv'), 'w') as f:
+            f.write('import Leaf::*;\nimport Vector::*;\n')
+        with open(os.path.join('lib', 'Leaf.bsv'), 'w') as f:
+            f.write('typedef Bit#(8) Byte;\n')
+
+        self.assertEqual(bsvutil.get_bsv_imports('Top.bsv'), ['FIFO', 'Middle', 'Leaf'])
+
+        graph = bsvutil.get_package_dependencies('Top.bsv', ['lib'])
+        self.assertEqual(graph, {
+            'Top' : ('Top.bsv', ['Middle', 'Leaf']),
+            'Middle' : (os.path.join('lib', 'Middle.bsv'), ['Leaf']),
+            'Leaf' : (os.path.join('lib', 'Leaf.bsv'), []) })
@@ -0,0 +1,39 @@
+import unittest
+from bluespecrepl import instancetable
+
+class TestInstanceTable(unittest.TestCase):
+    def setUp(self):
+        hierarchy = {
+                'mkTop' : [('a', 'mkMid'), ('b', 'mkMid'), ('r', 'RegN')],
+                'mkMid' : [('leaf', 'mkLeaf')],
+                'mkLeaf' : [],
+                'RegN' : None }
+        self.table = instancetable.InstanceTable(hierarchy, 'mkTop')
+
+    def test_preorder(self):
+        paths = [ path for _, path in self.table.iter_paths() ]
+        self.assertEqual(paths, ['mkTop', 'mkTop.a', 'mkTop.a.leaf', 'mkTop.b', 'mkTop.b.leaf', 'mkTop.r'])
+        self.assertEqual(len(self.table), 6)
+        for instance_id, path in self.table.iter_paths():
+            self.assertEqual(self.table.get_path(instance_id), path)
+            self.assertEqual(self.table.find(path), instance_id)
+
+    def test_structure(self):
+        b = self.table.find('mkTop.b')
+        self.assertEqual(self.table.get_module(b), 'mkMid')
+        self.assertEqual(self.table.get_name(b), 'b')
+        self.assertEqual(self.table.parent[b], 0)
+        self.assertEqual([ self.table.get_name(x) for x in self.table.get_children(0) ], ['a', 'b', 'r'])
+        self.assertEqual([ self.table.get_path(x) for x in self.table.get_subtree(b) ], ['mkTop.b', 'mkTop.b.leaf'])
+        self.assertEqual([ path for _, path in self.table.iter_paths(b) ], ['mkTop.b', 'mkTop.b.leaf'])
+        self.assertEqual([ self.table.get_path(x) for x in self.table.get_instances_of('mkLeaf') ], ['mkTop.a.leaf', 'mkTop.b.leaf'])
+        self.assertEqual(self.table.get_instances_of('mkMissing'), [])
+        # module and instance names are interned
+        self.assertEqual(self.table.module[self.table.find('mkTop.a')], self.table.module[b])
+        self.assertEqual(self.table.name[self.table.find('mkTop.a.leaf')], self.table.name[self.table.find('mkTop.b.leaf')])
+
+    def test_find_missing(self):
+        with self.assertRaises(KeyError):
+            self.table.find('mkTop.c')
+        with self.assertRaises(KeyError):
+            self.table.find('mkOther.a')
@@ -3,6 +3,7 @@ import tempfile
 import shutil
 import os
 from bluespecrepl import bsvproject
+from bluespecrepl import pyverilatorbsv
 
 class TestPyVerilatorBSV(unittest.TestCase):
     def setUp(self):
@@ -69,3 +70,63 @@ class TestPyVerilatorBSV(unittest.TestCase):
 
         self.assertEqual(resp, 18)
         self.assertFalse(sim.interface.response.get.ready)
+
+    def test_native_step(self):
+        with open('Counter.bsv', 'w') as f:
+            f.write('''
+                (* synthesize *)
+                module mkCounter(Empty);
+                    Reg#(Bit#(32)) count <- mkReg(0);
+                    Reg#(Bit#(32)) other <- mkReg(0);
+
+                    rule incr;
+                        count <= count + 1;
+                    endrule
+
+                    rule incrOther(count[0] == 1);
+                        other <= other + 1;
+                    endrule
+
+                    rule done(count == 100);
+                        $finish;
+                    endrule
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Counter.bsv', top_module = 'mkCounter')
+        sim = proj.gen_python_repl(scheduling_control = True)
+        self.assertIsNotNone(sim._native_step)
+
+        # the native step and the python step do the same thing
+        self.assertEqual(sim.run_bsc_schedule(10), 10)
+        sim.use_native_step = False
+        self.assertEqual(sim.run_bsc_schedule(10), 10)
+        self.assertEqual(sim.bsv.count, 20)
+        self.assertEqual(sim.bsv.other, 10)
+        sim.use_native_step = True
+        sim.set_fire(['RL_incr'])
+        sim.step(5)
+        self.assertEqual(sim.bsv.count, 25)
+        self.assertEqual(sim.bsv.other, 10)
+        # a negative number of cycles isn't passed to bsv_step
+        with self.assertRaises(ValueError):
+            sim.step(-1)
+        self.assertEqual(sim.bsv.count, 25)
+
+        # stop at $finish
+        self.assertEqual(sim.run_bsc_schedule(1000, stop_on_finish = True), 76)
+        self.assertTrue(sim.finished)
+        self.assertEqual(sim.bsv.count, 101)
+
+    def test_add_native_step(self):
+        os.makedirs('obj_dir')
+        wrapper_filename = os.path.join('obj_dir', 'pyverilator_wrapper.cpp')
+        with open(wrapper_filename, 'w') as f:
+            f.write('int set_RST_N(VmkTest* top, uint32_t new_value){ top->RST_N = new_value; return 0;}\n')
+        # designs without a clock can't be stepped natively
+        self.assertFalse(pyverilatorbsv.PyVerilatorBSV.add_native_step('mkTest.v'))
+        with open(wrapper_filename, 'a') as f:
+            f.write('int set_CLK(VmkTest* top, uint32_t new_value){ top->CLK = new_value; return 0;}\n')
+        self.assertTrue(pyverilatorbsv.PyVerilatorBSV.add_native_step('mkTest.v'))
+        with open(wrapper_filename) as f:
+            wrapper = f.read()
+        self.assertIn('uint64_t bsv_step(VmkTest* top, ', wrapper)
@@ -0,0 +1,37 @@
+import unittest
+from bluespecrepl import rulegraph
+from bluespecrepl.tests.fakemodule import FakeModule
+
+class TestRuleGraph(unittest.TestCase):
+    def setUp(self):
+        self.modules = {
+                'mkSub' : FakeModule(['RL_s', 'put'], (), {'RL_s' : ['r.write']}),
+                'mkTop' : FakeModule(
+                    ['RL_a', 'RL_b'],
+                    (('sub0', 'mkSub'), ('sub1', 'mkSub')),
+                    {'RL_a' : ['sub0.put', 'sub1.put'], 'RL_b' : ['sub1.put']},
+                    {'RL_b' : ['RL_a']}) }
+        self.graph = rulegraph.RuleGraph(self.modules, 'mkTop')
+
+    def test_ids(self):
+        for name in ['mkTop.RL_a', 'mkTop.sub0.RL_s', 'mkTop.sub1.put', 'mkTop.sub1.r.write']:
+            self.assertIn(name, self.graph)
+            self.assertEqual(self.graph.get_name(self.graph.get_id(name)), name)
+        self.assertNotIn('mkTop.RL_c', self.graph)
+        self.assertEqual(len(self.graph), len(set(self.graph.names)))
+
+    def test_calls(self):
+        self.assertEqual(self.graph.get_called_methods('mkTop.RL_a'), ['mkTop.sub0.put', 'mkTop.sub1.put'])
+        self.assertEqual(self.graph.get_callers('mkTop.sub1.put'), ['mkTop.RL_a', 'mkTop.RL_b'])
+        self.assertEqual(self.graph.get_callers('mkTop.sub0.put'), ['mkTop.RL_a'])
+        self.assertEqual(self.graph.get_callers('mkTop.sub0.r.write'), ['mkTop.sub0.RL_s'])
+        self.assertTrue(self.graph.calls('mkTop.RL_b', 'mkTop.sub1.put'))
+        self.assertFalse(self.graph.calls('mkTop.RL_b', 'mkTop.sub0.put'))
+        self.assertEqual(self.graph.get_called_methods('mkTop.sub0.put'), [])
+
+    def test_urgency(self):
+        self.assertTrue(self.graph.can_block('mkTop.RL_a', 'mkTop.RL_b'))
+        self.assertFalse(self.graph.can_block('mkTop.RL_b', 'mkTop.RL_a'))
+        self.assertEqual(self.graph.get_blocking_rules('mkTop.RL_b'), ['mkTop.RL_a'])
+        self.assertEqual(self.graph.get_blocked_rules('mkTop.RL_a'), ['mkTop.RL_b'])
+        self.assertEqual(self.graph.get_blocking_rules('mkTop.sub0.RL_s'), [])
@@ -0,0 +1,76 @@
+import unittest
+import tempfile
+import shutil
+import os
+import time
+from bluespecrepl import simstore
+
+class TestSimulatorStore(unittest.TestCase):
+    def setUp(self):
+        self.old_dir = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+
+    def tearDown(self):
+        os.chdir(self.old_dir)
+        shutil.rmtree(self.test_dir)
+
+    def make_so_file(self, name, size):
+        with open(name, 'wb') as f:
+            f.write(b'\0' * size)
+        return name
+
+    def test_simstore_get_put(self):
+        store = simstore.SimulatorStore('store')
+        self.assertFalse(store.get('key', os.path.join('out', 'VmkTest')))
+        store.put('key', self.make_so_file('VmkTest', 100), {'rules' : ['RL_a']})
+        self.assertIn('key', store)
+        self.assertTrue(store.get('key', os.path.join('out', 'VmkTest')))
+        self.assertEqual(os.path.getsize(os.path.join('out', 'VmkTest')), 100)
+        self.assertEqual(store.get_json_data('key'), {'rules' : ['RL_a']})
+
+    def test_simstore_lru_eviction(self):
+        store = simstore.SimulatorStore('store', max_entries = 2)
+        for key in ['a', 'b']:
+            store.put(key, self.make_so_file(key, 10))
+            # make sure the last use times are distinct
+            time.sleep(0.01)
+        # using 'a' makes 'b' the least recently used entry
+        store.get('a', 'out')
+        time.sleep(0.01)
+        store.put('c', self.make_so_file('c', 10))
+        self.assertEqual(sorted(key for key, _, _ in store.get_entries()), ['a', 'c'])
+
+    def test_simstore_size_eviction(self):
+        store = simstore.SimulatorStore('store', max_size = 2500)
+        for key in ['a', 'b', 'c']:
+            store.put(key, self.make_so_file(key, 1000))
+            time.sleep(0.01)
+        self.assertEqual([key for key, _, _ in store.get_entries()], ['b', 'c'])
+
+    def test_simstore_from_environment(self):
+        env_vars = [simstore.SimulatorStore.env_var, simstore.SimulatorStore.max_size_env_var, simstore.SimulatorStore.max_entries_env_var]
+        old_values = { name : os.environ.pop(name, None) for name in env_vars }
+        try:
+            self.assertIsNone(simstore.SimulatorStore.from_environment())
+            # the store is limited by default
+            os.environ[simstore.SimulatorStore.env_var] = 'store'
+            store = simstore.SimulatorStore.from_environment()
+            self.assertEqual(store.cache_dir, 'store')
+            self.assertEqual(store.max_size, simstore.SimulatorStore.default_max_size)
+            self.assertEqual(store.max_entries, simstore.SimulatorStore.default_max_entries)
+            # the limits can be set from the environment, and 0 removes them
+            os.environ[simstore.SimulatorStore.max_size_env_var] = '2500'
+            os.environ[simstore.SimulatorStore.max_entries_env_var] = '0'
+            store = simstore.SimulatorStore.from_environment()
+            self.assertEqual(store.max_size, 2500)
+            self.assertIsNone(store.max_entries)
+            os.environ[simstore.SimulatorStore.max_size_env_var] = 'big'
+            with self.assertRaises(ValueError):
+                simstore.SimulatorStore.from_environment()
+        finally:
+            for name, value in old_values.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
@@ -0,0 +1,64 @@
+import unittest
+import tempfile
+import shutil
+import os
+from bluespecrepl import bsvproject, sweep
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.old_dir = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+
+    def tearDown(self):
+        os.chdir(self.old_dir)
+        shutil.rmtree(self.test_dir)
+
+    def test_build_variants(self):
+        with open('Test.bsv', 'w') as f:
+            f.write('''
+                interface Test;
+                    method Bit#(8) value;
+                endinterface
+                (* synthesize *)
+                module mkTest(Test);
+                `ifdef BROKEN
+                    this is not valid BSV
+                `endif
+                `ifdef BIG
+                    Reg#(Bit#(8)) r <- mkReg(200);
+                `else
+                    Reg#(Bit#(8)) r <- mkReg(7);
+                `endif
+                    method Bit#(8) value = r;
+                endmodule
+                ''')
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest')
+
+        results = sweep.build_variants(proj, [[], ['-D', 'BIG'], ['-D', 'BROKEN']], jobs = 2)
+        self.assertEqual(len(results), 3)
+
+        # each variant is built in its own directory
+        self.assertEqual(results[0].project.build_dir, os.path.join('sweep_dir', 'variant_0', 'build_dir'))
+        self.assertTrue(os.path.isfile(os.path.join('sweep_dir', 'variant_1', 'verilog_dir', 'mkTest.v')))
+        # the base project is unchanged
+        self.assertFalse(os.path.exists('build_dir'))
+
+        self.assertTrue(results[0].succeeded())
+        self.assertEqual(results[0].sim.interface.value(), 7)
+        self.assertTrue(results[1].succeeded())
+        self.assertEqual(results[1].sim.interface.value(), 200)
+
+        # the broken variant reports its error without affecting the others
+        self.assertFalse(results[2].succeeded())
+        self.assertIsNone(results[2].sim)
+        self.assertIsInstance(results[2].error, Exception)
+
+    def test_make_variant_has_own_build_manifests(self):
+        proj = bsvproject.BSVProject(top_file = 'Test.bsv', top_module = 'mkTest', v_path = [])
+        proj.get_build_manifest()
+        variant = proj.make_variant('variant_dir', ['-D', 'BIG'])
+        self.assertEqual(variant.build_manifests, {})
+        self.assertIsNot(variant.build_manifests_lock, proj.build_manifests_lock)
+        variant.get_build_manifest()
+        self.assertEqual(list(proj.build_manifests.keys()), [os.path.join('build_dir', bsvproject.BSVProject.build_manifest_name)])
@@ -0,0 +1,300 @@
+import unittest
+import tempfile
+import shutil
+import os
+import stat
+import pickle
+import pyverilog.vparser.ast as ast
+from bluespecrepl import verilog_mutator
+from bluespecrepl import verilog_text_editor
+
+# verilog in the style of bsc output
+test_verilog = '''
+module mkTest(CLK, RST_N, EN_go, RDY_go);
+  input  CLK;
+  input  RST_N;
+  input  EN_go;
+  output RDY_go;
+  wire RDY_go;
+  reg [7 : 0] count;
+  wire [7 : 0] count$D_IN;
+  wire count$EN;
+  wire CAN_FIRE_RL_a, WILL_FIRE_RL_a;
+  wire CAN_FIRE_RL_b, WILL_FIRE_RL_b;
+  wire sub$EN_go, sub$RDY_go;
+  assign RDY_go = 1'd1 ;
+  assign CAN_FIRE_RL_a = count[0] ;
+  assign WILL_FIRE_RL_a = CAN_FIRE_RL_a && !EN_go ;
+  assign CAN_FIRE_RL_b = count[1] ;
+  assign WILL_FIRE_RL_b = CAN_FIRE_RL_b ;
+  assign count$D_IN = count + 8'd1 ;
+  assign count$EN = 1'd1 ;
+  assign sub$EN_go = 1'd1 ;
+  mkSub sub(.CLK(CLK), .RST_N(RST_N), .EN_go(sub$EN_go), .RDY_go(sub$RDY_go));
+  always@(posedge CLK)
+  begin
+    if (count$EN) count <= count$D_IN;
+  end
+endmodule
+'''
+
+class TestVerilogMutator(unittest.TestCase):
+    def setUp(self):
+        self.old_dir = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+        with open('mkTest.v', 'w') as f:
+            f.write(test_verilog)
+
+    def tearDown(self):
+        os.chdir(self.old_dir)
+        shutil.rmtree(self.test_dir)
+
+    def test_index(self):
+        mutator = verilog_mutator.VerilogMutator('mkTest.v')
+        self.assertEqual(mutator.get_submodules(), [('sub', 'mkSub')])
+        self.assertEqual(mutator.get_instance('sub').module, 'mkSub')
+        self.assertIsNone(mutator.get_instance('missing'))
+        self.assertEqual(mutator.get_rules_in_scheduling_order(), ['a', 'b'])
+        self.assertEqual(mutator.get_inputs(), [('CLK', 1), ('RST_N', 1), ('EN_go', 1)])
+        self.assertEqual(mutator.get_outputs(), [('RDY_go', 1)])
+        self.assertEqual([type(x) for x in mutator.get_decls('RDY_go')], [ast.Output, ast.Wire])
+        # the indexed search matches a search from a custom root
+        self.assertEqual([x.name for x in mutator.get_nodes_by_type(ast.Wire)],
+                [x.name for x in mutator.get_nodes_by_type(ast.Wire, mutator.module)])
+        # nested = False doesn't search inside matching nodes
+        self.assertEqual(len(mutator.get_nodes_by_type(ast.Assign, nested = False)), len(mutator.get_assigns()))
+        self.assertEqual(mutator.get_nodes_by_type(ast.ModuleDef, nested = False), [mutator.module])
+        self.assertEqual(mutator.get_assign('WILL_FIRE_RL_a').right.var.left.name, 'CAN_FIRE_RL_a')
+        with self.assertRaises(ValueError):
+            mutator.get_assign('count')
+
+    def test_index_after_mutation(self):
+        mutator = verilog_mutator.VerilogMutator('mkTest.v')
+        num_rules = mutator.expose_internal_scheduling_signals(num_rules_per_module = {'mkSub' : 2})
+        self.assertEqual(num_rules, 4)
+        # the indexes include the added nodes
+        self.assertEqual([type(x) for x in mutator.get_decls('BLOCK_FIRE')], [ast.Input])
+        self.assertEqual([type(x) for x in mutator.get_decls('CAN_FIRE')], [ast.Output, ast.Wire])
+        self.assertIn(('BLOCK_FIRE', 4), mutator.get_inputs())
+        self.assertIn(('CAN_FIRE', 4), mutator.get_outputs())
+        self.assertIn('BLOCK_FIRE_RL_a', mutator.get_decl_names(ast.Wire))
+        self.assertIn('CAN_FIRE_MODULE_sub', mutator.get_decl_names(ast.Wire))
+        port_names = [x.portname for x in mutator.get_nodes_by_type(ast.PortArg)]
+        self.assertIn('BLOCK_FIRE', port_names)
+        # WILL_FIRE_RL_a keeps its original assign, which now depends on BLOCK_FIRE_RL_a
+        self.assertEqual(mutator.get_assign('WILL_FIRE_RL_a').right.var.left.right.name, 'BLOCK_FIRE_RL_a')
+        self.assertEqual(mutator.get_assign('BLOCK_FIRE_MODULE_sub').right.var.var.name, 'BLOCK_FIRE')
+        # the indexed search still matches a search of the mutated AST
+        self.assertEqual(len(mutator.get_nodes_by_type(ast.Identifier)), len(mutator.get_nodes_by_type(ast.Identifier, mutator.ast_root.description)))
+
+    def test_batch(self):
+        def mutate(mutator):
+            mutator.add_decls('x', ast.Wire)
+            mutator.add_assign('x', ast.Identifier('EN_go'))
+            mutator.add_decls('y', ast.Wire, width = 2)
+            mutator.add_assign('y', ast.Concat([ast.Identifier('x'), ast.Identifier('x')]))
+            mutator.add_ports(['z'])
+            mutator.add_decls('z', ast.Output)
+            mutator.add_port_arg('sub', 'CAN_FIRE', 'x')
+        unbatched = verilog_mutator.VerilogMutator('mkTest.v')
+        mutate(unbatched)
+        batched = verilog_mutator.VerilogMutator('mkTest.v')
+        num_items = len(batched.module.items)
+        with batched.batch():
+            mutate(batched)
+            # nothing is applied until the end of the batch
+            self.assertEqual(len(batched.module.items), num_items)
+            with self.assertRaises(ValueError):
+                batched.start_batch()
+        self.assertEqual(batched.get_verilog(), unbatched.get_verilog())
+        self.assertEqual([type(x) for x in batched.get_decls('z')], [ast.Output])
+        with self.assertRaises(ValueError):
+            batched.commit_batch()
+
+    def test_edited_verilog(self):
+        for add_force_fire in [False, True]:
+            mutator = verilog_mutator.VerilogMutator('mkTest.v')
+            mutator.expose_internal_scheduling_signals(num_rules_per_module = {'mkSub' : 2}, add_force_fire = add_force_fire)
+            mutator.write_verilog('mkTest_edited.v', splice = True)
+            with open('mkTest_edited.v') as f:
+                edited_verilog = f.read()
+            # the edited verilog parses to the same verilog as the mutated AST
+            self.assertEqual(verilog_mutator.VerilogMutator('mkTest_edited.v').get_verilog(), mutator.get_verilog())
+            # and the lines that weren't changed are kept as they are
+            edited_lines = edited_verilog.splitlines()
+            for line in test_verilog.splitlines():
+                if 'WILL_FIRE_RL_' not in line and not line.startswith('module') and 'mkSub sub' not in line:
+                    self.assertIn(line, edited_lines)
+            self.assertIn('  assign WILL_FIRE_RL_a = ' + mutator.codegen.visit(mutator.get_assign('WILL_FIRE_RL_a').right) + ' ;', edited_lines)
+            self.assertEqual(edited_lines[-5:], test_verilog.splitlines()[-5:])
+        # unedited verilog is written as it is
+        mutator = verilog_mutator.VerilogMutator('mkTest.v')
+        self.assertEqual(mutator.get_edited_verilog(), test_verilog)
+        # by default the verilog is regenerated from the AST, so untracked changes aren't lost
+        mutator.module.name = 'mkRenamed'
+        mutator.write_verilog('mkRenamed.v')
+        with open('mkRenamed.v') as f:
+            self.assertEqual(f.read(), mutator.get_verilog())
+        self.assertIn('module mkRenamed', mutator.get_verilog())
+        # verilog that VerilogTextEditor doesn't support is regenerated from the AST
+        with open('mkGenerate.v', 'w') as f:
+            f.write(test_verilog.replace('endmodule', 'generate\nendgenerate\nendmodule'))
+        mutator = verilog_mutator.VerilogMutator('mkGenerate.v')
+        mutator.expose_internal_scheduling_signals(num_rules_per_module = {'mkSub' : 2})
+        self.assertEqual(mutator.get_edited_verilog(), mutator.get_verilog())
+
+    def test_pickle(self):
+        mutator = pickle.loads(pickle.dumps(verilog_mutator.VerilogMutator('mkTest.v')))
+        self.assertEqual(mutator.get_submodules(), [('sub', 'mkSub')])
+        self.assertEqual(mutator.expose_internal_scheduling_signals(num_rules_per_module = {'mkSub' : 2}), 4)
+        # the recorded edits are pickled too
+        unpickled_mutator = pickle.loads(pickle.dumps(mutator))
+        self.assertEqual(unpickled_mutator.get_edited_verilog(), mutator.get_edited_verilog())
+        self.assertNotEqual(mutator.get_edited_verilog(), test_verilog)
+        with mutator.batch():
+            with self.assertRaises(ValueError):
+                pickle.dumps(mutator)
+
+    def test_add_scheduling_signals(self):
+        os.makedirs('in')
+        shutil.move('mkTest.v', 'in')
+        with open(os.path.join('in', 'mkSub.v'), 'w') as f:
+            f.write(test_verilog.replace('mkTest', 'mkSub').replace('mkSub sub', 'FIFO2 sub'))
+        # mutate the modules one at a time from the leaf module to the top module
+        sub_mutator = verilog_mutator.VerilogMutator(os.path.join('in', 'mkSub.v'))
+        sub_num_rules = sub_mutator.expose_internal_scheduling_signals(num_rules_per_module = {})
+        top_mutator = verilog_mutator.VerilogMutator(os.path.join('in', 'mkTest.v'))
+        top_mutator.expose_internal_scheduling_signals(num_rules_per_module = {'mkSub' : sub_num_rules})
+        for jobs in [1, 2]:
+            out_dir = 'out%d' % jobs
+            rule_names = verilog_mutator.add_scheduling_signals('in', out_dir, jobs = jobs, use_text_mutator = False)
+            self.assertEqual(rule_names, {'mkSub' : ['RL_a', 'RL_b'], 'mkTest' : ['RL_a', 'RL_b', 'sub__DOT__RL_a', 'sub__DOT__RL_b']})
+            with open(os.path.join(out_dir, 'mkSub.v')) as f:
+                self.assertEqual(f.read(), sub_mutator.get_edited_verilog())
+            with open(os.path.join(out_dir, 'mkTest.v')) as f:
+                self.assertEqual(f.read(), top_mutator.get_edited_verilog())
+        # the text mutator's output parses to the same verilog
+        rule_names = verilog_mutator.add_scheduling_signals('in', 'out_text', jobs = 2)
+        self.assertEqual(rule_names, {'mkSub' : ['RL_a', 'RL_b'], 'mkTest' : ['RL_a', 'RL_b', 'sub__DOT__RL_a', 'sub__DOT__RL_b']})
+        self.assertEqual(verilog_mutator.VerilogMutator(os.path.join('out_text', 'mkSub.v')).get_verilog(), sub_mutator.get_verilog())
+        self.assertEqual(verilog_mutator.VerilogMutator(os.path.join('out_text', 'mkTest.v')).get_verilog(), top_mutator.get_verilog())
+
+    def test_incremental_scheduling_signals(self):
+        os.makedirs('in')
+        shutil.move('mkTest.v', 'in')
+        sub_verilog = test_verilog.replace('mkTest', 'mkSub').replace('mkSub sub', 'FIFO2 sub')
+        with open(os.path.join('in', 'mkSub.v'), 'w') as f:
+            f.write(sub_verilog)
+        with open(os.path.join('in', 'mkOther.v'), 'w') as f:
+            f.write(sub_verilog.replace('mkSub', 'mkOther'))
+        def run():
+            # set the modification times of the outputs so rewritten outputs can be detected
+            for filename in os.listdir('out'):
+                os.utime(os.path.join('out', filename), (0, 0))
+            rule_names = verilog_mutator.add_scheduling_signals('in', 'out', jobs = 1, use_cache = True)
+            self.assertEqual(rule_names, verilog_mutator.add_scheduling_signals('in', 'out_uncached', jobs = 1))
+            for module in ['mkTest', 'mkSub', 'mkOther']:
+                with open(os.path.join('out', module + '.v')) as f, open(os.path.join('out_uncached', module + '.v')) as g:
+                    self.assertEqual(f.read(), g.read())
+            return sorted(module for module in ['mkTest', 'mkSub', 'mkOther'] if os.stat(os.path.join('out', module + '.v')).st_mtime != 0)
+        os.makedirs('out')
+        self.assertEqual(run(), ['mkOther', 'mkSub', 'mkTest'])
+        self.assertEqual(run(), [])
+        # same number of rules in mkSub, so mkTest doesn't change
+        with open(os.path.join('in', 'mkSub.v'), 'w') as f:
+            f.write(sub_verilog.replace("8'd1", "8'd2"))
+        self.assertEqual(run(), ['mkSub'])
+        # a new rule in mkSub changes the scheduling signals of mkTest
+        with open(os.path.join('in', 'mkSub.v'), 'w') as f:
+            f.write(sub_verilog.replace('  wire CAN_FIRE_RL_b, WILL_FIRE_RL_b;', '  wire CAN_FIRE_RL_b, WILL_FIRE_RL_b;\n  wire CAN_FIRE_RL_c, WILL_FIRE_RL_c;')
+                    .replace('  assign CAN_FIRE_RL_b = count[1] ;', '  assign CAN_FIRE_RL_b = count[1] ;\n  assign CAN_FIRE_RL_c = count[2] ;\n  assign WILL_FIRE_RL_c = CAN_FIRE_RL_c ;'))
+        self.assertEqual(run(), ['mkSub', 'mkTest'])
+        # modified outputs are written again
+        with open(os.path.join('out', 'mkOther.v'), 'a') as f:
+            f.write('\n')
+        self.assertEqual(run(), ['mkOther'])
+
+    def test_text_mutator(self):
+        for num_rules_per_module in [None, {'mkSub' : 1}, {'mkSub' : 3}]:
+            for add_force_fire in [False, True]:
+                mutator = verilog_mutator.VerilogMutator('mkTest.v')
+                text_mutator = verilog_mutator.TextVerilogMutator('mkTest.v')
+                self.assertEqual(text_mutator.get_default_scheduling_order(), mutator.get_default_scheduling_order())
+                self.assertEqual(text_mutator.get_submodules(), mutator.get_submodules())
+                self.assertEqual(text_mutator.expose_internal_scheduling_signals(num_rules_per_module = num_rules_per_module, add_force_fire = add_force_fire),
+                        mutator.expose_internal_scheduling_signals(num_rules_per_module = num_rules_per_module, add_force_fire = add_force_fire))
+                # same signals with the same bit layout in the same places
+                text_mutator.write_verilog('mkTest_text.v')
+                self.assertEqual(verilog_mutator.VerilogMutator('mkTest_text.v').get_verilog(), mutator.get_verilog())
+        # anything the text mutator doesn't recognize has to go through VerilogMutator
+        with open('mkGenerate.v', 'w') as f:
+            f.write(test_verilog.replace('endmodule', 'generate\nendgenerate\nendmodule'))
+        with self.assertRaises(verilog_text_editor.UnsupportedVerilogError):
+            verilog_mutator.TextVerilogMutator('mkGenerate.v')
+
+    def test_shared_parser(self):
+        self.assertIs(verilog_mutator.get_verilog_parser(), verilog_mutator.get_verilog_parser())
+        with open('mkOther.v', 'w') as f:
+            f.write(test_verilog.replace('mkTest', 'mkOther'))
+        # both files are preprocessed together and then parsed separately by the same parser
+        preprocessed_verilog = verilog_mutator.preprocess_verilog_files(['mkTest.v', 'mkOther.v'])
+        self.assertEqual(len(preprocessed_verilog), 2)
+        mutators = [verilog_mutator.VerilogMutator(filename, preprocessed_verilog = text) for filename, text in zip(['mkTest.v', 'mkOther.v'], preprocessed_verilog)]
+        self.assertEqual([mutator.module.name for mutator in mutators], ['mkTest', 'mkOther'])
+        self.assertEqual(mutators[1].module.lineno, mutators[0].module.lineno)
+        self.assertEqual(mutators[1].get_verilog(), verilog_mutator.VerilogMutator('mkOther.v').get_verilog())
+
+    def test_parser_tables(self):
+        original_tables_dir = verilog_mutator.verilog_parser_tables_dir
+        original_parser = verilog_mutator._verilog_parser
+        try:
+            verilog_mutator.verilog_parser_tables_dir = os.path.abspath('tables')
+            verilog_mutator._verilog_parser = None
+            parser = verilog_mutator.get_verilog_parser()
+            tables_filename = os.path.join('tables', os.listdir('tables')[0])
+            self.assertEqual(stat.S_IMODE(os.stat('tables').st_mode), 0o700)
+            self.assertEqual(stat.S_IMODE(os.stat(tables_filename).st_mode), 0o600)
+            # tables that someone else could have written are not loaded, they are generated again
+            class Payload:
+                def __reduce__(self):
+                    return (os.mkdir, (os.path.abspath('loaded'),))
+            with open(tables_filename, 'wb') as f:
+                pickle.dump(Payload(), f)
+            os.chmod(tables_filename, 0o622)
+            verilog_mutator._verilog_parser = None
+            self.assertIsNot(verilog_mutator.get_verilog_parser(), parser)
+            self.assertFalse(os.path.exists('loaded'))
+            self.assertEqual(stat.S_IMODE(os.stat(tables_filename).st_mode), 0o600)
+            verilog_mutator.parse_verilog_text(test_verilog)
+        finally:
+            verilog_mutator.verilog_parser_tables_dir = original_tables_dir
+            verilog_mutator._verilog_parser = original_parser
+
+    def test_ast_cache(self):
+        expected_verilog = verilog_mutator.VerilogMutator('mkTest.v').get_verilog()
+        mutator = verilog_mutator.VerilogMutator('mkTest.v', ast_cache_dir = 'ast_cache')
+        self.assertEqual(mutator.get_verilog(), expected_verilog)
+        self.assertEqual(len(os.listdir('ast_cache')), 1)
+        # mutating the AST doesn't change the cached AST
+        mutator.expose_internal_scheduling_signals()
+        original_parse_verilog_text = verilog_mutator.parse_verilog_text
+        try:
+            def fail(text):
+                raise Exception('the cached AST was not used')
+            verilog_mutator.parse_verilog_text = fail
+            mutator = verilog_mutator.VerilogMutator('mkTest.v', ast_cache_dir = 'ast_cache')
+            self.assertEqual(mutator.get_verilog(), expected_verilog)
+            self.assertEqual(mutator.get_submodules(), [('sub', 'mkSub')])
+        finally:
+            verilog_mutator.parse_verilog_text = original_parse_verilog_text
+        # a changed file gets a new entry
+        with open('mkTest.v', 'a') as f:
+            f.write('\n')
+        verilog_mutator.VerilogMutator('mkTest.v', ast_cache_dir = 'ast_cache')
+        self.assertEqual(len(os.listdir('ast_cache')), 2)
+        # so does the same file preprocessed differently (e.g. after other files defined macros)
+        preprocessed_verilog = test_verilog.replace('mkTest', 'mkRenamed')
+        mutator = verilog_mutator.VerilogMutator('mkTest.v', ast_cache_dir = 'ast_cache', preprocessed_verilog = preprocessed_verilog)
+        self.assertEqual(mutator.module.name, 'mkRenamed')
+        self.assertEqual(len(os.listdir('ast_cache')), 3)
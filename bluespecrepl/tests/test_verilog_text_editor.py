@@ -0,0 +1,106 @@
+import unittest
+from bluespecrepl import verilog_text_editor
+
+# verilog in the style of bsc output, including its preprocessor directives
+test_verilog = '''
+`ifdef BSV_ASSIGNMENT_DELAY
+`else
+  `define BSV_ASSIGNMENT_DELAY
+`endif
+
+module mkTest(CLK,
+	      RST_N,
+	      EN_go,
+	      RDY_go);
+  input  CLK;
+  input  RST_N;
+
+  // action method go
+  input  EN_go;
+  output RDY_go;
+  wire RDY_go;
+  reg [7 : 0] count;
+  wire [7 : 0] count$D_IN;
+  wire count$EN;
+  wire sub$EN_go, sub$RDY_go;
+  wire CAN_FIRE_RL_a, WILL_FIRE_RL_a;
+  wire CAN_FIRE_RL_b, WILL_FIRE_RL_b;
+  assign RDY_go = 1'd1 ;
+  // submodule sub
+  mkSub #(.width(32'd8)) sub(.CLK(CLK),
+			    .RST_N(RST_N),
+			    .EN_go(sub$EN_go),
+			    .RDY_go(sub$RDY_go));
+  assign CAN_FIRE_RL_a = count[0] ;
+  assign WILL_FIRE_RL_a =
+	     CAN_FIRE_RL_a && !EN_go &&
+	     (count == 8'd3 || count[3:0] != 4'hA) ;
+  assign CAN_FIRE_RL_b = count[1] ;
+  assign WILL_FIRE_RL_b = CAN_FIRE_RL_b ;
+  assign count$D_IN = count + 8'd1 ;
+  assign count$EN = 1'd1 ;
+  assign sub$EN_go = 1'd1 ;
+  always@(posedge CLK)
+  begin
+    if (count$EN) count <= `BSV_ASSIGNMENT_DELAY count$D_IN;
+  end
+  // synopsys translate_off
+  `ifdef BSV_NO_INITIAL_BLOCKS
+  `else // not BSV_NO_INITIAL_BLOCKS
+  initial
+  begin
+    count = 8'hAA;
+    case (count) 8'd0: $display("end"); endcase
+  end
+  `endif // BSV_NO_INITIAL_BLOCKS
+  // synopsys translate_on
+endmodule  // mkTest
+'''
+
+class TestVerilogTextEditor(unittest.TestCase):
+    def test_scan(self):
+        editor = verilog_text_editor.VerilogTextEditor(test_verilog)
+        self.assertEqual(editor.module_name, 'mkTest')
+        self.assertEqual(editor.submodules, [('sub', 'mkSub')])
+        self.assertEqual(editor.decl_names[:4], ['CLK', 'RST_N', 'EN_go', 'RDY_go'])
+        self.assertEqual([x for x in editor.decl_names if x.startswith('CAN_FIRE_RL_')], ['CAN_FIRE_RL_a', 'CAN_FIRE_RL_b'])
+        self.assertEqual(editor.get_assign_rhs('WILL_FIRE_RL_b'), ' CAN_FIRE_RL_b ')
+        self.assertIn("(count == 8'd3 || count[3:0] != 4'hA)", editor.get_assign_rhs('WILL_FIRE_RL_a'))
+        with self.assertRaises(ValueError):
+            editor.get_assign_rhs('count')
+        # no edits
+        self.assertEqual(editor.get_text(), test_verilog)
+
+    def test_edits(self):
+        editor = verilog_text_editor.VerilogTextEditor(test_verilog)
+        editor.add_decl('wire x;')
+        editor.add_assign('x', 'EN_go')
+        editor.add_decl('output y;')
+        editor.add_ports(['y'])
+        editor.add_port_arg('sub', 'CAN_FIRE', 'x')
+        editor.replace_assign_rhs('WILL_FIRE_RL_b', ' x ')
+        text = editor.get_text()
+        self.assertIn('\t      RDY_go, y);', text)
+        self.assertIn('  wire CAN_FIRE_RL_b, WILL_FIRE_RL_b;\n  wire x;\n  output y;\n', text)
+        self.assertIn('  assign sub$EN_go = 1\'d1 ;\n  assign x = EN_go ;\n', text)
+        self.assertIn('.RDY_go(sub$RDY_go), .CAN_FIRE(x));', text)
+        self.assertIn('assign WILL_FIRE_RL_b = x ;', text)
+        # the rest of the text is unchanged
+        self.assertEqual(len(text), len(test_verilog) + len(', y') + len('\n  wire x;\n  output y;') + len('\n  assign x = EN_go ;') + len(', .CAN_FIRE(x)') + len(' x ') - len(' CAN_FIRE_RL_b '))
+        # the edited text can be edited again
+        editor = verilog_text_editor.VerilogTextEditor(text)
+        self.assertEqual(editor.get_assign_rhs('x'), ' EN_go ')
+        self.assertIn('y', editor.decl_names)
+
+    def test_unsupported(self):
+        unsupported = [
+                # the scheduling signals could end up inside the `ifdef
+                test_verilog.replace('  wire count$EN;\n', '`ifdef FOO\n  wire count$EN;\n`endif\n'),
+                test_verilog.replace('  assign sub$EN_go', '  generate\n  endgenerate\n  assign sub$EN_go'),
+                test_verilog.replace('sub(.CLK', 'sub[1:0](.CLK'),
+                test_verilog.replace('wire count$EN;', 'wire count$EN = 1\'d1;'),
+                test_verilog + 'module mkOther();\nendmodule\n',
+                test_verilog.replace('endmodule', '')]
+        for verilog in unsupported:
+            with self.assertRaises(verilog_text_editor.UnsupportedVerilogError):
+                verilog_text_editor.VerilogTextEditor(verilog)
@@ -1,14 +1,329 @@
 import io
 import os
-from pyverilog.vparser.parser import parse
+import re
+import json
+import stat
+import pickle
+import tempfile
+import contextlib
+import concurrent.futures
+import pyverilog
+import pyverilog.vparser.parser as vparser
+from pyverilog.vparser.preprocessor import VerilogPreprocessor
 import pyverilog.vparser.ast as ast
 from pyverilog.ast_code_generator.codegen import ASTCodeGenerator, ConvertVisitor
+import bluespecrepl.buildcache as buildcache
+import bluespecrepl.verilog_text_editor as verilog_text_editor
 
-def add_scheduling_signals(bsc_vdir, out_dir):
+# version of the format of the files in AST caches
+ast_cache_version = 2
+
+def get_pyverilog_version():
+    """Returns the version of pyverilog, which is part of the key of cached ASTs."""
+    if hasattr(pyverilog, '__version__'):
+        return pyverilog.__version__
+    # older versions of pyverilog only have the version in pyverilog.utils.version
+    from pyverilog.utils.version import VERSION
+    return VERSION
+
+# per-user directory where the PLY parser tables are kept between processes
+verilog_parser_tables_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'bluespecrepl')
+# parser shared by all parses in this process (see get_verilog_parser)
+_verilog_parser = None
+
+class _VerilogParser(vparser.VerilogParser):
+    """VerilogParser that loads its PLY tables from tables_filename.
+
+    VerilogParser.__init__ can't be used since it regenerates the tables every
+    time (PLY looks for them next to pyverilog instead of in its output
+    directory) and it has no option for a PLY table file. The tables don't
+    depend on the lexer, so the parser is built once and new_lexer gives each
+    parse a lexer without any state from the previous parse."""
+    def __init__(self, tables_filename):
+        self.new_lexer()
+        self.parser = vparser.yacc(module = self, method = 'LALR', picklefile = tables_filename, debug = False)
+
+    def new_lexer(self):
+        self.lexer = vparser.VerilogLexer(error_func = self._lexer_error_func)
+        self.lexer.build()
+        self.tokens = self.lexer.tokens
+
+def _is_private_file(filename):
+    """Returns True if filename exists, is owned by the current user, and can't be written by anyone else."""
+    try:
+        file_stat = os.stat(filename)
+    except OSError:
+        return False
+    return file_stat.st_uid == os.getuid() and not (file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+def get_verilog_parser():
+    """Returns the pyverilog VerilogParser shared by all parses in this process.
+
+    The parser is constructed the first time this is called. Its PLY tables
+    are kept in verilog_parser_tables_dir, so only the first process of a
+    user to construct a parser for a version of pyverilog has to generate
+    them. The tables are pickled, so they are only loaded if they are owned
+    by the current user and nobody else can write them. Worker processes
+    forked after this is called share the parser too.
+    """
+    global _verilog_parser
+    if _verilog_parser is None:
+        tables_filename = os.path.join(verilog_parser_tables_dir, 'parser_tables_%s.pickle' % get_pyverilog_version())
+        if _is_private_file(tables_filename):
+            try:
+                with open(tables_filename, 'rb') as f:
+                    pickle.load(f)
+                _verilog_parser = _VerilogParser(tables_filename)
+            except Exception:
+                # corrupted tables are generated again
+                pass
+        if _verilog_parser is None:
+            # the tables are written to a temporary file first so processes
+            # constructing parsers at the same time don't read incomplete tables
+            os.makedirs(verilog_parser_tables_dir, mode = 0o700, exist_ok = True)
+            tmp_filename = '%s.%d.tmp' % (tables_filename, os.getpid())
+            _verilog_parser = _VerilogParser(tmp_filename)
+            os.chmod(tmp_filename, 0o600)
+            os.replace(tmp_filename, tables_filename)
+    return _verilog_parser
+
+def parse_verilog_text(text):
+    """Parses preprocessed verilog source and returns an (ast, directives) tuple."""
+    parser = get_verilog_parser()
+    # the lexer keeps the line number and directives of the previous parse
+    parser.new_lexer()
+    ast_root = parser.parse(text, debug = 0)
+    return ast_root, parser.get_directives()
+
+# line that separates the files in the output of preprocess_verilog_files
+_file_boundary_re = re.compile(r'__bluespecrepl_file_boundary__ ([0-9]+)\n')
+
+def _run_preprocessor(verilog_file_paths, tmp_dir):
+    output_filename = os.path.join(tmp_dir, 'preprocess.output')
+    VerilogPreprocessor(verilog_file_paths, output_filename, [], []).preprocess()
+    with open(output_filename) as f:
+        return f.read()
+
+def preprocess_verilog_files(verilog_file_paths):
+    """Preprocesses verilog files and returns a list of their preprocessed sources.
+
+    All the files are preprocessed by a single invocation of iverilog, so
+    macros defined by a file are also defined in the files after it (as when
+    the files are compiled together by verilator). If the output can't be
+    split into the files (e.g. because of an unterminated `ifdef), the files
+    are preprocessed one at a time instead. The preprocessor output goes to
+    a temporary directory instead of the current directory, so several
+    processes can preprocess files at the same time.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(verilog_file_paths) > 1:
+            # put a file containing a boundary line before each file
+            file_list = []
+            for i, verilog_file_path in enumerate(verilog_file_paths):
+                boundary_filename = os.path.join(tmp_dir, 'boundary%d.v' % i)
+                with open(boundary_filename, 'w') as f:
+                    f.write('\n__bluespecrepl_file_boundary__ %d\n' % i)
+                file_list += [boundary_filename, verilog_file_path]
+            try:
+                pieces = _file_boundary_re.split(_run_preprocessor(file_list, tmp_dir))
+                # pieces alternates between the text between boundaries and the indexes of the boundaries
+                if pieces[1::2] == [str(i) for i in range(len(verilog_file_paths))]:
+                    return pieces[2::2]
+            except Exception:
+                pass
+            print('WARNING: preprocessing the verilog files one at a time')
+        return [_run_preprocessor([verilog_file_path], tmp_dir) for verilog_file_path in verilog_file_paths]
+
+def parse_verilog_file(verilog_file_path):
+    """Parses a verilog file and returns an (ast, directives) tuple."""
+    return parse_verilog_text(preprocess_verilog_files([verilog_file_path])[0])
+
+def get_ast_cache_filename(preprocessed_verilog, ast_cache_dir):
+    """Returns the name of the file in ast_cache_dir for the AST of preprocessed verilog source.
+
+    The key is the preprocessed source instead of the verilog file, since the
+    macros defined by the files preprocessed before a file (see
+    preprocess_verilog_files) can change its preprocessed source."""
+    key = buildcache.hash_data({
+        'preprocessed_verilog' : buildcache.hash_data(preprocessed_verilog),
+        'pyverilog_version' : get_pyverilog_version(),
+        'ast_cache_version' : ast_cache_version })
+    return os.path.join(ast_cache_dir, key + '.pickle')
+
+def load_verilog_file(verilog_file_path, ast_cache_dir = None, preprocessed_verilog = None):
+    """Returns an (ast, directives) tuple for a verilog file.
+
+    If the file has already been preprocessed (e.g. by
+    preprocess_verilog_files), its preprocessed source can be passed as
+    preprocessed_verilog. If ast_cache_dir is not None, the AST is loaded
+    from ast_cache_dir if the same preprocessed source was parsed before with
+    the same version of pyverilog. Otherwise the preprocessed source is
+    parsed and the AST is added to ast_cache_dir.
+    """
+    if preprocessed_verilog is None:
+        preprocessed_verilog = preprocess_verilog_files([verilog_file_path])[0]
+    if ast_cache_dir is None:
+        return parse_verilog_text(preprocessed_verilog)
+    cache_filename = get_ast_cache_filename(preprocessed_verilog, ast_cache_dir)
+    try:
+        with open(cache_filename, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        # missing or corrupted entries are parsed again
+        pass
+    ast_root, directives = parse_verilog_text(preprocessed_verilog)
+    os.makedirs(ast_cache_dir, exist_ok = True)
+    # write to a temporary file first so an interrupted write or a parallel
+    # parse of the same file doesn't corrupt the entry
+    tmp_filename = '%s.%d.tmp' % (cache_filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump((ast_root, directives), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, cache_filename)
+    except RecursionError:
+        # very deeply nested expressions can't be pickled, so this file isn't cached
+        os.remove(tmp_filename)
+    return ast_root, directives
+
+def get_scheduling_signal_layout(scheduling_order, submodules, num_rules_per_module = None):
+    """Returns the bits of the scheduling signals added by expose_internal_scheduling_signals.
+
+    scheduling_order is a list of 'RL_<rule>' and 'MODULE_<instance>' names,
+    submodules is a list of (instance_name, module_name) tuples, and
+    num_rules_per_module maps module names to their number of rules.
+    Submodules without known rules get no bits.
+
+    Returns a (total_num_bits, layout) tuple where layout is a list of (name,
+    lsb, num_bits) tuples in the order of scheduling_order.
+    """
+    instance_to_module = dict(submodules)
+    total_num_bits = 0
+    layout = []
+    for name in scheduling_order:
+        if name.startswith('RL_'):
+            num_bits = 1
+        elif name.startswith('MODULE_'):
+            module_name = instance_to_module[name[len('MODULE_'):]]
+            if num_rules_per_module is None or num_rules_per_module.get(module_name, 0) == 0:
+                continue
+            num_bits = num_rules_per_module[module_name]
+        elif name.startswith('METH_'):
+            raise ValueError('"METH_" scheduling signals are not supported yet')
+        else:
+            raise ValueError('unexpected entry "%s" in scheduling_order' % name)
+        layout.append((name, total_num_bits, num_bits))
+        total_num_bits += num_bits
+    return total_num_bits, layout
+
+# name of the file in out_dir that records the modules written by add_scheduling_signals
+scheduling_cache_name = 'bluespecrepl_scheduling_signals.json'
+# incremented whenever the verilog written by add_scheduling_signals changes
+scheduling_cache_version = 2
+
+def _load_mutator(verilog_filename, ast_cache_dir, use_text_mutator):
+    if use_text_mutator:
+        try:
+            return TextVerilogMutator(verilog_filename)
+        except verilog_text_editor.UnsupportedVerilogError:
+            # fall back to parsing the verilog
+            pass
+    return VerilogMutator(verilog_filename, ast_cache_dir = ast_cache_dir)
+
+def _parse_module(verilog_filename, ast_cache_dir, use_text_mutator, preprocessed_verilog = None):
+    """Worker for add_scheduling_signals that parses a module.
+
+    Returns the submodules and the default scheduling order of the module and
+    the pickled TextVerilogMutator or VerilogMutator, which is only unpickled
+    by the worker that mutates it. If use_text_mutator is True, this returns
+    None for modules that TextVerilogMutator doesn't support."""
+    if use_text_mutator:
+        try:
+            mutator = TextVerilogMutator(verilog_filename)
+        except verilog_text_editor.UnsupportedVerilogError:
+            return None
+    else:
+        mutator = VerilogMutator(verilog_filename, ast_cache_dir = ast_cache_dir, preprocessed_verilog = preprocessed_verilog)
+    return mutator.get_submodules(), mutator.get_default_scheduling_order(), pickle.dumps(mutator)
+
+def _mutate_module(pickled_mutator, input_verilog_filename, output_verilog_filename, num_rules_per_module, ast_cache_dir, use_text_mutator):
+    """Worker for add_scheduling_signals that adds the scheduling signals to a module.
+
+    The module is parsed again if pickled_mutator is None. num_rules_per_module
+    only has to contain the submodules of this module. Returns the number of
+    rules of the module (including the rules of its submodules)."""
+    if pickled_mutator is None:
+        mutator = _load_mutator(input_verilog_filename, ast_cache_dir, use_text_mutator)
+    else:
+        mutator = pickle.loads(pickled_mutator)
+    num_rules = mutator.expose_internal_scheduling_signals(num_rules_per_module = num_rules_per_module)
+    # expose_internal_scheduling_signals only makes changes that get_edited_verilog tracks
+    mutator.write_verilog(output_verilog_filename, splice = True)
+    return num_rules
+
+def _get_rule_names(scheduling_order, submodules, rule_names_per_module):
+    """Returns the names of the rules of a module (including the rules of its submodules)."""
+    submodules = dict(submodules)
+    full_module_rule_names = []
+    for sched_item in scheduling_order:
+        if sched_item.startswith('RL_'):
+            full_module_rule_names.append(sched_item)
+        elif sched_item.startswith('MODULE_'):
+            submodule_instance_name = sched_item[len('MODULE_'):]
+            submodule_type = submodules[submodule_instance_name]
+            if submodule_type not in rule_names_per_module:
+                # this submodule has no known rules
+                continue
+            full_module_rule_names += [submodule_instance_name + '__DOT__' + x for x in rule_names_per_module[submodule_type]]
+        else:
+            raise Exception('Unsupported scheuling item type')
+    return full_module_rule_names
+
+def _load_scheduling_cache(out_dir):
+    try:
+        with open(os.path.join(out_dir, scheduling_cache_name)) as f:
+            cache = json.load(f)
+    except Exception:
+        # missing or corrupted caches are treated as empty
+        return {}
+    if cache.get('version') != scheduling_cache_version:
+        return {}
+    return cache['modules']
+
+def _write_scheduling_cache(out_dir, modules):
+    filename = os.path.join(out_dir, scheduling_cache_name)
+    # write to a temporary file first so an interrupted write doesn't corrupt the cache
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump({'version' : scheduling_cache_version, 'modules' : modules}, f)
+    os.replace(tmp_filename, filename)
+
+def add_scheduling_signals(bsc_vdir, out_dir, jobs = None, ast_cache_dir = None, use_text_mutator = True, use_cache = False):
     """
     Stand-alone function for adding scheduling signals to a directory of bsc-generated Verilog.
 
-    Results are written to the out_dir folder.
+    Results are written to the out_dir folder. The modules are parsed by a
+    pool of jobs worker processes (one per CPU if jobs is None). Then they are
+    mutated level by level from the leaf modules to the top modules, and the
+    modules in each level are mutated in parallel. The output is the same as
+    mutating the modules one at a time. If ast_cache_dir is not None, it is
+    used to cache the parsed modules (see load_verilog_file).
+
+    If use_text_mutator is True, modules are edited with TextVerilogMutator
+    when possible, which doesn't have to parse them. Otherwise all the
+    modules are parsed by pyverilog and edited by VerilogMutator. The modules
+    that have to be parsed are preprocessed by a single iverilog invocation
+    (see preprocess_verilog_files) and share a parser per worker process.
+
+    If use_cache is True, the modules written to out_dir are recorded in
+    out_dir/bluespecrepl_scheduling_signals.json along with the hash of their
+    input verilog and the numbers of rules of their submodules. Modules for
+    which both are unchanged since the last call are not parsed or mutated
+    again, so after a change to one module only that module and the modules
+    above it whose submodules' numbers of rules changed are mutated.
+
+    Returns a dictionary mapping each module to the names of its rules
+    (including the rules of its submodules) in the order of its scheduling
+    signals.
     """
     if not os.path.isdir(bsc_vdir):
         raise Exception('bsc_vdir must be a directory')
@@ -17,48 +332,102 @@ def add_scheduling_signals(bsc_vdir, out_dir):
     base_verilog_filenames = { filename[:-len('.v')] : filename for filename in os.listdir(bsc_vdir) if os.path.isfile(os.path.join(bsc_vdir, filename)) and filename.endswith('.v') }
     input_verilog_filenames = { module : os.path.join(bsc_vdir, filename) for module, filename in base_verilog_filenames.items() }
     output_verilog_filenames = { module : os.path.join(out_dir, filename) for module, filename in base_verilog_filenames.items() }
-    mutators = { module : VerilogMutator(verilog_filename) for module, verilog_filename in input_verilog_filenames.items() }
-    submodules = { module : mutator.get_submodules() for module, mutator in mutators.items() }
-    modules_to_mutate = list(base_verilog_filenames.keys())
-    num_rules_per_module = {}
-    rule_names_per_module = {}
-    while len(modules_to_mutate) != 0:
-        module_to_mutate = None
-        for module in modules_to_mutate:
-            good_candidate = True
-            for instance_name, instance_module in submodules[module]:
-                if instance_module in modules_to_mutate:
-                    good_candidate = False
-            if good_candidate:
-                module_to_mutate = module
-                break
-        if module_to_mutate is not None:
-            mutator = mutators[module_to_mutate]
-            num_rules = mutator.expose_internal_scheduling_signals(num_rules_per_module = num_rules_per_module)
-            mutator.write_verilog(output_verilog_filenames[module])
-            rules = mutator.get_rules_in_scheduling_order()
-            num_rules_per_module[module_to_mutate] = num_rules
-            # get list of rule names
-            full_module_rule_names = []
-            for sched_item in mutator.get_default_scheduling_order():
-                if sched_item.startswith('RL_'):
-                    full_module_rule_names.append(sched_item)
-                elif sched_item.startswith('MODULE_'):
-                    submodule_instance_name = sched_item[len('MODULE_'):]
-                    submodule_type = [y for x, y in submodules[module_to_mutate] if x == submodule_instance_name][0]
-                    if submodule_type not in rule_names_per_module:
-                        # this submodule has no known rules
+    modules = sorted(base_verilog_filenames.keys())
+    # module -> dictionary of the input hash, submodules, scheduling order,
+    # key, number of rules, and output hash of the module
+    cached_modules = {}
+    input_hashes = {}
+    if use_cache:
+        cached_modules = _load_scheduling_cache(out_dir)
+        input_hashes = { module : buildcache.hash_file(input_verilog_filenames[module]) for module in modules }
+    def is_input_cached(module):
+        return module in cached_modules and cached_modules[module]['input_hash'] == input_hashes[module]
+    if jobs is None:
+        jobs = os.cpu_count()
+    # modules with changed verilog have to be parsed to find their submodules
+    modules_to_parse = [module for module in modules if not is_input_cached(module)]
+    if not use_text_mutator and len(modules_to_parse) != 0:
+        # construct the parser before starting the worker processes so forked workers share it.
+        # With the text mutator, it is only constructed by the workers that need it.
+        get_verilog_parser()
+    with concurrent.futures.ProcessPoolExecutor(max_workers = max(1, min(jobs, len(modules)))) as executor:
+        parsed_modules = {}
+        if use_text_mutator:
+            parsed_modules = dict(zip(modules_to_parse, executor.map(_parse_module,
+                    [input_verilog_filenames[module] for module in modules_to_parse],
+                    [ast_cache_dir] * len(modules_to_parse),
+                    [True] * len(modules_to_parse))))
+            # the modules that TextVerilogMutator doesn't support have to be parsed by pyverilog
+            modules_to_parse = [module for module in modules_to_parse if parsed_modules[module] is None]
+        # the modules are preprocessed together, and the ASTs in the AST cache are found by their preprocessed source
+        preprocessed_verilog = {}
+        if len(modules_to_parse) != 0:
+            preprocessed_verilog = dict(zip(modules_to_parse, preprocess_verilog_files([input_verilog_filenames[module] for module in modules_to_parse])))
+        parsed_modules.update(zip(modules_to_parse, executor.map(_parse_module,
+                [input_verilog_filenames[module] for module in modules_to_parse],
+                [ast_cache_dir] * len(modules_to_parse),
+                [False] * len(modules_to_parse),
+                [preprocessed_verilog[module] for module in modules_to_parse])))
+        del preprocessed_verilog
+        # module -> (submodules, scheduling order)
+        module_info = {}
+        for module in modules:
+            if module in parsed_modules:
+                module_info[module] = parsed_modules[module][:2]
+            else:
+                module_info[module] = ([tuple(x) for x in cached_modules[module]['submodules']], cached_modules[module]['scheduling_order'])
+        # only submodules with verilog in bsc_vdir have to be mutated first
+        submodules = { module : set(instance_module for _, instance_module in module_info[module][0] if instance_module in input_verilog_filenames) for module in modules }
+        # modules that instantiate each module and the number of their submodules that still have to be mutated
+        parent_modules = { module : [] for module in modules }
+        num_remaining_submodules = { module : len(submodules[module]) for module in modules }
+        for module in modules:
+            for submodule in submodules[module]:
+                parent_modules[submodule].append(module)
+        num_rules_per_module = {}
+        rule_names_per_module = {}
+        new_cached_modules = {}
+        level = [module for module in modules if num_remaining_submodules[module] == 0]
+        while len(level) != 0:
+            futures = {}
+            keys = {}
+            for module in level:
+                submodule_num_rules = { x : num_rules_per_module[x] for x in submodules[module] }
+                if use_cache:
+                    keys[module] = buildcache.hash_data({
+                            'input_hash' : input_hashes[module],
+                            'submodule_num_rules' : submodule_num_rules,
+                            'use_text_mutator' : use_text_mutator })
+                    entry = cached_modules.get(module)
+                    if (is_input_cached(module) and entry['key'] == keys[module] and os.path.isfile(output_verilog_filenames[module])
+                            and buildcache.hash_file(output_verilog_filenames[module]) == entry['output_hash']):
+                        # the output from the last call is still up to date
+                        num_rules_per_module[module] = entry['num_rules']
                         continue
-                    submodule_rule_names = [submodule_instance_name + '__DOT__' + x for x in rule_names_per_module[submodule_type]]
-                    full_module_rule_names += submodule_rule_names
-                else:
-                    raise Exception('Unsupported scheuling item type')
-            rule_names_per_module[module_to_mutate] = full_module_rule_names
-            rule_order = mutator.get_default_scheduling_order()
-            modules_to_mutate.remove(module_to_mutate)
-        else:
+                pickled_mutator = parsed_modules.pop(module)[2] if module in parsed_modules else None
+                futures[module] = executor.submit(_mutate_module, pickled_mutator, input_verilog_filenames[module], output_verilog_filenames[module], submodule_num_rules, ast_cache_dir, use_text_mutator)
+            next_level = []
+            for module in level:
+                if module in futures:
+                    num_rules_per_module[module] = futures[module].result()
+                rule_names_per_module[module] = _get_rule_names(module_info[module][1], module_info[module][0], rule_names_per_module)
+                if use_cache:
+                    new_cached_modules[module] = {
+                            'input_hash' : input_hashes[module],
+                            'submodules' : module_info[module][0],
+                            'scheduling_order' : module_info[module][1],
+                            'key' : keys[module],
+                            'num_rules' : num_rules_per_module[module],
+                            'output_hash' : buildcache.hash_file(output_verilog_filenames[module]) }
+                for parent_module in parent_modules[module]:
+                    num_remaining_submodules[parent_module] -= 1
+                    if num_remaining_submodules[parent_module] == 0:
+                        next_level.append(parent_module)
+            level = sorted(next_level)
+        if len(rule_names_per_module) != len(modules):
             raise Exception("Adding scheduling control failed. Can't find next module to mutate")
-    # get rule names
+    if use_cache:
+        _write_scheduling_cache(out_dir, new_cached_modules)
     return rule_names_per_module
 
 class CustomizedASTCodeGenerator(ASTCodeGenerator):
@@ -71,10 +440,14 @@ class CustomizedASTCodeGenerator(ASTCodeGenerator):
         return '\n'.join([self.visit(item) for item in node.list])
 
 class VerilogMutator:
-    def __init__(self, verilog_file_path):
+    def __init__(self, verilog_file_path, ast_cache_dir = None, preprocessed_verilog = None):
         if not os.path.isfile(verilog_file_path):
             raise ValueError(verilog_file_path + ' is not a valid file')
-        self.ast_root, self.directives = parse([verilog_file_path], preprocess_include = [], preprocess_define = [])
+        # see load_verilog_file for ast_cache_dir and preprocessed_verilog
+        self.ast_root, self.directives = load_verilog_file(verilog_file_path, ast_cache_dir, preprocessed_verilog)
+        # the original source is kept so write_verilog only has to generate the changes to it
+        with open(verilog_file_path) as f:
+            self.source = f.read()
         self.codegen = CustomizedASTCodeGenerator()
         definitions = self.ast_root.description.definitions
         self.module = None
@@ -87,6 +460,75 @@ class VerilogMutator:
         if self.module is None:
             raise ValueError(verilog_file_path + ' has no module defined within it')
         # self.module has name, paramlist, portlist, and items
+        self._build_index()
+        # mutations buffered by start_batch until commit_batch is called
+        self.pending_mutations = None
+        # (kind, ...) tuples for the nodes added by the mutator methods in the order they were added
+        self.added_nodes = []
+        # signal name -> (assign, right, var) for the indexed assigns in the original source,
+        # so get_edited_verilog can find the ones whose right-hand side has been replaced
+        self.original_assign_rhs = { name : (assign, assign.right, assign.right.var) for name, assign in self.assigns_by_name.items() }
+
+    def __getstate__(self):
+        if self.pending_mutations is not None:
+            raise ValueError('VerilogMutator can not be pickled while a batch is in progress')
+        # the indexes are rebuilt when unpickling since they depend on the ids of the nodes
+        return { 'ast_root' : self.ast_root, 'directives' : self.directives, 'module' : self.module, 'source' : self.source,
+                'added_nodes' : self.added_nodes, 'original_assign_rhs' : self.original_assign_rhs }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.codegen = CustomizedASTCodeGenerator()
+        self._build_index()
+        self.pending_mutations = None
+
+    def _build_index(self):
+        '''Indexes the AST in a single traversal so lookups don't have to search the whole AST'''
+        # all nodes in preorder, followed by nodes added by mutations in the order they were added
+        self.nodes = []
+        # exact node type -> list of nodes in the same order as self.nodes
+        self.nodes_by_type = {}
+        # declared signal name -> list of declared items (e.g. Input and Wire) with that name
+        self.decls_by_name = {}
+        # instance name -> Instance node
+        self.instances_by_name = {}
+        # ids of indexed nodes (pyverilog nodes define __eq__, so they can't be put in a set directly)
+        self.indexed_node_ids = set()
+        self._index_subtree(self.ast_root)
+        # assigned signal name -> first continuous assignment to it in self.module.items
+        self.assigns_by_name = {}
+        for item in self.module.items:
+            if isinstance(item, ast.Assign):
+                self._index_assign(item)
+
+    def _index_assign(self, assign):
+        '''Adds a continuous assignment to assigns_by_name unless its signal already has one'''
+        if isinstance(assign.left.var, ast.Identifier) and assign.left.var.name not in self.assigns_by_name:
+            self.assigns_by_name[assign.left.var.name] = assign
+
+    def _index_subtree(self, root):
+        '''Adds root and all of its descendants that aren't indexed yet to the indexes'''
+        stack = [root]
+        while len(stack) != 0:
+            node = stack.pop()
+            if id(node) in self.indexed_node_ids:
+                # descendants of indexed nodes are already indexed too
+                continue
+            self.indexed_node_ids.add(id(node))
+            self.nodes.append(node)
+            node_type = type(node)
+            if node_type not in self.nodes_by_type:
+                self.nodes_by_type[node_type] = []
+            self.nodes_by_type[node_type].append(node)
+            if node_type == ast.Decl:
+                for item in node.list:
+                    if item.name not in self.decls_by_name:
+                        self.decls_by_name[item.name] = []
+                    self.decls_by_name[item.name].append(item)
+            elif node_type == ast.Instance:
+                self.instances_by_name[node.name] = node
+            # push the children in reverse so they are visited in order
+            stack.extend(reversed(node.children()))
 
     def get_ast(self):
         '''Get the abstract syntax tree in a human-readable text format'''
@@ -101,30 +543,88 @@ class VerilogMutator:
         '''Formats the modified verilog AST as verilog source stored in a str'''
         return self.codegen.visit(self.ast_root)
 
-    def write_verilog(self, output_verilog_filename):
-        '''Writes the modified verilog to the specified file'''
+    def get_edited_verilog(self):
+        '''Splices the changes to the verilog AST into the original verilog source
+
+        Only the nodes added by the mutator methods and the right-hand sides
+        of existing continuous assignments that have been replaced are
+        formatted as verilog, and they are put in the same places as in
+        get_verilog. The rest of the source is kept as it is, which keeps the
+        line numbers of the original items close to the original ones. Other
+        changes to the AST are not seen by this method, so get_verilog has to
+        be used after making them. If the original source can't be edited by
+        VerilogTextEditor, this falls back to get_verilog.'''
+        try:
+            editor = verilog_text_editor.VerilogTextEditor(self.source)
+        except verilog_text_editor.UnsupportedVerilogError:
+            return self.get_verilog()
+        for name, (assign, right, var) in self.original_assign_rhs.items():
+            if assign.right is not right or right.var is not var:
+                if name not in editor.assign_rhs_spans:
+                    return self.get_verilog()
+                editor.replace_assign_rhs(name, ' ' + self.codegen.visit(assign.right) + ' ')
+        for added_node in self.added_nodes:
+            kind = added_node[0]
+            if kind == 'decls':
+                for line in self.codegen.visit(added_node[1]).splitlines():
+                    editor.add_decl(line)
+            elif kind == 'assigns':
+                assign = added_node[1]
+                editor.add_assign(self.codegen.visit(assign.left), self.codegen.visit(assign.right))
+            elif kind == 'ports':
+                editor.add_ports([port.name for port in added_node[1]])
+            else:
+                instance_name, port_arg = added_node[1:]
+                editor.add_port_arg(instance_name, port_arg.portname, self.codegen.visit(port_arg.argname))
+        return editor.get_text()
+
+    def write_verilog(self, output_verilog_filename, splice = False):
+        '''Writes the modified verilog to the specified file
+
+        By default the verilog is regenerated from the AST (see get_verilog).
+        If splice is True, the file contains the original verilog source with
+        the changes spliced into it (see get_edited_verilog), which is only
+        correct if the AST was changed through the mutator methods.'''
         with open(output_verilog_filename, 'w') as f:
-            f.write( self.get_verilog() )
+            if splice:
+                f.write( self.get_edited_verilog() )
+            else:
+                f.write( self.get_verilog() )
 
     def get_nodes_by_type(self, node_type, search_root_node = None, nested = True):
-        '''Constructs a list of AST nodes of a given type'''
-        if search_root_node == None:
-            search_root_node = self.ast_root
-        if isinstance(search_root_node, node_type):
-            if not nested:
-                return [search_root_node]
+        '''Constructs a list of AST nodes of a given type
+
+        If nested is False, nodes inside other nodes of the given type are
+        skipped.'''
+        if (search_root_node is None or search_root_node is self.ast_root) and nested:
+            # use the index
+            matching_types = [t for t in self.nodes_by_type if issubclass(t, node_type)]
+            if len(matching_types) == 0:
+                return []
+            elif len(matching_types) == 1:
+                return list(self.nodes_by_type[matching_types[0]])
             else:
-                return sum(list(map(lambda x: self.get_nodes_by_type(node_type, x, nested), search_root_node.children())), [search_root_node])
-        else:
-            return sum(list(map(lambda x: self.get_nodes_by_type(node_type, x, nested), search_root_node.children())), [])
+                return [node for node in self.nodes if isinstance(node, node_type)]
+        if search_root_node is None:
+            search_root_node = self.ast_root
+        nodes = []
+        stack = [search_root_node]
+        while len(stack) != 0:
+            node = stack.pop()
+            if isinstance(node, node_type):
+                nodes.append(node)
+                if not nested:
+                    continue
+            stack.extend(reversed(node.children()))
+        return nodes
 
     def get_instance(self, name):
         '''Gets AST nodes for module instances by name'''
-        instances = self.get_nodes_by_type(ast.Instance)
-        for instance in instances:
-            if instance.name == name:
-                return instance
-        return None
+        return self.instances_by_name.get(name)
+
+    def get_decls(self, name):
+        '''Gets the declared items (e.g. Input and Wire nodes) for a signal name'''
+        return list(self.decls_by_name.get(name, []))
 
     def get_decl_names(self, node_type = None):
         '''Gets names of declared signals (restricted to a specific type if node_type is provided)'''
@@ -154,6 +654,11 @@ class VerilogMutator:
             new_decls.append(node_type(name, width))
         # wrap them in a Decl node
         decl = ast.Decl(new_decls)
+        self._index_subtree(decl)
+        self.added_nodes.append(('decls', decl))
+        if self.pending_mutations is not None:
+            self._add_pending_item('decls', decl)
+            return
         # find index to insert at
         insert_index = 0
         for i in range(len(self.module.items)):
@@ -168,15 +673,20 @@ class VerilogMutator:
 
     def get_assign(self, name):
         '''Get assignment for a specific signal'''
-        # look through items in module for assignment matching requested name
-        for item in self.module.items:
-            if isinstance(item, ast.Assign) and isinstance(item.left.var, ast.Identifier) and item.left.var.name == name:
-                return item
-        raise ValueError('No assignment found for ' + name)
+        if name not in self.assigns_by_name:
+            raise ValueError('No assignment found for ' + name)
+        return self.assigns_by_name[name]
 
     def add_assign(self, lhs, rhs):
         '''Adds a new assignment'''
         assign = ast.Assign(ast.Lvalue(ast.Identifier(lhs)), ast.Rvalue(rhs))
+        self._index_subtree(assign)
+        # new assigns go after the existing ones, so an existing assign to lhs stays first
+        self._index_assign(assign)
+        self.added_nodes.append(('assigns', assign))
+        if self.pending_mutations is not None:
+            self._add_pending_item('assigns', assign)
+            return
         # find index to insert at
         insert_index = 0
         for i in range(len(self.module.items)):
@@ -192,8 +702,82 @@ class VerilogMutator:
         new_ports = []
         for name in names:
             new_ports.append(ast.Port(name, None, None))
+        for port in new_ports:
+            self._index_subtree(port)
+        self.added_nodes.append(('ports', new_ports))
+        if self.pending_mutations is not None:
+            self.pending_mutations['ports'].extend(new_ports)
+            return
         self.module.portlist.ports = self.module.portlist.ports + tuple(new_ports)
 
+    def add_port_arg(self, instance_name, port_name, signal_name):
+        '''Connects signal_name to the port port_name of a module instance'''
+        instance = self.get_instance(instance_name)
+        port_arg = ast.PortArg(port_name, ast.Identifier(signal_name))
+        self._index_subtree(port_arg)
+        self.added_nodes.append(('port_args', instance_name, port_arg))
+        if self.pending_mutations is not None:
+            if instance_name not in self.pending_mutations['port_args']:
+                self.pending_mutations['port_args'][instance_name] = []
+            self.pending_mutations['port_args'][instance_name].append(port_arg)
+            return
+        instance.portlist += (port_arg,)
+
+    def start_batch(self):
+        '''Starts buffering new declarations, assigns, ports, and port connections
+
+        The buffered mutations are applied together by commit_batch, which
+        rebuilds the module items only once. The result is the same as making
+        the mutations one at a time.'''
+        if self.pending_mutations is not None:
+            raise ValueError('VerilogMutator.start_batch() called while a batch is already in progress')
+        self.pending_mutations = {'decls' : [], 'assigns' : [], 'ports' : [], 'port_args' : {}, 'first_added' : []}
+
+    def _add_pending_item(self, kind, item):
+        if kind not in self.pending_mutations['first_added']:
+            self.pending_mutations['first_added'].append(kind)
+        self.pending_mutations[kind].append(item)
+
+    def commit_batch(self):
+        '''Applies the mutations buffered since start_batch'''
+        if self.pending_mutations is None:
+            raise ValueError('VerilogMutator.commit_batch() called without a batch in progress')
+        pending = self.pending_mutations
+        self.pending_mutations = None
+        items = self.module.items
+        # new decls go after the last Decl and new assigns go after the last Assign
+        insert_indexes = {'decls' : 0, 'assigns' : 0}
+        for i in range(len(items)):
+            if isinstance(items[i], ast.Decl):
+                insert_indexes['decls'] = i + 1
+            elif isinstance(items[i], ast.Assign):
+                insert_indexes['assigns'] = i + 1
+        # when both insertion points are equal, adding items one at a time puts
+        # the kind of item that was added first after the other kind
+        kinds = sorted(reversed(pending['first_added']), key = lambda kind: insert_indexes[kind])
+        new_items = []
+        start = 0
+        for kind in kinds:
+            new_items.extend(items[start:insert_indexes[kind]])
+            new_items.extend(pending[kind])
+            start = insert_indexes[kind]
+        new_items.extend(items[start:])
+        self.module.items = tuple(new_items)
+        if len(pending['ports']) != 0:
+            self.module.portlist.ports = self.module.portlist.ports + tuple(pending['ports'])
+        for instance_name, port_args in pending['port_args'].items():
+            instance = self.get_instance(instance_name)
+            instance.portlist += tuple(port_args)
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''Context manager that buffers the mutations made within it and applies them at the end'''
+        self.start_batch()
+        try:
+            yield self
+        finally:
+            self.commit_batch()
+
     def get_inputs(self):
         """Returns list of tuples of input name and width."""
         inputs = []
@@ -244,106 +828,163 @@ class VerilogMutator:
     def expose_internal_scheduling_signals(self, num_rules_per_module = None, scheduling_order = None, add_force_fire = False):
         # if schedule isn't provided, assume rules first then modules
         if scheduling_order is None:
-            scheduling_order = ['RL_' + x for x in self.get_rules_in_scheduling_order()] + ['MODULE_' + x for x, y in self.get_submodules()]
-        instance_to_module = {x: y for x, y in self.get_submodules()}
+            scheduling_order = self.get_default_scheduling_order()
+        total_num_bits, layout = get_scheduling_signal_layout(scheduling_order, self.get_submodules(), num_rules_per_module)
         can_fires = []
         will_fires = []
-        # compute total number of bits
-        total_num_bits = 0
-        for name in scheduling_order:
-            if name.startswith('RL_'):
-                total_num_bits += 1
-            elif name.startswith('MODULE_'):
-                instance_name = name[len('MODULE_'):]
-                module_name = instance_to_module[instance_name]
-                if num_rules_per_module is None:
-                    continue
-                if module_name not in num_rules_per_module:
-                    continue
-                num_submodule_rules = num_rules_per_module[module_name]
-                if num_submodule_rules == 0:
-                    continue
-                total_num_bits += num_submodule_rules
-        # now add the signals
-        curr_bit_index = 0
-        for name in scheduling_order:
-            if name.startswith('RL_'):
-                self.add_decls('BLOCK_FIRE_' + name, ast.Wire)
-                if add_force_fire:
-                    self.add_decls('FORCE_FIRE_' + name, ast.Wire)
-                # definition of BLOCK_FIRE and FORCE_FILE
-                assign = self.get_assign('WILL_FIRE_' + name)
-                if add_force_fire:
-                    new_rhs = ast.Or(ast.Identifier('FORCE_FIRE_' + name), ast.And(ast.Unot(ast.Identifier('BLOCK_FIRE_' + name)), assign.right.var))
-                else:
-                    new_rhs = ast.And(ast.Unot(ast.Identifier('BLOCK_FIRE_' + name)), assign.right.var)
-                assign.right.var = new_rhs
-                # definition of BLOCK_FIRE_* and FORCE_FIRE_* signals from top-level BLOCK_FIRE and FORCE_FIRE
-                if total_num_bits == 1:
-                    self.add_assign('BLOCK_FIRE_' + name, ast.Identifier('BLOCK_FIRE'))
+        # the module items are rebuilt once at the end of the batch instead of once per new item
+        with self.batch():
+            # now add the signals
+            for name, lsb, num_bits in layout:
+                if name.startswith('RL_'):
+                    self.add_decls('BLOCK_FIRE_' + name, ast.Wire)
                     if add_force_fire:
-                        self.add_assign('FORCE_FIRE_' + name, ast.Identifier('FORCE_FIRE'))
-                else:
-                    self.add_assign('BLOCK_FIRE_' + name, ast.Partselect(ast.Identifier('BLOCK_FIRE'), ast.IntConst(curr_bit_index), ast.IntConst(curr_bit_index)))
+                        self.add_decls('FORCE_FIRE_' + name, ast.Wire)
+                    # definition of BLOCK_FIRE and FORCE_FILE
+                    assign = self.get_assign('WILL_FIRE_' + name)
                     if add_force_fire:
-                        self.add_assign('FORCE_FIRE_' + name, ast.Partselect(ast.Identifier('FORCE_FIRE'), ast.IntConst(curr_bit_index), ast.IntConst(curr_bit_index)))
-                curr_bit_index += 1
+                        new_rhs = ast.Or(ast.Identifier('FORCE_FIRE_' + name), ast.And(ast.Unot(ast.Identifier('BLOCK_FIRE_' + name)), assign.right.var))
+                    else:
+                        new_rhs = ast.And(ast.Unot(ast.Identifier('BLOCK_FIRE_' + name)), assign.right.var)
+                    assign.right.var = new_rhs
+                    self._index_subtree(new_rhs)
+                    # definition of BLOCK_FIRE_* and FORCE_FIRE_* signals from top-level BLOCK_FIRE and FORCE_FIRE
+                    if total_num_bits == 1:
+                        self.add_assign('BLOCK_FIRE_' + name, ast.Identifier('BLOCK_FIRE'))
+                        if add_force_fire:
+                            self.add_assign('FORCE_FIRE_' + name, ast.Identifier('FORCE_FIRE'))
+                    else:
+                        self.add_assign('BLOCK_FIRE_' + name, ast.Partselect(ast.Identifier('BLOCK_FIRE'), ast.IntConst(lsb), ast.IntConst(lsb)))
+                        if add_force_fire:
+                            self.add_assign('FORCE_FIRE_' + name, ast.Partselect(ast.Identifier('FORCE_FIRE'), ast.IntConst(lsb), ast.IntConst(lsb)))
+                else:
+                    instance_name = name[len('MODULE_'):]
+                    for signal_type in ['CAN_FIRE', 'WILL_FIRE', 'BLOCK_FIRE', 'FORCE_FIRE']:
+                        if signal_type == 'FORCE_FIRE' and not add_force_fire:
+                            continue
+                        # declarations of all FIRE signals for the submodule
+                        self.add_decls(signal_type + '_' + name, ast.Wire, width = num_bits)
+                        # connection of all FIRE signals to the submodule
+                        # this assumes the submodule has ports named CAN_FIRE, WILL_FIRE, BLOCK_FIRE, and if add_force_fire is true, FORCE_FIRE
+                        self.add_port_arg(instance_name, signal_type, signal_type + '_' + name)
+                    # assignments of BLOCK_FIRE_* and FORCE_FIRE_* signals from top-level BLOCK_FIRE and FORCE_FIRE
+                    msb = lsb + num_bits - 1
+                    if total_num_bits == 1:
+                        self.add_assign('BLOCK_FIRE_' + name, ast.Identifier('BLOCK_FIRE'))
+                        if add_force_fire:
+                            self.add_assign('FORCE_FIRE_' + name, ast.Identifier('FORCE_FIRE'))
+                    else:
+                        self.add_assign('BLOCK_FIRE_' + name, ast.Partselect(ast.Identifier('BLOCK_FIRE'), ast.IntConst(msb), ast.IntConst(lsb)))
+                        if add_force_fire:
+                            self.add_assign('FORCE_FIRE_' + name, ast.Partselect(ast.Identifier('FORCE_FIRE'), ast.IntConst(msb), ast.IntConst(lsb)))
                 can_fires.append(ast.Identifier('CAN_FIRE_' + name))
                 will_fires.append(ast.Identifier('WILL_FIRE_' + name))
-            elif name.startswith('MODULE_'):
+
+            if total_num_bits != 0:
+                # new ports
+                self.add_ports(['CAN_FIRE', 'WILL_FIRE', 'BLOCK_FIRE'])
+                if add_force_fire:
+                    self.add_ports(['FORCE_FIRE'])
+                self.add_decls('CAN_FIRE', ast.Output, width = total_num_bits)
+                self.add_decls('WILL_FIRE', ast.Output, width = total_num_bits)
+                self.add_decls('BLOCK_FIRE', ast.Input, width = total_num_bits)
+                if add_force_fire:
+                    self.add_decls('FORCE_FIRE', ast.Input, width = total_num_bits)
+                self.add_decls('CAN_FIRE', ast.Wire, width = total_num_bits)
+                self.add_decls('WILL_FIRE', ast.Wire, width = total_num_bits)
+                # connect CAN_FIRE and WILL_FIRE
+                can_fires.reverse()
+                will_fires.reverse()
+                self.add_assign('CAN_FIRE', ast.Concat(can_fires))
+                self.add_assign('WILL_FIRE', ast.Concat(will_fires))
+
+        return total_num_bits
+
+class TextVerilogMutator:
+    '''Adds scheduling signals to bsc-generated verilog without parsing it
+
+    The new signals are spliced into the verilog text by VerilogTextEditor,
+    which is much faster than parsing and regenerating large modules. The
+    signals have the same names, bit layout, and positions among the module
+    items as with VerilogMutator, and the rest of the text is left as it is.
+    Raises verilog_text_editor.UnsupportedVerilogError for verilog that
+    VerilogTextEditor doesn't recognize, in which case VerilogMutator has to
+    be used instead.'''
+    def __init__(self, verilog_file_path):
+        if not os.path.isfile(verilog_file_path):
+            raise ValueError(verilog_file_path + ' is not a valid file')
+        with open(verilog_file_path) as f:
+            self.editor = verilog_text_editor.VerilogTextEditor(f.read())
+
+    def get_verilog(self):
+        return self.editor.get_text()
+
+    def write_verilog(self, output_verilog_filename, splice = True):
+        # the text mutator always edits the original source, splice is only accepted for compatibility with VerilogMutator
+        with open(output_verilog_filename, 'w') as f:
+            f.write( self.get_verilog() )
+
+    def get_rules_in_scheduling_order(self):
+        # see VerilogMutator.get_rules_in_scheduling_order
+        prefix = 'CAN_FIRE_RL_'
+        return [name[len(prefix):] for name in self.editor.decl_names if name.startswith(prefix)]
+
+    def get_submodules(self):
+        return list(self.editor.submodules)
+
+    def get_default_scheduling_order(self):
+        return ['RL_' + x for x in self.get_rules_in_scheduling_order()] + ['MODULE_' + x for x, y in self.get_submodules()]
+
+    def expose_internal_scheduling_signals(self, num_rules_per_module = None, scheduling_order = None, add_force_fire = False):
+        '''Same as VerilogMutator.expose_internal_scheduling_signals'''
+        if scheduling_order is None:
+            scheduling_order = self.get_default_scheduling_order()
+        total_num_bits, layout = get_scheduling_signal_layout(scheduling_order, self.get_submodules(), num_rules_per_module)
+        def decl(node_type, name, width = 1):
+            if width == 1:
+                return '%s %s;' % (node_type, name)
+            return '%s [%d : 0] %s;' % (node_type, width - 1, name)
+        def select(signal, msb, lsb):
+            if total_num_bits == 1:
+                return signal
+            return '%s[%d : %d]' % (signal, msb, lsb)
+        editor = self.editor
+        # the signals are added in the same order as in VerilogMutator
+        for name, lsb, num_bits in layout:
+            if name.startswith('RL_'):
+                editor.add_decl(decl('wire', 'BLOCK_FIRE_' + name))
+                if add_force_fire:
+                    editor.add_decl(decl('wire', 'FORCE_FIRE_' + name))
+                new_rhs = '~BLOCK_FIRE_%s & (%s)' % (name, editor.get_assign_rhs('WILL_FIRE_' + name).strip())
+                if add_force_fire:
+                    new_rhs = 'FORCE_FIRE_%s | (%s)' % (name, new_rhs)
+                editor.replace_assign_rhs('WILL_FIRE_' + name, ' ' + new_rhs + ' ')
+                editor.add_assign('BLOCK_FIRE_' + name, select('BLOCK_FIRE', lsb, lsb))
+                if add_force_fire:
+                    editor.add_assign('FORCE_FIRE_' + name, select('FORCE_FIRE', lsb, lsb))
+            else:
                 instance_name = name[len('MODULE_'):]
-                module_name = instance_to_module[instance_name]
-                if num_rules_per_module is None:
-                    continue
-                if module_name not in num_rules_per_module:
-                    continue
-                num_submodule_rules = num_rules_per_module[module_name]
-                if num_submodule_rules == 0:
-                    continue
-                instance = self.get_instance(instance_name)
                 for signal_type in ['CAN_FIRE', 'WILL_FIRE', 'BLOCK_FIRE', 'FORCE_FIRE']:
                     if signal_type == 'FORCE_FIRE' and not add_force_fire:
                         continue
-                    # declarations of all FIRE signals for the submodule
-                    self.add_decls(signal_type + '_' + name, ast.Wire, width = num_submodule_rules)
-                    # connection of all FIRE signals to the submodule
-                    # this assumes the submodule has ports named CAN_FIRE, WILL_FIRE, BLOCK_FIRE, and if add_force_fire is true, FORCE_FIRE
-                    instance.portlist += (ast.PortArg(signal_type, ast.Identifier(signal_type + '_' + name)),)
-                # assignments of BLOCK_FIRE_* and FORCE_FIRE_* signals from top-level BLOCK_FIRE and FORCE_FIRE
-                lsb = curr_bit_index
-                msb = curr_bit_index + num_submodule_rules - 1
-                curr_bit_index += num_submodule_rules
-                if total_num_bits == 1:
-                    self.add_assign('BLOCK_FIRE_' + name, ast.Identifier('BLOCK_FIRE'))
-                    if add_force_fire:
-                        self.add_assign('FORCE_FIRE_' + name, ast.Identifier('FORCE_FIRE'))
-                else:
-                    self.add_assign('BLOCK_FIRE_' + name, ast.Partselect(ast.Identifier('BLOCK_FIRE'), ast.IntConst(msb), ast.IntConst(lsb)))
-                    if add_force_fire:
-                        self.add_assign('FORCE_FIRE_' + name, ast.Partselect(ast.Identifier('FORCE_FIRE'), ast.IntConst(msb), ast.IntConst(lsb)))
-                can_fires.append(ast.Identifier('CAN_FIRE_' + name))
-                will_fires.append(ast.Identifier('WILL_FIRE_' + name))
-            elif name.startswith('METH_'):
-                raise ValueError('"METH_" scheduling signals are not supported yet')
-            else:
-                raise ValueError('unexpected entry "%s" in scheduling_order' % name)
-
+                    editor.add_decl(decl('wire', signal_type + '_' + name, num_bits))
+                    editor.add_port_arg(instance_name, signal_type, signal_type + '_' + name)
+                msb = lsb + num_bits - 1
+                editor.add_assign('BLOCK_FIRE_' + name, select('BLOCK_FIRE', msb, lsb))
+                if add_force_fire:
+                    editor.add_assign('FORCE_FIRE_' + name, select('FORCE_FIRE', msb, lsb))
         if total_num_bits != 0:
-            # new ports
-            self.add_ports(['CAN_FIRE', 'WILL_FIRE', 'BLOCK_FIRE'])
+            editor.add_ports(['CAN_FIRE', 'WILL_FIRE', 'BLOCK_FIRE'])
             if add_force_fire:
-                self.add_ports(['FORCE_FIRE'])
-            self.add_decls('CAN_FIRE', ast.Output, width = total_num_bits)
-            self.add_decls('WILL_FIRE', ast.Output, width = total_num_bits)
-            self.add_decls('BLOCK_FIRE', ast.Input, width = total_num_bits)
+                editor.add_ports(['FORCE_FIRE'])
+            editor.add_decl(decl('output', 'CAN_FIRE', total_num_bits))
+            editor.add_decl(decl('output', 'WILL_FIRE', total_num_bits))
+            editor.add_decl(decl('input', 'BLOCK_FIRE', total_num_bits))
             if add_force_fire:
-                self.add_decls('FORCE_FIRE', ast.Input, width = total_num_bits)
-            self.add_decls('CAN_FIRE', ast.Wire, width = total_num_bits)
-            self.add_decls('WILL_FIRE', ast.Wire, width = total_num_bits)
-            # connect CAN_FIRE and WILL_FIRE
-            can_fires.reverse()
-            will_fires.reverse()
-            self.add_assign('CAN_FIRE', ast.Concat(can_fires))
-            self.add_assign('WILL_FIRE', ast.Concat(will_fires))
-
+                editor.add_decl(decl('input', 'FORCE_FIRE', total_num_bits))
+            editor.add_decl(decl('wire', 'CAN_FIRE', total_num_bits))
+            editor.add_decl(decl('wire', 'WILL_FIRE', total_num_bits))
+            # the most significant bit comes first in a concatenation
+            editor.add_assign('CAN_FIRE', '{%s}' % ', '.join('CAN_FIRE_' + name for name, _, _ in reversed(layout)))
+            editor.add_assign('WILL_FIRE', '{%s}' % ', '.join('WILL_FIRE_' + name for name, _, _ in reversed(layout)))
         return total_num_bits
@@ -0,0 +1,433 @@
+import re
+
+class UnsupportedVerilogError(Exception):
+    """Raised when verilog doesn't have the structure expected by VerilogTextEditor.
+
+    Verilog that raises this error can still be handled by VerilogMutator,
+    which parses the verilog instead."""
+    pass
+
+# tokens of verilog source that matter for finding the items of a module
+# (everything else, e.g. whitespace and operators, is skipped)
+_token_re = re.compile(r'''
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*")
+  | (?P<directive>`[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<number>[0-9][0-9_]*\s*'[sS]?[bBoOdDhH]\s*[0-9a-fA-FxXzZ?_]+|'[sS]?[bBoOdDhH]\s*[0-9a-fA-FxXzZ?_]+|[0-9][0-9_.]*)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*|\$[A-Za-z0-9_$]+)
+  | (?P<escaped>\\\S+)
+  | (?P<punct>[;,()\[\]{}#@=*])
+    ''', re.S | re.X)
+
+# directives that take the rest of their line as arguments
+_line_directives = {'`define', '`undef', '`timescale', '`default_nettype', '`resetall', '`celldefine', '`endcelldefine', '`line'}
+
+_decl_keywords = {'input', 'output', 'inout', 'wire', 'reg', 'integer', 'real', 'realtime', 'time', 'tri', 'tri0', 'tri1', 'triand', 'trior', 'trireg', 'wand', 'wor', 'supply0', 'supply1', 'event'}
+# words that can follow a declaration keyword before the declared names
+_decl_modifiers = _decl_keywords | {'signed', 'unsigned', 'scalared', 'vectored', 'small', 'medium', 'large'}
+_block_keywords = {'always', 'initial'}
+_subroutine_keywords = {'function' : 'endfunction', 'task' : 'endtask'}
+# words that start or end nested blocks within always and initial blocks
+_block_starts = {'begin', 'fork', 'case', 'casex', 'casez'}
+_block_ends = {'end', 'join', 'endcase'}
+_closing_brackets = {'(' : ')', '[' : ']', '{' : '}'}
+_keywords = _decl_modifiers | _block_keywords | _block_starts | _block_ends | set(_subroutine_keywords) | set(_subroutine_keywords.values()) | {
+        'module', 'macromodule', 'endmodule', 'assign', 'deassign', 'parameter', 'localparam', 'defparam', 'specparam', 'genvar',
+        'generate', 'endgenerate', 'specify', 'endspecify', 'primitive', 'endprimitive', 'table', 'endtable',
+        'if', 'else', 'for', 'while', 'repeat', 'forever', 'wait', 'disable', 'force', 'release', 'posedge', 'negedge', 'or',
+        'and', 'nand', 'nor', 'xor', 'xnor', 'not', 'buf', 'bufif0', 'bufif1', 'notif0', 'notif1', 'pullup', 'pulldown'}
+
+class _Tokens:
+    """Iterator over the (kind, text, start, end) tokens of verilog source.
+
+    Comments are skipped and conditional compilation directives are tracked
+    instead of being returned, so the tokens of both branches of an `ifdef
+    are returned. Other directives are returned as 'macro' tokens."""
+
+    def __init__(self, text, pos = 0):
+        self.text = text
+        self.pos = pos
+        self.peeked = None
+        # number of enclosing `ifdef blocks
+        self.ifdef_depth = 0
+        # number of conditional directives seen so far
+        self.num_conditionals = 0
+
+    def _read(self):
+        while True:
+            match = _token_re.search(self.text, self.pos)
+            if match is None:
+                return None
+            self.pos = match.end()
+            kind = match.lastgroup
+            text = match.group()
+            if kind == 'comment':
+                continue
+            if kind == 'directive':
+                if text in ('`ifdef', '`ifndef', '`elsif'):
+                    if text != '`elsif':
+                        self.ifdef_depth += 1
+                    self.num_conditionals += 1
+                    # skip the name of the macro
+                    if self._read() is None:
+                        raise UnsupportedVerilogError('missing macro name after ' + text)
+                    continue
+                elif text in ('`else', '`endif'):
+                    if text == '`endif':
+                        self.ifdef_depth -= 1
+                    self.num_conditionals += 1
+                    continue
+                elif text in _line_directives:
+                    # skip the rest of the line, including continued lines
+                    end = self.text.find('\n', self.pos)
+                    while end != -1 and (self.text[end - 1] == '\\' or self.text[end - 2:end] == '\\\r'):
+                        end = self.text.find('\n', end + 1)
+                    self.pos = len(self.text) if end == -1 else end
+                    continue
+                elif text == '`include':
+                    raise UnsupportedVerilogError('`include is not supported')
+                kind = 'macro'
+            return (kind, text, match.start(), match.end())
+
+    def next(self):
+        if self.peeked is not None:
+            token = self.peeked
+            self.peeked = None
+            return token
+        token = self._read()
+        if token is None:
+            raise UnsupportedVerilogError('unexpected end of file')
+        return token
+
+    def peek(self):
+        if self.peeked is None:
+            self.peeked = self._read()
+        return self.peeked
+
+    def expect(self, text):
+        token = self.next()
+        if token[1] != text:
+            raise UnsupportedVerilogError('expected "%s" but found "%s"' % (text, token[1]))
+        return token
+
+    def skip_group(self, open_token):
+        """Skips to the bracket closing open_token and returns the closing token."""
+        stack = [_closing_brackets[open_token[1]]]
+        while True:
+            token = self.next()
+            if token[1] in _closing_brackets:
+                stack.append(_closing_brackets[token[1]])
+            elif token[1] == stack[-1]:
+                stack.pop()
+                if len(stack) == 0:
+                    return token
+            elif token[1] in (')', ']', '}'):
+                raise UnsupportedVerilogError('unbalanced brackets')
+
+    def skip_to_semicolon(self):
+        """Skips to the next semicolon outside of brackets and returns it."""
+        while True:
+            token = self.next()
+            if token[1] == ';':
+                return token
+            elif token[1] in _closing_brackets:
+                self.skip_group(token)
+            elif token[0] == 'word' and token[1] in _keywords:
+                raise UnsupportedVerilogError('unexpected keyword "%s"' % token[1])
+
+class VerilogTextEditor:
+    """Splices new declarations, assigns, and connections into the text of a verilog module.
+
+    This understands the regular structure of the verilog generated by bsc
+    well enough to find the module's declarations, continuous assignments,
+    and submodule instances without parsing the expressions in them. Edits
+    are made in the same places as the corresponding VerilogMutator methods
+    make them in the AST: new declarations go after the last declaration, new
+    assigns go after the last assign, and new ports and port connections go
+    at the end of their lists. The rest of the text is left as it is.
+
+    Raises UnsupportedVerilogError for anything it doesn't recognize.
+
+    decl_names -- names of the declared signals in order
+    submodules -- list of (instance_name, module_name) tuples in order
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.module_name = None
+        self.decl_names = []
+        self.submodules = []
+        # lhs -> (start, end) of the rhs of the first assign to lhs
+        self.assign_rhs_spans = {}
+        # instance name -> (offset of the closing parenthesis, has connections)
+        self.port_arg_list_ends = {}
+        # offset of the closing parenthesis of the port list and whether there are ports
+        self.port_list_end = None
+        self.has_ports = False
+        # offsets right after the module header, the last declaration, and the last assign
+        self.header_end = None
+        self.decl_end = None
+        self.assign_end = None
+        self._scan()
+        # pending edits
+        self.new_decls = []
+        self.new_assigns = []
+        self.new_ports = []
+        self.new_port_args = {}
+        self.new_assign_rhs = {}
+        self.first_added = []
+
+    def _scan(self):
+        tokens = _Tokens(self.text)
+        while True:
+            token = tokens.peek()
+            if token is None:
+                break
+            tokens.next()
+            if token[0] == 'word' and token[1] in ('module', 'macromodule'):
+                if self.module_name is not None:
+                    raise UnsupportedVerilogError('more than one module')
+                if tokens.ifdef_depth != 0:
+                    raise UnsupportedVerilogError('module within `ifdef')
+                self._scan_module(tokens)
+        if self.module_name is None:
+            raise UnsupportedVerilogError('no module')
+
+    def _scan_module(self, tokens):
+        name = tokens.next()
+        if name[0] != 'word' or name[1] in _keywords:
+            raise UnsupportedVerilogError('unexpected module name "%s"' % name[1])
+        self.module_name = name[1]
+        token = tokens.next()
+        if token[1] == '#':
+            tokens.skip_group(tokens.expect('('))
+            token = tokens.next()
+        if token[1] != '(':
+            raise UnsupportedVerilogError('module without a port list')
+        while True:
+            token = tokens.next()
+            if token[1] == ')':
+                self.port_list_end = token[2]
+                break
+            elif token[1] in _decl_keywords:
+                raise UnsupportedVerilogError('ANSI-style port declarations are not supported')
+            elif token[1] in _closing_brackets:
+                tokens.skip_group(token)
+            elif token[1] != ',':
+                self.has_ports = True
+        self.header_end = tokens.expect(';')[3]
+        if tokens.ifdef_depth != 0:
+            raise UnsupportedVerilogError('module header within `ifdef')
+
+        while True:
+            token = tokens.next()
+            start_depth = tokens.ifdef_depth
+            start_conditionals = tokens.num_conditionals
+            kind = None
+            if token[0] == 'word' and token[1] == 'endmodule':
+                return
+            elif token[0] == 'word' and token[1] in _decl_keywords:
+                kind = 'decl'
+                self._scan_decl(tokens)
+            elif token[0] == 'word' and token[1] == 'assign':
+                kind = 'assign'
+                self._scan_assign(tokens)
+            elif token[0] == 'word' and token[1] in _block_keywords:
+                self._skip_statement(tokens)
+            elif token[0] == 'word' and token[1] in _subroutine_keywords:
+                self._skip_to(tokens, _subroutine_keywords[token[1]])
+            elif token[0] == 'word' and token[1] not in _keywords:
+                kind = 'instance'
+                self._scan_instance(tokens, token[1])
+            elif token[1] != ';':
+                raise UnsupportedVerilogError('unsupported module item starting with "%s"' % token[1])
+            if kind is not None and (start_depth != 0 or tokens.num_conditionals != start_conditionals):
+                raise UnsupportedVerilogError('%s within `ifdef' % kind)
+            if start_depth != tokens.ifdef_depth:
+                raise UnsupportedVerilogError('`ifdef within a module item')
+
+    def _scan_decl(self, tokens):
+        expect_name = True
+        while True:
+            token = tokens.next()
+            if token[1] == ';':
+                self.decl_end = token[3]
+                return
+            elif token[1] in _closing_brackets:
+                tokens.skip_group(token)
+            elif token[1] == ',':
+                expect_name = True
+            elif token[1] == '=':
+                raise UnsupportedVerilogError('declarations with assignments are not supported')
+            elif token[0] == 'word' and token[1] in _decl_modifiers:
+                continue
+            elif token[0] == 'word' and expect_name and token[1] not in _keywords:
+                self.decl_names.append(token[1])
+                expect_name = False
+            else:
+                raise UnsupportedVerilogError('unsupported declaration')
+
+    def _scan_assign(self, tokens):
+        lhs = tokens.next()
+        if lhs[0] != 'word' or lhs[1] in _keywords:
+            raise UnsupportedVerilogError('unsupported assign')
+        token = tokens.next()
+        if token[1] != '=':
+            # e.g. an assign to a bit select, which can't be looked up by name
+            lhs = None
+            while token[1] != '=':
+                if token[1] in _closing_brackets:
+                    tokens.skip_group(token)
+                elif token[1] == ';':
+                    raise UnsupportedVerilogError('unsupported assign')
+                token = tokens.next()
+        rhs_start = token[3]
+        while True:
+            token = tokens.next()
+            if token[1] == ';':
+                break
+            elif token[1] in _closing_brackets:
+                tokens.skip_group(token)
+            elif token[1] == ',':
+                raise UnsupportedVerilogError('assigns to multiple signals are not supported')
+            elif token[0] == 'word' and token[1] in _keywords:
+                raise UnsupportedVerilogError('unexpected keyword "%s"' % token[1])
+        if lhs is not None and lhs[1] not in self.assign_rhs_spans:
+            self.assign_rhs_spans[lhs[1]] = (rhs_start, token[2])
+        self.assign_end = token[3]
+
+    def _scan_instance(self, tokens, module_name):
+        token = tokens.next()
+        if token[1] == '#':
+            tokens.skip_group(tokens.expect('('))
+            token = tokens.next()
+        if token[0] != 'word' or token[1] in _keywords:
+            raise UnsupportedVerilogError('unsupported instance of "%s"' % module_name)
+        instance_name = token[1]
+        token = tokens.next()
+        if token[1] != '(':
+            raise UnsupportedVerilogError('unsupported instance "%s"' % instance_name)
+        has_connections = False
+        while True:
+            token = tokens.next()
+            if token[1] == ')':
+                break
+            has_connections = True
+            if token[1] in _closing_brackets:
+                tokens.skip_group(token)
+        tokens.expect(';')
+        if instance_name in self.port_arg_list_ends:
+            raise UnsupportedVerilogError('duplicate instance "%s"' % instance_name)
+        self.submodules.append((instance_name, module_name))
+        self.port_arg_list_ends[instance_name] = (token[2], has_connections)
+
+    def _skip_statement(self, tokens):
+        """Skips a procedural statement, e.g. the body of an always block."""
+        token = tokens.next()
+        if token[1] in ('@', '#'):
+            # event or delay control
+            token = tokens.next()
+            if token[1] == '(':
+                tokens.skip_group(token)
+            self._skip_statement(tokens)
+        elif token[1] in _block_starts:
+            depth = 1
+            while depth != 0:
+                token = tokens.next()
+                if token[0] == 'word' and token[1] in _block_starts:
+                    depth += 1
+                elif token[0] == 'word' and token[1] in _block_ends:
+                    depth -= 1
+        elif token[1] in ('if', 'for', 'while', 'repeat'):
+            tokens.skip_group(tokens.expect('('))
+            self._skip_statement(tokens)
+            if token[1] == 'if':
+                next_token = tokens.peek()
+                if next_token is not None and next_token[1] == 'else':
+                    tokens.next()
+                    self._skip_statement(tokens)
+        elif token[1] == 'forever':
+            self._skip_statement(tokens)
+        elif token[1] != ';':
+            if token[1] in _closing_brackets:
+                tokens.skip_group(token)
+            tokens.skip_to_semicolon()
+
+    def _skip_to(self, tokens, end_keyword):
+        while True:
+            token = tokens.next()
+            if token[0] == 'word' and token[1] == end_keyword:
+                return
+
+    def get_assign_rhs(self, lhs):
+        """Returns the text of the expression assigned to lhs (including the surrounding whitespace)."""
+        if lhs not in self.assign_rhs_spans:
+            raise ValueError('No assignment found for ' + lhs)
+        if lhs in self.new_assign_rhs:
+            return self.new_assign_rhs[lhs]
+        start, end = self.assign_rhs_spans[lhs]
+        return self.text[start:end]
+
+    def replace_assign_rhs(self, lhs, rhs):
+        """Replaces the expression assigned to lhs with the text rhs."""
+        if lhs not in self.assign_rhs_spans:
+            raise ValueError('No assignment found for ' + lhs)
+        self.new_assign_rhs[lhs] = rhs
+
+    def _add(self, kind, text):
+        if kind not in self.first_added:
+            self.first_added.append(kind)
+        getattr(self, 'new_' + kind).append(text)
+
+    def add_decl(self, decl):
+        """Adds the declaration statement decl (e.g. 'wire [3 : 0] x;')."""
+        self._add('decls', decl)
+
+    def add_assign(self, lhs, rhs):
+        """Adds an assignment of the expression rhs to the signal lhs."""
+        self._add('assigns', 'assign %s = %s ;' % (lhs, rhs))
+
+    def add_ports(self, names):
+        self.new_ports += names
+
+    def add_port_arg(self, instance_name, port_name, signal):
+        """Connects the expression signal to the port port_name of an instance."""
+        if instance_name not in self.port_arg_list_ends:
+            raise ValueError('No instance named ' + instance_name)
+        if instance_name not in self.new_port_args:
+            self.new_port_args[instance_name] = []
+        self.new_port_args[instance_name].append('.%s(%s)' % (port_name, signal))
+
+    def get_text(self):
+        """Returns the text with all the edits applied."""
+        # list of (start, end, text) edits
+        edits = []
+        for lhs, rhs in self.new_assign_rhs.items():
+            start, end = self.assign_rhs_spans[lhs]
+            edits.append((start, end, rhs))
+        if len(self.new_ports) != 0:
+            edits.append((self.port_list_end, self.port_list_end, (', ' if self.has_ports else '') + ', '.join(self.new_ports)))
+        for instance_name, port_args in self.new_port_args.items():
+            end, has_connections = self.port_arg_list_ends[instance_name]
+            edits.append((end, end, (', ' if has_connections else '') + ', '.join(port_args)))
+        insert_offsets = {
+                'decls' : self.header_end if self.decl_end is None else self.decl_end,
+                'assigns' : self.header_end if self.assign_end is None else self.assign_end }
+        # when both go to the same offset, the kind of item that was added
+        # first goes after the other kind, like in VerilogMutator
+        for kind in reversed(self.first_added):
+            items = getattr(self, 'new_' + kind)
+            offset = insert_offsets[kind]
+            edits.append((offset, offset, ''.join('\n  ' + item for item in items)))
+        # sort by position, keeping the order of edits at the same position
+        edits.sort(key = lambda edit: edit[0])
+        pieces = []
+        pos = 0
+        for start, end, text in edits:
+            if start < pos:
+                raise ValueError('overlapping edits')
+            pieces.append(self.text[pos:start])
+            pieces.append(text)
+            pos = end
+        pieces.append(self.text[pos:])
+        return ''.join(pieces)